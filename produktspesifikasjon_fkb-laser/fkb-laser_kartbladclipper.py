@@ -20,8 +20,9 @@
 ##     Installation
 ##     conda install -yc conda-forge numpy
 ##     conda install -yc conda-forge gdal
-##     conda install -yc conda-forge shapely
+##     conda install -yc conda-forge "shapely>=2"
 ##     conda install -yc conda-forge tqdm
+##     conda install -yc conda-forge laspy lazrs-python (valgfritt, for --single_pass)
 
 ##     Bruk
 ##     LAZ 1.2 retiler
@@ -41,9 +42,9 @@
 ##     - installer dependencies som listet over
 ##     - python ndh_kartbladklipper.py med argument som vist i prompt
 
-##     Alternativt oppsett fra Conda Env Fil (Testet OK 20200623 mot python v3.7)
+##     Alternativt oppsett fra Conda Env Fil (krever shapely 2)
 ##     - @ Anaconda Prompt
-##     - conda env create --name kartbladklipper --file kartbladklipper-env.txt
+##     - conda create --name kartbladklipper --override-channels -c conda-forge --file fkb-laser_kartbladclipper-env.txt
 
 ##     Tips for bruk
 ##     - Legg SOSI avgrensningfil + kartbladklipper folder nært root og uten æøå eller mellomrom
@@ -56,12 +57,17 @@
 
 
 import argparse
+from array import array
+import copy
+import hashlib
 import os
+import shutil
 import sys
 from concurrent import futures
-from collections import namedtuple, Counter
+from collections import namedtuple, Counter, OrderedDict
 import re
-from tempfile import NamedTemporaryFile
+import struct
+from tempfile import NamedTemporaryFile, gettempdir
 import queue
 from subprocess import Popen, PIPE
 import itertools
@@ -72,13 +78,33 @@ import logging
 import math
 
 import numpy as np
+import shapely
 from shapely.geometry import *
-from shapely.ops import polygonize_full
 from osgeo import ogr, osr
 import tqdm
+try:
+    import laspy
+except ImportError:
+    laspy = None
 
 
 FYSAK_PATH = 'C:\Fysak'
+## Folder of the parsed SOSI files, cached by file hash so repeated runs
+## against the same AOI skip the parsing. Bump SOSI_CACHE_VERSION when
+## the cached layout changes.
+SOSI_CACHE_DIR = os.path.join(gettempdir(), 'kartbladclipper_cache')
+SOSI_CACHE_VERSION = 3
+## Version of the cached bounds index of the input LAZ files, bumped
+## when its layout changes.
+BOUNDS_CACHE_VERSION = 1
+## Offset in the LAS public header of the max X, min X, max Y, min Y,
+## max Z, min Z doubles.
+LAS_BOUNDS_OFFSET = 179
+LAS_BOUNDS = struct.Struct('<6d')
+## Number of points read at a time, and maximum number of per kartblad
+## output files kept open at a time, by the single pass clipper.
+CHUNK_POINTS = 1000000
+MAX_OPEN_WRITERS = 64
 
 mko_template = """
 FysakVersjon >= K1.1
@@ -116,6 +142,13 @@ UTFØR
 ## Define namedtuple which will store the needed information for each
 ## kartblad.
 Kartblad = namedtuple('Kartblad', ['name', 'geometry', 'bounds'])
+## Define namedtuple which will store the content of a parsed SOSI
+## file: the header properties, the raw integer YX-coordinates of all
+## ".KURVE/.LINJE" features in one array with their start offsets, and
+## the ".KURVE" references of the ".FLATE" features in the same way.
+SOSIData = namedtuple('SOSIData', ['units', 'origin', 'koordsys',
+                                   'kurve_ids', 'coords', 'offsets',
+                                   'flate_names', 'refs', 'ref_offsets'])
 ## Get logger.
 logger = logging.getLogger(__name__)
 ## Set basic logging configuration.
@@ -206,119 +239,352 @@ def run_lasindex(LAZ_directory, ncores):
         logger.debug(p)
 
 
-def SOSI_file_reader(path2filename):
+def parse_SOSI(path2filename, header_only=False):
+    """Parse a SOSI file in one forward pass over its lines.
+
+    Read the header properties (ENHET, ORIGO-NØ, KOORDSYS) and the
+    ".KURVE/.LINJE" coordinates and ".FLATE" references line by line,
+    so that only the parsed numbers are held in memory, and return a
+    'SOSIData' instance. Coordinates are kept as the integers of the
+    file (neither units nor origin applied).
+
+
+    Positional argument:
+
+    path2filename: absolute path to the input SOSI file.
+
+    Keyword argument:
+
+    header_only: bool which indicates whether to stop at the end of the
+    header (".HODE"), the features are then left empty.
+    """
+    ## Header properties.
+    units = None
+    origin = tuple()
+    koordsys = -1
+    ## Growing arrays of the features.
+    kurve_ids = array('q')
+    coords = array('q')
+    offsets = array('q')
+    flate_names = list()
+    refs = array('q')
+    ref_offsets = array('q')
+    ## Current section (level 1 keyword), the ".FLATE" being read and
+    ## whether continuation lines hold coordinates or references.
+    section = None
+    flate = None
+    reading = None
+    with open(path2filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('!'):
+                continue
+            if not line.startswith('.'):
+                ## Continuation line.
+                if reading == 'coords':
+                    yxz = line.split()
+                    try:
+                        coords.extend((int(yxz[0]), int(yxz[1])))
+                    except (IndexError, ValueError):
+                        reading = None
+                elif reading == 'refs':
+                    flate[1].extend(int(r) for r in re.findall(r'\d+', line))
+                continue
+            level = len(line) - len(line.lstrip('.'))
+            keyword, _, rest = line[level:].partition(' ')
+            keyword = keyword.rstrip(':')
+            rest = rest.strip()
+            reading = None
+            if level == 1:
+                ## A new section ends the previous ".FLATE".
+                if flate is not None and flate[0] is not None:
+                    flate_names.append(flate[0])
+                    refs.extend(flate[1])
+                    ref_offsets.append(len(refs))
+                flate = None
+                if header_only and section == 'HODE':
+                    break
+                section = keyword
+                if section in ('KURVE', 'LINJE'):
+                    kurve_ids.append(int(re.match(r'\d+', rest).group()))
+                    offsets.append(len(coords) // 2)
+                elif section == 'FLATE':
+                    flate = [None, array('q')]
+            elif section == 'HODE':
+                value = rest.split()
+                if keyword == 'ENHET':
+                    try:
+                        units = float(value[0])
+                    except (IndexError, ValueError):
+                        raise ValueError('The "ENHET" attribute does not have a '
+                                         'valid value!')
+                elif keyword == 'ORIGO-NØ':
+                    origin = (int(value[0]), int(value[1]))
+                elif keyword == 'KOORDSYS':
+                    koordsys = int(value[0])
+            elif section in ('KURVE', 'LINJE') and keyword in ('NØ', 'NØH'):
+                reading = 'coords'
+                if rest:
+                    yxz = rest.split()
+                    coords.extend((int(yxz[0]), int(yxz[1])))
+            elif section == 'FLATE':
+                if keyword == 'R_KART':
+                    flate[0] = re.match(r'[\d-]+', rest).group()
+                elif keyword == 'REF':
+                    reading = 'refs'
+                    flate[1].extend(int(r) for r in re.findall(r'\d+', rest))
+    if flate is not None and flate[0] is not None:
+        flate_names.append(flate[0])
+        refs.extend(flate[1])
+        ref_offsets.append(len(refs))
+    offsets.append(len(coords) // 2)
+    return SOSIData(np.nan if units is None else units,
+                    np.array(origin, dtype=np.int64),
+                    koordsys,
+                    np.frombuffer(kurve_ids, dtype=np.int64),
+                    np.frombuffer(coords, dtype=np.int64).reshape(-1, 2),
+                    np.frombuffer(offsets, dtype=np.int64),
+                    np.array(flate_names, dtype=str),
+                    np.frombuffer(refs, dtype=np.int64),
+                    np.concatenate([[0], np.frombuffer(ref_offsets, dtype=np.int64)]))
+
+
+def read_SOSI(path2filename, cache_directory=SOSI_CACHE_DIR):
+    """Return the parsed content of a SOSI file, from the cache if any.
+
+    Hash the content of the file, and load the 'SOSIData' instance
+    cached under that hash, or parse the file with 'parse_SOSI' and
+    cache the result (*.npz file).
+
+
+    Positional argument:
+
+    path2filename: absolute path to the input SOSI file.
+
+    Keyword argument:
+
+    cache_directory: absolute path to the cache directory, None
+    disables the cache.
+    """
+    if cache_directory is None:
+        return parse_SOSI(path2filename)
+    sha = hashlib.sha256()
+    with open(path2filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024**2), b''):
+            sha.update(block)
+    cache_file = os.path.join(cache_directory, 'sosi_{}_v{}.npz'
+                              .format(sha.hexdigest(), SOSI_CACHE_VERSION))
+    if os.path.isfile(cache_file):
+        logger.info('Reading the parsed {} file from the cache...'.format(path2filename))
+        with np.load(cache_file) as cached:
+            return SOSIData(*(cached[field][()] if cached[field].ndim == 0
+                              else cached[field]
+                              for field in SOSIData._fields))
+    logger.info('Parsing the {} file...'.format(path2filename))
+    data = parse_SOSI(path2filename)
+    os.makedirs(cache_directory, exist_ok=True)
+    ## Write under a temporary name so that a concurrent run never
+    ## reads a partial cache file.
+    tmp = NamedTemporaryFile(suffix='.npz', dir=cache_directory, delete=False)
+    try:
+        np.savez(tmp, **data._asdict())
+        tmp.close()
+        os.replace(tmp.name, cache_file)
+    except BaseException:
+        tmp.close()
+        os.unlink(tmp.name)
+        raise
+    return data
+
+
+def SOSI_file_reader(path2filename, cache_directory=SOSI_CACHE_DIR):
     """Read an input SOSI files with ".FLATE" objects an returns a
     list of 'Kartblad' instances, which are a 3-field namedtuples with
     the fields 'name' (kartblad), 'geometry'
-    (shapely.geometry.polygon.Polygon) and 'bounds' (coords: minx miny
-    maxx maxy).
+    (shapely.geometry.polygon.Polygon with its holes, or
+    shapely.geometry.multipolygon.MultiPolygon for a ".FLATE" in several
+    parts) and 'bounds' (coords: minx miny maxx maxy).
 
 
     Positional argument:
 
     path2filename: absolute path to the input SOSI file.
+
+    Keyword argument:
+
+    cache_directory: absolute path to the directory of the parsed SOSI
+    files cache, None disables the cache (see 'read_SOSI').
     """
-    ## Supported geometry types.
-    supported_geom_types = ['KURVE', 'LINJE', 'FLATE']
-    ## Register the regex patterns to filter the information from
-    ## the input file.
-    head_pattern = re.compile(r'\.HODE(?:.|\n)+?(?=\n\.\w)')
-    yxz_pattern = re.compile(r'(?<=\.\.NØ)H?(?P<yxz>(?:\s+?(?:-?\d+)\s+?'
-                             '(?:-?\d+)(?:[ \t\r\f\v]+?(?:-?\d+))?)+)')
-    geom_pattern = re.compile(r'\.(?:{})(?:.|\n)+?(?=\n\.\w)'
-                              .format('|'.join(supported_geom_types)))
-    kartblad_name_pattern = re.compile(r'\.\.R_KART\s+?(?P<name>(?:\d|-)+)')
-    refs_pattern = re.compile(r'\.\.REF(?:.|\n)+?(?=\.\.)')
-    knum_pattern = re.compile(r'\.(?:KURVE|LINJE)\s+?(?P<num>\d+)')
-    units_pattern = re.compile(r'\.\.\.ENHET\s+?(?P<float>(?:\d|\.)+)')
-    origin_pattern = re.compile(r'(?<=\.\.\.ORIGO-NØ)\s+?(?P<y>-?\d+)\s+?'
-                                '(?P<x>-?\d+)')    
-    ## Store coordinates of ".KURVE" objects and references of
-    ## ".FLATE".
-    kurve_coords = dict()
-    flate_refs = dict()    
-    ## Store the resultings polygons in a list.
-    kartblad_list = list()
-    ## Make a numpy dtype for the coordinates structured array.    
-    dtype= [('y', np.float), ('x', np.float)]
-    with open(path2filename, 'r', encoding='utf-8') as f:
-        contents = f.read()
-    ## Extract the information from the file's header.
-    head_match = head_pattern.search(contents)
-    header = head_match.group().strip()
-    all_features = slice(head_match.end(), None)
-    logger.info('Finding the units of the {} file...'.format(path2filename))
-    units = units_pattern.search(header)
-    if not units:
+    data = read_SOSI(path2filename, cache_directory)
+    if np.isnan(data.units):
         raise RuntimeError('The {!r} file does not '
                            'have an "ENHET" property!'.format(path2filename))
-    try:
-        logger.info('Converting the coordinates\' units...')
-        units = float(units.group('float'))
-    except ValueError:
-        raise ValueError('The "ENHET" attribute does not have a '
-                         'valid value!')    
-    logger.info('Looking for "ORIGO-NØ"...')
-    origin = origin_pattern.search(header)
-    if origin:
-        logger.info('Converting "ORIGO-NØ"...')
-        origin_y = int(origin.group('y'))
-        origin_x = int(origin.group('x'))
-    ## Start iterating over the input file's features.    
+    ## Apply units and ORIGO-NØ on the YX-coordinates of all features
+    ## at once.
     logger.info('Extract the geometry features from the {} file...'.format(path2filename))
-    for feature in geom_pattern.finditer(contents[all_features]):
-        feature_str = feature.group()
-        if feature_str.startswith('.F'):
-            ## Feature is ".FLATE".
-            kartblad_name = kartblad_name_pattern.search(feature_str).group('name')
-            logger.debug('Registering references for kartblad {!r}...'.format(kartblad_name))
-            flate_refs[kartblad_name] = re.findall(r'(\d+)', refs_pattern.search(feature_str).group())
+    yx = np.round(data.coords*data.units, decimals=round(math.log10(1/data.units)))
+    if len(data.origin):
+        yx += data.origin
+    ## Build the LineString of every ".KURVE/.LINJE" with at least two
+    ## vertices in one call, the others are left as None.
+    counts = np.diff(data.offsets)
+    valid = counts >= 2
+    lines = np.full(len(counts), None, dtype=object)
+    if valid.any():
+        keep = np.repeat(valid, counts)
+        lines[valid] = shapely.linestrings(yx[keep][:, ::-1],
+                                           indices=np.repeat(np.arange(valid.sum()), counts[valid]))
+    if not len(data.flate_names):
+        return list()
+    ## Look up the referred ".KURVE" of every ".FLATE".
+    order = np.argsort(data.kurve_ids, kind='stable')
+    sorted_ids = data.kurve_ids[order]
+    found = np.searchsorted(sorted_ids, data.refs)
+    missing = found == len(sorted_ids)
+    missing[~missing] = sorted_ids[found[~missing]] != data.refs[~missing]
+    if missing.any():
+        raise RuntimeError('The {!r} file refers to missing ".KURVE" {}!'
+                           .format(path2filename, data.refs[missing][:10].tolist()))
+    ## One row of ".KURVE" geometries per ".FLATE" (padded with None),
+    ## polygonized row by row in a single call.
+    ref_counts = np.diff(data.ref_offsets)
+    rows = np.full((len(ref_counts), max(ref_counts.max(), 1)), None, dtype=object)
+    row_index = np.repeat(np.arange(len(ref_counts)), ref_counts)
+    column_index = np.arange(len(data.refs)) - np.repeat(data.ref_offsets[:-1], ref_counts)
+    rows[row_index, column_index] = lines[order[found]]
+    logger.info('Polygonize {} kartblad...'.format(len(rows)))
+    parts, index = shapely.get_parts(shapely.polygonize(rows), return_index=True)
+    ## A face of the polygonized rings is part of its ".FLATE" if it lies
+    ## within an odd number of the rings of the ".FLATE". A face within
+    ## an even number fills a hole (an island, REF in parentheses).
+    rings = shapely.polygons(shapely.get_exterior_ring(parts))
+    face, ring = shapely.STRtree(rings).query(shapely.point_on_surface(parts),
+                                              predicate='within')
+    same = index[face] == index[ring]
+    inside = np.bincount(face[same], minlength=len(parts)) % 2 == 1
+    parts, index = parts[inside], index[inside]
+    ## One row of faces per ".FLATE" (padded with None), merged row by
+    ## row in a single call into a polygon with its holes, or a
+    ## multipolygon for a ".FLATE" in several parts.
+    found, counts = np.unique(index, return_counts=True)
+    faces = np.full((len(found), counts.max(initial=1)), None, dtype=object)
+    faces[np.repeat(np.arange(len(found)), counts),
+          np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)] = parts
+    polygons = np.full(len(rows), None, dtype=object)
+    polygons[found] = shapely.union_all(faces, axis=1)
+    bounds = shapely.bounds(polygons)
+    return [Kartblad(str(name), polygon, tuple(bounds_))
+            for name, polygon, bounds_ in zip(data.flate_names, polygons, bounds.tolist())
+            if polygon is not None]
+
+
+def read_LAS_bounds(path2filename):
+    """Read the extent of a LAS/LAZ file from its header.
+
+    Return the tuple (minx, miny, maxx, maxy) of the public header
+    block, which is never compressed.
+
+
+    Positional argument:
+
+    path2filename: absolute path to the input LAS/LAZ file.
+    """
+    with open(path2filename, 'rb') as f:
+        header = f.read(LAS_BOUNDS_OFFSET + LAS_BOUNDS.size)
+    if header[:4] != b'LASF' or len(header) < LAS_BOUNDS_OFFSET + LAS_BOUNDS.size:
+        raise ValueError('{!r} is not a LAS/LAZ file!'.format(path2filename))
+    maxx, minx, maxy, miny, _, _ = LAS_BOUNDS.unpack_from(header, LAS_BOUNDS_OFFSET)
+    return (minx, miny, maxx, maxy)
+
+
+def LAZ_bounds_index(LAZ_directory, ncores, cache_directory=SOSI_CACHE_DIR):
+    """Index the extent of the LAZ files of a directory.
+
+    Read the headers of the *.laz files concurrently and return the
+    sorted list of file names and the (N, 4) array of their bounds
+    (minx, miny, maxx, maxy). The index is cached by directory, and
+    only the files whose size or modification time changed since the
+    previous run are read again. A file which cannot be read (e.g.
+    truncated) is reported and left out of the index, and read again
+    on the next run.
+
+
+    Positional arguments:
+
+    LAZ_directory: absolute path to the input laser data directory.
+    ncores: number of concurrent header reads.
+
+    Keyword argument:
+
+    cache_directory: absolute path to the directory of the cache, None
+    disables the cache.
+    """
+    def read_bounds(name):
+        try:
+            return read_LAS_bounds(os.path.join(LAZ_directory, name))
+        except (OSError, ValueError) as e:
+            logger.warning('The {!r} file is left out of the bounds index: {}'
+                           .format(name, e))
+            return None
+
+    found = sorted(os.path.basename(f)
+                   for f in glob.glob(os.path.join(LAZ_directory, '*.laz')))
+    names = list()
+    stamps = list()
+    for name in found:
+        try:
+            st = os.stat(os.path.join(LAZ_directory, name))
+        except OSError as e:
+            logger.warning('The {!r} file is left out of the bounds index: {}'
+                           .format(name, e))
+            continue
+        names.append(name)
+        stamps.append((st.st_size, st.st_mtime_ns))
+    stamps = np.array(stamps, dtype=np.int64).reshape(-1, 2)
+    bounds = np.full((len(names), 4), np.nan)
+    cached = dict()
+    if cache_directory is not None:
+        key = hashlib.sha256(os.path.abspath(LAZ_directory).encode('utf-8')).hexdigest()
+        cache_file = os.path.join(cache_directory, 'bounds_{}_v{}.npz'
+                                  .format(key, BOUNDS_CACHE_VERSION))
+        if os.path.isfile(cache_file):
+            with np.load(cache_file) as npz:
+                cached = {name: (tuple(stamp), b) for name, stamp, b
+                          in zip(npz['names'].tolist(), npz['stamps'], npz['bounds'])}
+    to_read = list()
+    for i, name in enumerate(names):
+        stamp, b = cached.get(name, (None, None))
+        if stamp == tuple(stamps[i]):
+            bounds[i] = b
         else:
-            ## Feature is ".KURVE" or ".LINJE".
-            yx_coords = [yxz.group('yxz').strip().split('\n')
-                          for yxz in yxz_pattern.finditer(feature_str)]
-            yx_coords[:] = [tuple(yxz.strip().split()[:2])
-                            for coords in yx_coords
-                            for yxz in coords]
-            ## Convert the list of coordinates to a numpy
-            ## structured array.
-            logger.debug('Building the coordinates structured array...')
-            arr_yx = np.asarray(yx_coords, dtype=dtype)
-            ## Apply units on the XY-coordinates of the feature.
-            for field in arr_yx.dtype.names:
-                logger.debug('Applying the units factor on the '
-                      '{}-coordinates...'.format(field.upper()))
-                np.round_(arr_yx[field]*units, decimals=int(math.log10(1/units)),
-                          out=arr_yx[field])
-            ## Correct the YX-coordinates if ORIGO-NØ is specified in the
-            ## input file.
-            if origin:
-                logger.debug('Applying the "ORIGO-NØ" shift on the feature\'s '
-                      'coordinates...')
-                arr_yx['y'] += origin_y
-                arr_yx['x'] += origin_x
-            knum = knum_pattern.search(feature_str).group('num')
-            logger.debug('Converting ".KURVE/.LINJE {}" to LineString...'.format(knum))
-            geom_shapely = LineString(arr_yx[['x', 'y']].tolist())
-            kurve_coords[knum] = geom_shapely
-    if flate_refs:
-    ## If there are ".FLATE" features, try to convert to polygons the
-    ## referred ".KURVE" features.
-        ## Set of the registered the referred ".KURVE" numbers.
-        kurve_refs = set()
-        for kartblad, lines in flate_refs.items():
-            ## List of ".KURVE" geometries that define the ".FLATE"
-            ## boundary.
-            linestrings = [kurve_coords[line] for line in lines]
-            ## Polygonize the LineString instances.
-            logger.debug('Polygonize kartblad {!r}...'.format(kartblad))
-            poly, *rest = polygonize_full(linestrings)
-            ## List of Polygon instances.
-            poly = [Polygon(p.exterior) for p in poly]
-            if poly:
-                kartblad_list.append(Kartblad(kartblad, poly[0], poly[0].bounds))
-                del poly
-    return kartblad_list
+            to_read.append(i)
+    logger.info('Read the header of {} of {} LAZ file(s)...'
+                .format(len(to_read), len(names)))
+    with futures.ThreadPoolExecutor(max_workers=max(ncores, 1)) as executor:
+        for i, b in zip(to_read, executor.map(read_bounds, [names[i] for i in to_read])):
+            if b is not None:
+                bounds[i] = b
+    ## Leave the unreadable files out, of the cache too.
+    readable = ~np.isnan(bounds).any(axis=1)
+    names = [name for name, ok in zip(names, readable) if ok]
+    stamps = stamps[readable]
+    bounds = bounds[readable]
+    if len(names) < len(found):
+        logger.warning('{} of {} LAZ file(s) left out of the bounds index!'
+                       .format(len(found) - len(names), len(found)))
+    if cache_directory is not None and to_read:
+        os.makedirs(cache_directory, exist_ok=True)
+        tmp = NamedTemporaryFile(suffix='.npz', dir=cache_directory, delete=False)
+        try:
+            np.savez(tmp, names=np.array(names, dtype=str), stamps=stamps,
+                     bounds=bounds)
+            tmp.close()
+            os.replace(tmp.name, cache_file)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    return names, bounds
 
 
 def rename_LAZ_output(LAZ_output):
@@ -344,11 +610,13 @@ def rename_LAZ_output(LAZ_output):
 
 
 def clip_many(LAZ_directory, output_directory, kartblad_list, LAZ_EPSG,
-              ncores, verbose):
+              ncores, verbose, cache_directory=SOSI_CACHE_DIR):
     """Clip the laser data using multiple kartblad polygon geometries.
 
     Orchestrate the clipping of the laser data against the kartblad
-    polygon geometries using concurrency.
+    polygon geometries using concurrency. Each kartblad is clipped from
+    the input LAZ files whose extent intersects it only (found with a
+    STRtree of the LAZ files bounds index).
 
 
     Positional arguments:
@@ -366,13 +634,27 @@ def clip_many(LAZ_directory, output_directory, kartblad_list, LAZ_EPSG,
     ncores: number of CPU cores to use for clipping the laser data.
     verbose: bool which indicates whether the user wants to run the
     script in verbose/debug mode.
+
+    Keyword argument:
+
+    cache_directory: absolute path to the directory of the LAZ files
+    bounds index cache, None disables the cache.
     """
     counter = Counter()
+    ## Input LAZ files intersecting each kartblad.
+    names, bounds = LAZ_bounds_index(LAZ_directory, ncores, cache_directory)
+    LAZ_files = [list() for _ in kartblad_list]
+    if names:
+        tree = shapely.STRtree(shapely.box(*bounds.T))
+        kartblad, LAZ_file = tree.query([k.geometry for k in kartblad_list],
+                                        predicate='intersects')
+        for i, j in zip(kartblad.tolist(), LAZ_file.tolist()):
+            LAZ_files[i].append(names[j])
     with futures.ThreadPoolExecutor(max_workers=ncores) as executor:
         future_list = list()
-        for k in kartblad_list:
+        for k, files in zip(kartblad_list, LAZ_files):
             future = executor.submit(clip_one, LAZ_directory,
-                            output_directory, k, LAZ_EPSG)
+                            output_directory, k, LAZ_EPSG, files)
             future_list.append(future)
         done_iter = futures.as_completed(future_list)
         if not verbose:
@@ -385,11 +667,13 @@ def clip_many(LAZ_directory, output_directory, kartblad_list, LAZ_EPSG,
     return counter
 
 
-def clip_one(LAZ_directory, output_directory, kartblad, LAZ_EPSG):
+def clip_one(LAZ_directory, output_directory, kartblad, LAZ_EPSG,
+             LAZ_files=None):
     """Clip the laser data against one kartblad polygon geometry.
 
     Clip the laser data with LAStools (lasclip) using a single feature
-    created Shapefile.
+    created Shapefile. Return empty without running lasclip if no
+    input LAZ file intersects the kartblad.
 
     
     Positional arguments:
@@ -404,7 +688,15 @@ def clip_one(LAZ_directory, output_directory, kartblad, LAZ_EPSG):
     LAZ_EPSG: EPSG code (integer) of the projected coordinate
     reference system of the input LAZ files (supported: 25832, 25833
     or 25835).
+
+    Keyword argument:
+
+    LAZ_files: list of the names of the input LAZ files to clip, None
+    means all the *.laz files of the input directory.
     """
+    if LAZ_files is not None and not LAZ_files:
+        logger.debug('{} : no LAZ file'.format(kartblad.name))
+        return 'empty'
     ## Create a temporary file.
     tf = NamedTemporaryFile(suffix='.shp', delete=False)
     tf.close()
@@ -415,10 +707,20 @@ def clip_one(LAZ_directory, output_directory, kartblad, LAZ_EPSG):
     ## Get the absolute path of the temporary files (*.shp file +
     ## metadata files).
     tempfiles = itertools.chain([poly], getSHPmetadatafiles(poly))
+    ## Input files: all the *.laz files, or the given ones listed in a
+    ## temporary file.
+    if LAZ_files is None:
+        inputs = '-i *.laz'
+    else:
+        lof = NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
+        lof.write('\n'.join(os.path.join(LAZ_directory, f) for f in LAZ_files) + '\n')
+        lof.close()
+        inputs = '-lof {}'.format(lof.name)
+        tempfiles = itertools.chain(tempfiles, [lof.name])
     ## Path to the output LAZ file.
     LAZ_output = os.path.join(output_directory, kartblad.name + '.laz')
     ## Command to run in a separate process.
-    cmd = ('lasclip -i *.laz -merged -inside {bounds[0]} {bounds[1]} '
+    cmd = ('lasclip {inputs} -merged -inside {bounds[0]} {bounds[1]} '
            '{bounds[2]} {bounds[3]} -poly {poly} '
            '-split -o {LAZ_output}'.format(**locals()))
     try:
@@ -446,6 +748,238 @@ def clip_one(LAZ_directory, output_directory, kartblad, LAZ_EPSG):
     return status
         
 
+def kartblad_lookup(kartblad_list):
+    """Make the grid index of the kartblad for the single pass clipper.
+
+    Kartblad are mostly axis-aligned rectangles of a regular grid. Take
+    the most common kartblad size and the lowest corner as grid, and
+    return the tuple (origin, size, keys, sheets, others) where 'keys'
+    is the sorted array of the grid cell keys of the rectangle kartblad,
+    'sheets' the index of their kartblad in 'kartblad_list' and 'others'
+    the array of the index of the remaining kartblad, whose points must
+    be found by polygon containment.
+
+
+    Positional argument:
+
+    kartblad_list: list of 'Kartblad' instances.
+    """
+    geoms = np.array([k.geometry for k in kartblad_list], dtype=object)
+    bounds = shapely.bounds(geoms)
+    sizes = bounds[:, 2:] - bounds[:, :2]
+    unique_sizes, counts = np.unique(sizes, axis=0, return_counts=True)
+    size = unique_sizes[np.argmax(counts)]
+    origin = bounds[:, :2].min(axis=0)
+    colrow = (bounds[:, :2] - origin)/size
+    rect = (np.isclose(colrow, np.round(colrow)).all(axis=1)
+            & np.isclose(sizes, size).all(axis=1)
+            & np.isclose(shapely.area(geoms), sizes.prod(axis=1)))
+    colrow = np.round(colrow).astype(np.int64)
+    keys = (colrow[:, 0] << 32) | (colrow[:, 1] & 0xFFFFFFFF)
+    ## Two kartblad on the same grid cell are left to polygon
+    ## containment.
+    unique_keys, key_counts = np.unique(keys[rect], return_counts=True)
+    rect &= np.isin(keys, unique_keys[key_counts > 1], invert=True)
+    sheets = np.flatnonzero(rect)
+    order = np.argsort(keys[sheets])
+    return (origin, size, keys[sheets][order], sheets[order],
+            np.flatnonzero(~rect))
+
+
+def route_LAZ_file(path2filename, part_directory, lookup, polygons,
+                   max_open_writers=MAX_OPEN_WRITERS):
+    """Route the points of one LAZ file to the kartblad parts.
+
+    Read the file chunk by chunk, assign every point to its kartblad
+    with the grid index (or by polygon containment) and append it to
+    the part file of the kartblad. At most 'max_open_writers' part
+    files are open at a time, the least recently used one is closed
+    when another is needed, and a new part file is started if the
+    kartblad gets points again. Return a dict of the part files by
+    kartblad index.
+
+
+    Positional arguments:
+
+    path2filename: absolute path to the input LAZ file.
+    part_directory: absolute path to the directory of the part files.
+    lookup: grid index from 'kartblad_lookup', without the last item.
+    polygons: list of (kartblad index, polygon) of the kartblad which
+    are not in the grid index and intersect the file.
+
+    Keyword argument:
+
+    max_open_writers: maximum number of part files open at a time.
+    """
+    origin, size, keys, sheets = lookup
+    stem = os.path.splitext(os.path.basename(path2filename))[0]
+    parts = dict()
+    writers = OrderedDict()
+    with laspy.open(path2filename) as reader:
+        header = copy.deepcopy(reader.header)
+        try:
+            for points in reader.chunk_iterator(CHUNK_POINTS):
+                x = np.asarray(points.x)
+                y = np.asarray(points.y)
+                col = np.floor((x - origin[0])/size[0]).astype(np.int64)
+                row = np.floor((y - origin[1])/size[1]).astype(np.int64)
+                point_keys = (col << 32) | (row & 0xFFFFFFFF)
+                sheet = np.full(len(x), -1, dtype=np.int64)
+                if len(keys):
+                    pos = np.minimum(np.searchsorted(keys, point_keys), len(keys) - 1)
+                    hit = keys[pos] == point_keys
+                    sheet[hit] = sheets[pos[hit]]
+                for index, polygon in polygons:
+                    inside = (sheet < 0) & shapely.contains_xy(polygon, x, y)
+                    sheet[inside] = index
+                ## Write the points grouped by kartblad.
+                order = np.argsort(sheet, kind='stable')
+                found, starts = np.unique(sheet[order], return_index=True)
+                ends = np.append(starts[1:], len(order))
+                for index, start, end in zip(found.tolist(), starts, ends):
+                    if index < 0:
+                        continue
+                    if index in writers:
+                        writers.move_to_end(index)
+                    else:
+                        if len(writers) >= max_open_writers:
+                            writers.popitem(last=False)[1].close()
+                        part = os.path.join(part_directory, '{}_{}_{}.laz'.format(
+                            index, stem, len(parts.get(index, ()))))
+                        parts.setdefault(index, list()).append(part)
+                        writers[index] = laspy.open(part, mode='w', header=copy.deepcopy(header),
+                                                    do_compress=True)
+                    writers[index].write_points(points[order[start:end]])
+        finally:
+            for writer in writers.values():
+                writer.close()
+    return parts
+
+
+def merge_parts(parts, LAZ_output):
+    """Merge the part files of one kartblad into the output LAZ file.
+
+    A single part file is renamed. Points of parts with other scales or
+    offsets than the first part are rescaled. The part files are
+    deleted.
+
+
+    Positional arguments:
+
+    parts: list of absolute paths to the part files.
+    LAZ_output: absolute path to the output LAZ file.
+    """
+    if len(parts) == 1:
+        os.replace(parts[0], LAZ_output)
+        return
+    with laspy.open(parts[0]) as reader:
+        header = copy.deepcopy(reader.header)
+    with laspy.open(LAZ_output, mode='w', header=header, do_compress=True) as writer:
+        for part in parts:
+            with laspy.open(part) as reader:
+                if reader.header.point_format.id != header.point_format.id:
+                    raise ValueError('Cannot merge point format {} with {} into {!r}!'
+                                     .format(reader.header.point_format.id,
+                                             header.point_format.id, LAZ_output))
+                rescale = (not np.array_equal(reader.header.scales, header.scales)
+                           or not np.array_equal(reader.header.offsets, header.offsets))
+                for points in reader.chunk_iterator(CHUNK_POINTS):
+                    if rescale:
+                        rescaled = laspy.ScaleAwarePointRecord(points.array.copy(),
+                                                               points.point_format,
+                                                               header.scales,
+                                                               header.offsets)
+                        rescaled.x = points.x
+                        rescaled.y = points.y
+                        rescaled.z = points.z
+                        points = rescaled
+                    writer.write_points(points)
+            os.unlink(part)
+
+
+def clip_single_pass(LAZ_directory, output_directory, kartblad_list,
+                     ncores, verbose, cache_directory=SOSI_CACHE_DIR,
+                     max_open_writers=MAX_OPEN_WRITERS):
+    """Clip the laser data against all kartblad in one pass.
+
+    Alternative to 'clip_many' which reads each input LAZ file once
+    (instead of once per kartblad it intersects): the points of every
+    input file are routed to part files per kartblad in parallel
+    processes, then the parts of each kartblad are merged into its
+    output LAZ file. Needs laspy with a LAZ backend (lazrs).
+
+
+    Positional arguments:
+
+    LAZ_directory: absolute path to the input laser data directory.
+    output_directory: absolute path to the output directory where the
+    clipped laser data will be saved.
+    kartblad_list: list of 'Kartblad' instances.
+    ncores: number of CPU cores to use for clipping the laser data.
+    verbose: bool which indicates whether the user wants to run the
+    script in verbose/debug mode.
+
+    Keyword arguments:
+
+    cache_directory: absolute path to the directory of the LAZ files
+    bounds index cache, None disables the cache.
+    max_open_writers: maximum number of part files open at a time in
+    each process.
+    """
+    if laspy is None:
+        raise RuntimeError('The single pass clipper needs laspy and '
+                           'lazrs-python to be installed!')
+    counter = Counter()
+    names, bounds = LAZ_bounds_index(LAZ_directory, ncores, cache_directory)
+    if not names or not kartblad_list:
+        counter['empty'] += len(kartblad_list)
+        return counter
+    *lookup, others = kartblad_lookup(kartblad_list)
+    ## Kartblad out of the grid index intersecting each input file.
+    file_polygons = [list() for _ in names]
+    if len(others):
+        tree = shapely.STRtree(shapely.box(*bounds.T))
+        other, LAZ_file = tree.query([kartblad_list[i].geometry for i in others],
+                                     predicate='intersects')
+        for i, j in zip(other.tolist(), LAZ_file.tolist()):
+            file_polygons[j].append((int(others[i]), kartblad_list[others[i]].geometry))
+    part_directory = os.path.join(output_directory, '.parts_{}'.format(os.getpid()))
+    os.makedirs(part_directory, exist_ok=True)
+    parts = dict()
+    try:
+        with futures.ProcessPoolExecutor(max_workers=ncores) as executor:
+            future_list = [executor.submit(route_LAZ_file,
+                                           os.path.join(LAZ_directory, name),
+                                           part_directory, lookup, polygons,
+                                           max_open_writers)
+                           for name, polygons in zip(names, file_polygons)]
+            done_iter = futures.as_completed(future_list)
+            if not verbose:
+                done_iter = tqdm.tqdm(done_iter, ascii=True,
+                                      desc='Routing laser data',
+                                      total=len(future_list))
+            for future in done_iter:
+                for index, sheet_parts in future.result().items():
+                    parts.setdefault(index, list()).extend(sheet_parts)
+            ## Merge the parts of each kartblad.
+            future_list = [executor.submit(merge_parts, sorted(sheet_parts),
+                                           os.path.join(output_directory,
+                                                        kartblad_list[index].name + '.laz'))
+                           for index, sheet_parts in parts.items()]
+            done_iter = futures.as_completed(future_list)
+            if not verbose:
+                done_iter = tqdm.tqdm(done_iter, ascii=True,
+                                      desc='Merging laser data',
+                                      total=len(future_list))
+            for future in done_iter:
+                _ = future.result()
+    finally:
+        shutil.rmtree(part_directory, ignore_errors=True)
+    counter['clipped'] += len(parts)
+    counter['empty'] += len(kartblad_list) - len(parts)
+    return counter
+
+
 def create_single_geometry_shapefile(output_filename, EPSG, geom):
     """Create a Shapefile with a single polygon feature.
 
@@ -532,23 +1066,16 @@ def extractprojectedSRSfromSOSI(path2filename):
     Read information in a header of a SOSI file and return the
     EPSG code number of the file features' projected SRS. '..KOORDSYS'
     property must be one of 22, 23 or 25. If the '..KOORDSYS' is not
-    found in the file, return None.
+    found in the file, return None. Only the header lines are read.
 
     
     Positional argument:
 
     path2filename: absolute path to the input SOSI file.
     """
-    head_pattern = re.compile(r'\.HODE(?:.|\n)+?(?=\n\.\w)')    
-    SRS_pattern = re.compile(r'(?<=\.\.\.KOORDSYS)\s+?(?P<srs>\d+)')
-    with open(path2filename, 'r', encoding='utf-8') as f:
-        contents = f.read()
-    ## Extract the information from the file's header.
-    head_match = head_pattern.search(contents)
-    header = head_match.group().strip()
-    SRS = SRS_pattern.search(header)
-    if SRS:
-        return 25810 + int(SRS.group('srs'))
+    koordsys = parse_SOSI(path2filename, header_only=True).koordsys
+    if koordsys >= 0:
+        return 25810 + koordsys
     else:
         return None
 
@@ -571,6 +1098,10 @@ def main(**kwargs):
     run_indexing: bool that indicates whether the user wants to run the
     spatial indexing of the laser data in the same process.
     ncores: number of CPU cores to use for running the whole script.
+    sosi_cache: absolute path to the directory of the parsed SOSI files
+    and LAZ files bounds index cache, None disables the cache.
+    single_pass: bool that indicates whether the user wants to clip
+    with the single pass clipper instead of lasclip.
     verbose: bool which indicates whether the user wants to run the
     script in verbose/debug mode.
     """
@@ -590,6 +1121,8 @@ def main(**kwargs):
     AOI = os.path.normpath(kwargs['aoi'])
     run_indexing = kwargs['run_indexing']
     ncores = kwargs['ncores']
+    sosi_cache = kwargs['sosi_cache']
+    single_pass = kwargs['single_pass']
     ## Get the EPSG of the project's spatial reference system.
     SRS = extractprojectedSRSfromSOSI(AOI)
     if SRS is None:
@@ -597,39 +1130,40 @@ def main(**kwargs):
                            'the {!r} file!'.format(AOI))
     else:
         UTMzone = str(SRS)[-2:]
-    ## Get a path of the kartblad temporary file.
-    kartblad_file = NamedTemporaryFile(mode='w', suffix='.sos', delete=False)
-    kartblad_file.close()
     ## Add the location of LAStools executable files to the PATH.
     add_exe_to_path()
     ## Add the GDAL_DATA environment variable.
     set_env_var()
-    ## Run the macro in Fysak to make the kartblad file, and run the
-    ## spatial indexing of LAZ files if wanted by the user.
-    if run_indexing:
-        max_workers = 2
-    else:
-        max_workers = 1
-    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    ## Run the spatial indexing of LAZ files if wanted by the user,
+    ## while making the kartblad.
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
         to_do = list()
-        to_do.append(executor.submit(run_fysak_mko, mko_template, AOI,
-                                     kartblad_file.name, UTMzone))
         if run_indexing:
             to_do.append(executor.submit(run_lasindex, LAZ_input_directory,
                                          ncores))
+        ## Run the macro in Fysak to make the kartblad file, then read
+        ## it and extract the kartblad polygons.
+        kartblad_file = NamedTemporaryFile(mode='w', suffix='.sos', delete=False)
+        kartblad_file.close()
+        try:
+            run_fysak_mko(mko_template, AOI, kartblad_file.name, UTMzone)
+            logger.info('Read the kartblad file...')
+            kartblad_list = SOSI_file_reader(kartblad_file.name, sosi_cache)
+        finally:
+            os.unlink(kartblad_file.name)
         ## Wait the termination of the thread(s).
         for future in futures.as_completed(to_do):
             _ = future.result()
-    ## Read the kartblad file and extract the kartblad polygons.
-    logger.info('Read the kartblad file...')
-    kartblad_list = SOSI_file_reader(kartblad_file.name)
-    os.unlink(kartblad_file.name)
     print('{} kartblad polygons will be used to clip the laser data.'
           .format(len(kartblad_list)))
     print('{} core(s) will be used.'.format(ncores))
     ## Start clipping the data.
-    counter = clip_many(LAZ_input_directory, LAZ_output_directory,
-                        kartblad_list, SRS, ncores, verbose)
+    if single_pass:
+        counter = clip_single_pass(LAZ_input_directory, LAZ_output_directory,
+                                   kartblad_list, ncores, verbose, sosi_cache)
+    else:
+        counter = clip_many(LAZ_input_directory, LAZ_output_directory,
+                            kartblad_list, SRS, ncores, verbose, sosi_cache)
     elapsed = time.time() - t0
     minutes, seconds = divmod(elapsed, 60)
     hours, minutes = divmod(minutes, 60)
@@ -704,6 +1238,34 @@ optimization_grp.add_argument('-C', '--ncores', type=int, dest='ncores',
                     NUMBER OF CORES
                        Number of cores used to run the script.
                        Default is {}.""".format(num_cores)))
+# Cache of the parsed SOSI files.
+optimization_grp.add_argument('--sosi_cache', dest='sosi_cache',
+                              metavar='SOSI_CACHE_DIRECTORY',
+                              default=SOSI_CACHE_DIR,
+                              help=textwrap.dedent("""\
+                              SOSI CACHE DIRECTORY
+                                  Path to the directory where the parsed
+                                  SOSI files are cached by file hash, so
+                                  that repeated runs against the same AOI
+                                  skip the parsing. The bounds index of the
+                                  input LAZ files is cached there as well.
+                                  Use '--no_sosi_cache' to disable it. Default is {}.""".format(SOSI_CACHE_DIR)))
+optimization_grp.add_argument('--no_sosi_cache', dest='sosi_cache',
+                              action='store_const', const=None,
+                              help=textwrap.dedent("""\
+                              NO SOSI CACHE
+                                  Always parse the SOSI files and read
+                                  the LAZ headers."""))
+# Single pass clipper.
+optimization_grp.add_argument('--single_pass', dest='single_pass',
+                              action='store_true',
+                              help=textwrap.dedent("""\
+                              SINGLE PASS CLIPPING
+                                  Read each input LAZ file once and route
+                                  its points to all the kartblad it covers,
+                                  instead of running lasclip once per
+                                  kartblad. Needs laspy and lazrs-python.
+                                  Spatial indexing is then not needed."""))
 # Verbosity.
 optimization_grp.add_argument('-v', '--verbose', dest='verbose',
                               action='store_true',
@@ -722,6 +1284,8 @@ if __name__ == '__main__':
                 'aoi': args.aoi,
                 'run_indexing': args.run_indexing,
                 'ncores': args.ncores,
+                'sosi_cache': args.sosi_cache,
+                'single_pass': args.single_pass,
                 'verbose': args.verbose,
                 }
     ## Run main function with CLI arguments.
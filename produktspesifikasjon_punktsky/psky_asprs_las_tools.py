@@ -23,7 +23,7 @@ Reference Documents:
     -   https://register.geonorge.no/produktspesifikasjoner/fkb-laser/3.0
     -   https://support.geocue.com/wp-content/uploads/2015/01/CueTip-Working-with-LAS-v1.4-Files-in-GeoCue.pdf    
 
-HEX layer generation post removal of pdal density in PDAL v2.8 
+HEX layer generation post removal of pdal density in PDAL v2.8 (single file, see worker_coverage for a whole project)
 C:\_SANDBOX\OM_USV_MBES_2025>python -c "import json; print(json.dumps([r'12\\OM_MBES.laz', {'type':'filters.hexbin','edge_size':10.0,'threshold':1,'density':'hex_10m.geojson'}]))" | pdal pipeline --stdin && ogr2ogr -f GPKG hex_10m.gpkg hex_10m.geojson -a_srs EPSG:5972
 
 """
@@ -36,110 +36,2049 @@ __email__       = "christian.malmquist@kartverket.com"
 __status__      = "Working"
 
 # Dependencies
+import base64
+import collections
 from concurrent import futures
+from contextlib import closing, contextmanager
+from datetime import timedelta
+from functools import partial
 import glob
+import hashlib
+import io
+import heapq
+import inspect
+import itertools
 import json
-from multiprocessing import Process
+import multiprocessing
+import os
+from multiprocessing import shared_memory
 from pathlib import Path
+import queue
+import shutil
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+import numpy as np
 import pdal     
+try:
+    import lazrs
+except ImportError:
+    lazrs = None
 
-def exc_func_in_proc(func, *args, **kwargs) -> None:
-    proc = Process(
-        target=func,
-        args=tuple(args),
-        kwargs=kwargs,
+# Streaming engine
+## CHUNK_SIZE        = points per chunk handed between PDAL and NumPy
+## MAX_WORKER_MEMORY = memory ceiling per worker process in bytes (None = no ceiling), chunks are shrunk to fit
+## ALLOW_IN_MEMORY   = run pipelines that cannot stream with execute() (True) or refuse them (False)
+CHUNK_SIZE = 1_000_000
+MAX_WORKER_MEMORY = 2 * 1024**3
+ALLOW_IN_MEMORY = False
+## PIPELINED  = read/decompress, transform and write/compress each file in three processes (the worker and two
+##              stage processes) handing chunks over in a shared memory ring of RING_SLOTS chunks
+##              The stage processes are started once per worker and kept for its next files
+##              MAX_WORKER_MEMORY then covers the three processes and the ring together
+##              Each chunk is copied twice, into its ring slot and out of it to the writer (see stream_pipelined),
+##              compare the *_pipelined tasks of psky_benchmark.py with the plain ones before turning it on
+PIPELINED = False
+RING_SLOTS = 4
+## NUMPY_TRANSCODE = convert uncompressed LAS 1.2 (point formats 0-3) to LAS 1.4 with psky_12_to_14_numpy, memory
+##                   mapped without PDAL, the output is then uncompressed LAS
+NUMPY_TRANSCODE = False
+
+# Spatial sort of the points written by stream_las (psky_12_to_14, psky_14_to_12, psky_flag_overlap)
+## SORT_ORDER = "morton" or "hilbert" order of XY keys (None = acquisition order), each part of a split file on its own
+## SORT_BITS  = key resolution, 2**SORT_BITS cells per axis over the header bounds (at most 31)
+## Points that do not fit MAX_WORKER_MEMORY are sorted in runs spilled next to the output and merged
+SORT_ORDER = None
+SORT_BITS = 16
+
+# Worker pool, a worker process is replaced after MAX_FILES_PER_WORKER files or MAX_BYTES_PER_WORKER input bytes
+## to release memory leaked by native code
+MAX_FILES_PER_WORKER = 500
+MAX_BYTES_PER_WORKER = 50 * 1024**3
+
+# Memory-aware scheduling, tasks are started largest first while their estimated memory fits MEMORY_BUDGET
+## MEMORY_BUDGET = bytes the workers may use together (None = MEMORY_SHARE of the physical memory of the machine)
+## num_workers is then only the most tasks running at once, estimates are corrected by the peak RSS workers report
+MEMORY_BUDGET = None
+MEMORY_SHARE = 0.8
+
+# Intra-file parallelism, inputs larger than SPLIT_SIZE bytes are converted in parts of about SPLIT_SIZE bytes
+## on several workers and stitched into one output (None = never split), LAZ inputs are cut at chunk boundaries
+## The LAZ chunk tables are read and written with lazrs (lazrs-python), without it no file is split
+SPLIT_SIZE = 2 * 1024**3
+
+# Staging through local scratch disk for inputs and outputs on network shares
+## SCRATCH_DIR    = local folder for the staged copies (None = workers read ifolder and write ofolder directly)
+## SCRATCH_BYTES  = scratch space used at most, an output is counted as large as its input
+## PREFETCH_FILES = inputs copied ahead of the workers
+SCRATCH_DIR = None
+SCRATCH_BYTES = 100 * 1024**3
+PREFETCH_FILES = 4
+
+# Cloud Optimized Point Cloud output of the conversion workers (worker_tag14, worker_12_to_14)
+## COPC_OUTPUT = write <name>.copc.laz with an octree (writers.copc) instead of plain LAZ, validated after writing
+##               writers.copc cannot stream, the octree is built on all points of a file in memory
+COPC_OUTPUT = False
+
+# Completion manifest written to the output folder, finished files are skipped on the next run
+MANIFEST_NAME = "psky_manifest.jsonl"
+## Bytes hashed from each end of an input file (header/VLRs and the LAZ chunk table/EVLRs)
+FINGERPRINT_BYTES = 64 * 1024
+
+# Per-file events (JSON lines) written to the output folder, progress summary printed every PROGRESS_INTERVAL seconds
+## PROMETHEUS_TEXTFILE = path of a node_exporter textfile collector file (*.prom), None = no export
+EVENTS_NAME = "psky_events.jsonl"
+PROGRESS_INTERVAL = 30
+PROMETHEUS_TEXTFILE = None
+
+# Per-file metadata catalog (SQLite with an R*Tree on the XY bounds) written to the output folder
+CATALOG_NAME = "psky_catalog.sqlite"
+
+# Side products (hexbin coverage and statistics) written next to converted files
+## HEXBIN_EDGE_SIZE = hexagon edge length in metres, HEXBIN_THRESHOLD = minimum points for a hexagon to count as covered
+HEXBIN_EDGE_SIZE = 10.0
+HEXBIN_THRESHOLD = 1
+
+# Overlap flagging across flight strips (worker_overlap)
+## OVERLAP_CELL_SIZE  = grid cell edge in metres, points in cells where two or more PointSourceIds have points are overlap
+## OVERLAP_CELLS_NAME = the overlap cells (sorted grid_cells keys) saved to the output folder and memory-mapped by workers
+OVERLAP_CELL_SIZE = 2.0
+OVERLAP_CELLS_NAME = "psky_overlap_cells.npy"
+
+# Bytes held per point by one chunk (all LAS 1.4 dimensions as PDAL types, rounded up)
+POINT_BYTES = 128
+# Memory a worker needs besides the chunks (interpreter, PDAL, GDAL/PROJ)
+WORKER_BASE_MEMORY = 512 * 1024**2
+
+# PDAL stages that run in stream mode, any other stage loads the whole file into memory
+STREAMABLE_STAGES = {
+    "readers.las",
+    "readers.copc",
+    "readers.memoryview",
+    "filters.assign",
+    "filters.crop",
+    "filters.expression",
+    "filters.ferry",
+    "filters.head",
+    "filters.range",
+    "filters.reprojection",
+    "filters.stats",
+    "filters.tail",
+    "writers.las",
+    "writers.null",
+    "writers.text",
+}
+
+# Classification codes that differ between FKB-Laser (LAS 1.2) and Produktspesifikasjon Punktsky (LAS 1.4)
+## key = FKB-Laser, value = Punktsky
+FKB_TO_PSKY_CLASSES = {
+    24: 21,
+    26: 40,
+    27: 41,
+    28: 42,
+    29: 43,
+    30: 44,
+    31: 45,
+}
+
+def class_lut(mapping: dict) -> np.ndarray:
+    # 256-entry Classification lookup table, codes missing from mapping are kept
+    lut = np.arange(256, dtype=np.uint8)
+    lut[list(mapping.keys())] = list(mapping.values())
+    return lut
+
+LUT_12_TO_14 = class_lut(FKB_TO_PSKY_CLASSES)
+LUT_14_TO_12 = class_lut({psky: fkb for fkb, psky in FKB_TO_PSKY_CLASSES.items()})
+
+# Attribute upgrade of the LAS 1.2 -> 1.4 conversion (besides the classes)
+## OVERLAP_CLASS    = LAS 1.2 overlap class, flagged with the LAS 1.4 overlap bit
+## OVERLAP_RECLASS  = class the flagged overlap points get, None = keep OVERLAP_CLASS
+## SCAN_CHANNEL_DIM = dimension of LAS 1.2 inputs holding the scanner channel (e.g. "UserData"), None = channel 0
+OVERLAP_CLASS = 12
+OVERLAP_RECLASS = None
+SCAN_CHANNEL_DIM = None
+## Dimensions the upgrade writes, added to the chunks when the reader does not deliver them
+UPGRADE_DIMS = [("ClassFlags", "u1"), ("ScanChannel", "u1")]
+## Adjusted standard GPS time = GPS seconds since the start of GPS week 0 (1980-01-06) - 1e9
+GPS_WEEK_SECONDS = 7 * 24 * 3600
+
+# LAS public header, fields common to LAS 1.0 - 1.4 and the LAS 1.3/1.4 extension
+LAS_HEADER = struct.Struct("<4sHH16sBB32s32sHHHLLBHL5L3d3d6d")
+LAS_HEADER_14 = struct.Struct("<QQLQ15Q")
+LAS_VLR_HEADER = struct.Struct("<H16sHH32s")
+LAS_EVLR_HEADER = struct.Struct("<H16sHQ32s")
+# Byte offsets of the public header fields patched by the header-only tagging
+LAS_GLOBAL_ENCODING_AT = 6
+LAS_SYSTEM_ID_AT = 26
+LAS_POINT_OFFSET_AT = 96
+LAS_EVLR_OFFSET_AT = 235
+# Global encoding bit telling the SRS is stored as WKT
+LAS_WKT_BIT = 0x10
+# GeoTIFF keys/doubles/ascii and OGC WKT records of "LASF_Projection"
+LAS_SRS_RECORDS = {34735, 34736, 34737, 2111, 2112}
+SRS_WKT = dict()
+# Stage processes of the PIPELINED ring in this worker (see ring_stages), and the result each stage reports
+RING_STAGES = None
+RING_RESULTS = {"transform": "transforms", "write": "count"}
+
+# COPC info VLR (the first VLR, "copc" record 1) and the hierarchy entries of the "copc" record 1000 EVLR
+## https://copc.io, info = center xyz, halfsize, spacing, root hierarchy page offset/size, GPS time min/max, reserved
+## entry = voxel key (level, x, y, z), data offset, byte size, point count (-1 = the entry is a child page)
+COPC_USER_ID = "copc"
+COPC_INFO_RECORD_ID = 1
+COPC_HIERARCHY_RECORD_ID = 1000
+COPC_INFO = struct.Struct("<5d2Q2d11Q")
+COPC_ENTRY = struct.Struct("<4iQii")
+
+# LASzip VLR, the chunk size field in its payload and the chunk size marking variable sized chunks
+LASZIP_USER_ID = "laszip encoded"
+LASZIP_RECORD_ID = 22204
+LASZIP_CHUNK_SIZE_AT = 12
+LASZIP_VARIABLE_CHUNKS = 0xFFFFFFFF
+# Records writers.las writes from its own options (LASzip, extra bytes), never carried over by forward_vlrs
+LAS_WRITER_RECORDS = {(LASZIP_USER_ID, LASZIP_RECORD_ID), ("LASF_Spec", 4)}
+LAS_MAX_VLR_PAYLOAD = 0xFFFF
+
+# Point data record formats as NumPy structured dtypes (little endian, packed)
+LAS_POINT_0 = [
+    ("X", "<i4"), ("Y", "<i4"), ("Z", "<i4"),
+    ("intensity", "<u2"),
+    ("return_bits", "u1"),       # return number (3 bits), number of returns (3), scan direction, edge of flight line
+    ("classification", "u1"),    # class (5 bits), synthetic, key-point, withheld
+    ("scan_angle_rank", "i1"),
+    ("user_data", "u1"),
+    ("point_source_id", "<u2"),
+]
+LAS_GPS_TIME = [("gps_time", "<f8")]
+LAS_RGB = [("red", "<u2"), ("green", "<u2"), ("blue", "<u2")]
+LAS_POINT_FORMATS = {
+    0: np.dtype(LAS_POINT_0),
+    1: np.dtype(LAS_POINT_0 + LAS_GPS_TIME),
+    2: np.dtype(LAS_POINT_0 + LAS_RGB),
+    3: np.dtype(LAS_POINT_0 + LAS_GPS_TIME + LAS_RGB),
+    6: np.dtype([
+        ("X", "<i4"), ("Y", "<i4"), ("Z", "<i4"),
+        ("intensity", "<u2"),
+        ("return_bits", "u1"),   # return number (4 bits), number of returns (4)
+        ("flag_bits", "u1"),     # classification flags (4 bits), scanner channel (2), scan direction, edge of flight line
+        ("classification", "u1"),
+        ("user_data", "u1"),
+        ("scan_angle", "<i2"),   # 0.006 degree units
+        ("point_source_id", "<u2"),
+        ("gps_time", "<f8"),
+    ]),
+}
+
+def pool_worker(inbox, results) -> None:
+    # Runs the tasks the pool hands this worker one at a time until it is sent None
+    limit_worker_memory(MAX_WORKER_MEMORY)
+    while (task := inbox.get()) is not None:
+        task_id, func, args, kwargs = task
+        results.put(("started", task_id, os.getpid(), None))
+        try:
+            results.put(("done", task_id, func(*args, **kwargs), None))
+        except Exception:
+            results.put(("done", task_id, None, traceback.format_exc()))
+
+class WorkerDied(RuntimeError):
+    def __init__(self, pid, exitcode):
+        super().__init__(f"Worker process {pid} died with exit code {exitcode}")
+        self.exitcode = exitcode
+
+class PoolWorker:
+    # A worker process of WorkerPool with its own task queue, and the task it was handed (None = idle)
+    # The task is recorded before it is put on the queue, so a worker dying at any point fails the task it holds
+
+    def __init__(self, results):
+        self.inbox = multiprocessing.Queue()
+        # Not daemonic, daemonic processes cannot start the PIPELINED stage processes (shutdown joins the workers)
+        self.process = multiprocessing.Process(target=pool_worker, args=(self.inbox, results))
+        self.process.start()
+        self.task = None
+        self.files = 0
+        self.processed = 0
+
+class WorkerPool:
+    # Persistent worker processes keeping PDAL loaded between files, used as futures.Executor-like context manager
+    # on_start(future, pid) is called from the collector thread when a worker picks up a task
+    # Tasks wait in the pool until a worker is idle, a worker is replaced after max_files tasks or max_bytes input
+    # bytes, or when it dies (failing the task it held with WorkerDied)
+
+    def __init__(self, num_workers, max_files=MAX_FILES_PER_WORKER, max_bytes=MAX_BYTES_PER_WORKER, on_start=None):
+        self.num_workers = num_workers
+        self.on_start = on_start
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.results = multiprocessing.Queue()
+        self.pending = collections.deque()
+        self.futures = dict()
+        self.workers = dict()
+        self.task_ids = itertools.count()
+        self.closing = False
+        self.lock = threading.Lock()
+        with self.lock:
+            for _ in range(num_workers):
+                self.start_worker()
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def start_worker(self) -> None:
+        worker = PoolWorker(self.results)
+        self.workers[worker.process.pid] = worker
+
+    def submit(self, func, *args, size=0, **kwargs) -> futures.Future:
+        # size = input bytes, counted against MAX_BYTES_PER_WORKER
+        task_id = next(self.task_ids)
+        future = futures.Future()
+        with self.lock:
+            self.futures[task_id] = future
+            self.pending.append((task_id, func, args, kwargs, size))
+            self.dispatch()
+        return future
+
+    def dispatch(self) -> None:
+        # Hand pending tasks to idle workers, called holding lock
+        for worker in self.workers.values():
+            if not self.pending:
+                return
+            if worker.task is None:
+                task_id, func, args, kwargs, size = self.pending.popleft()
+                worker.task = task_id
+                worker.files += 1
+                worker.processed += size
+                worker.inbox.put((task_id, func, args, kwargs))
+
+    def collect(self) -> None:
+        while True:
+            try:
+                message = self.results.get(timeout=1)
+            except queue.Empty:
+                self.reap_dead_workers()
+                continue
+            if message is None:
+                return
+            kind, task_id, payload, error = message
+            if kind == "started":
+                if self.on_start is not None and task_id in self.futures:
+                    self.on_start(self.futures[task_id], payload)
+            elif kind == "done":
+                with self.lock:
+                    future = self.futures.pop(task_id)
+                    self.task_done(task_id)
+                if error:
+                    future.set_exception(RuntimeError(error))
+                else:
+                    future.set_result(payload)
+            elif kind == "died":
+                with self.lock:
+                    future = self.futures.pop(task_id, None)
+                if future is not None:
+                    future.set_exception(WorkerDied(payload, error))
+            self.reap_dead_workers()
+
+    def task_done(self, task_id) -> None:
+        # Free the worker that ran task_id, replacing it once it reached max_files or max_bytes, called holding lock
+        for pid, worker in list(self.workers.items()):
+            if worker.task != task_id:
+                continue
+            worker.task = None
+            if worker.files >= self.max_files or worker.processed >= self.max_bytes:
+                del self.workers[pid]
+                worker.inbox.put(None)
+                worker.process.join()
+                self.start_worker()
+        self.dispatch()
+
+    def reap_dead_workers(self) -> None:
+        # A worker killed by native code or the OOM killer is replaced, and the task it held failed with WorkerDied
+        # The failure is queued behind any result the worker queued before dying, so a finished task keeps its result
+        with self.lock:
+            for pid, worker in list(self.workers.items()):
+                if worker.process.exitcode is None:
+                    continue
+                del self.workers[pid]
+                if worker.task is not None:
+                    self.results.put(("died", worker.task, pid, worker.process.exitcode))
+                if not self.closing:
+                    self.start_worker()
+            self.dispatch()
+
+    def shutdown(self) -> None:
+        futures.wait(list(self.futures.values()))
+        with self.lock:
+            self.closing = True
+            workers = list(self.workers.values())
+        for worker in workers:
+            worker.inbox.put(None)
+        for worker in workers:
+            worker.process.join()
+        self.results.put(None)
+        self.collector.join()
+
+def file_fingerprint(filename) -> str:
+    size = os.path.getsize(filename)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(filename, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def manifest_key(ifile, ofile, params: dict) -> dict:
+    stat = os.stat(ifile)
+    return {
+        "input": Path(ifile).resolve().as_posix(),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "output": Path(ofile).resolve().as_posix(),
+        "params": params,
+    }
+
+def read_manifest(manifest) -> dict:
+    done = dict()
+    if os.path.exists(manifest):
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Last line cut short by a crash
+                done[entry["input"]] = entry
+    return done
+
+def is_done(entry, key: dict) -> bool:
+    # Cheap stat comparisons first, the fingerprint is only read for files that look finished
+    return (
+        entry is not None
+        and all(entry.get(field) == value for field, value in key.items())
+        and os.path.exists(key["output"])
+        and os.path.getsize(key["output"]) == entry["output_size"]
+        and file_fingerprint(key["input"]) == entry["fingerprint"]
     )
-    proc.start()
-    proc.join()
-    proc.close()
 
-def psky_tag14(ifile,ofile,epsg,sensorsys):
-    
+def las_header_or_none(filename):
+    try:
+        return read_las_header(filename)
+    except (OSError, ValueError):
+        return None
+
+def point_count(filename):
+    try:
+        return read_las_header(filename)["point_count"]
+    except (OSError, ValueError):
+        return None
+
+def run_atomic(func, ifile, ofile, *args, **kwargs):
+    # Write to a temporary name next to ofile and rename when complete, a partial output is never left as ofile
+    # Side products written as <part>.<suffix> are renamed along with it
+    # Returns func's result, the input fingerprint and the measurements of the file
+    # peak_rss is the peak of this file only (see task_peak_rss), None where it cannot be measured per file
+    part = f"{ofile}.part"
+    fingerprint = file_fingerprint(ifile)
+    measuring = reset_peak_rss()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        result = func(ifile, part, *args, **kwargs)
+        metrics = {
+            "seconds": time.perf_counter() - start,
+            "cpu_seconds": time.process_time() - cpu_start,
+            "peak_rss": task_peak_rss() if measuring else None,
+            "points_in": point_count(ifile),
+            "points_out": point_count(part),
+            "bytes_in": os.path.getsize(ifile),
+            "bytes_out": os.path.getsize(part),
+        }
+        for side_product in glob.glob(f"{glob.escape(part)}.*"):
+            os.replace(side_product, f"{ofile}{side_product[len(part):]}")
+        os.replace(part, ofile)
+    except BaseException:
+        for leftover in glob.glob(f"{glob.escape(part)}*"):
+            os.remove(leftover)
+        raise
+    return result, fingerprint, metrics
+
+def run_part(func, ifile, part_file, *args, start, count):
+    # One point range of a split file into its own LAZ, stitched by run_atomic(func, ..., parts=...) afterwards
+    measuring = reset_peak_rss()
+    cpu_start = time.process_time()
+    result = func(ifile, part_file, *args, start=start, count=count)
+    return result, {"cpu_seconds": time.process_time() - cpu_start,
+                    "peak_rss": task_peak_rss() if measuring else None}
+
+class BatchMetrics:
+    # Per-file JSON-lines events, rolling throughput/ETA summary and optional Prometheus textfile of a batch
+
+    def __init__(self, action: str, sizes: dict, events=None, prometheus=PROMETHEUS_TEXTFILE):
+        # sizes = {input file: bytes}
+        self.action = action
+        self.sizes = sizes
+        self.events = events
+        self.prometheus = prometheus
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.running = dict()
+        self.status = {"ok": 0, "error": 0, "died": 0}
+        self.points = 0
+        self.bytes_done = 0
+        self.last_summary = self.start
+
+    @property
+    def count(self) -> int:
+        return sum(self.status.values())
+
+    def emit(self, event: str, ifile, **fields) -> None:
+        if self.events is None:
+            return
+        record = {"time": time.time(), "event": event, "action": self.action, "file": ifile, **fields}
+        with self.lock, open(self.events, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def started(self, ifile, pid) -> None:
+        self.running[ifile] = (pid, time.time())
+        self.emit("start", ifile, pid=pid, bytes_in=self.sizes[ifile])
+
+    def finished(self, ifile, metrics: dict) -> None:
+        self.running.pop(ifile, None)
+        self.status["ok"] += 1
+        self.points += metrics["points_in"] or 0
+        self.bytes_done += self.sizes[ifile]
+        self.emit("end", ifile, status="ok", **metrics)
+        rate = (metrics["points_in"] or 0) / metrics["seconds"] if metrics["seconds"] else 0
+        print(
+            f"File {self.action} [{self.count}/{len(self.sizes)} ({self.count/len(self.sizes)*100: >4.1f}%)] "
+            f"{metrics['seconds']:.1f} s, {rate/1e6:.2f} Mpts/s: {ifile!r}"
+        )
+
+    def failed(self, ifile, exc: Exception) -> None:
+        self.running.pop(ifile, None)
+        status = "died" if isinstance(exc, WorkerDied) else "error"
+        self.status[status] += 1
+        self.bytes_done += self.sizes[ifile]
+        self.emit("end", ifile, status=status, exitcode=getattr(exc, "exitcode", None), error=str(exc))
+        print(f"File failed [{self.count}/{len(self.sizes)}]: {ifile!r}\n{exc}", file=sys.stderr)
+
+    def eta(self):
+        # Remaining input bytes at the byte rate so far
+        elapsed = time.time() - self.start
+        if not self.bytes_done:
+            return None
+        return elapsed * (sum(self.sizes.values()) - self.bytes_done) / self.bytes_done
+
+    def summary(self) -> str:
+        elapsed = time.time() - self.start
+        eta = self.eta()
+        return (
+            f"{self.count}/{len(self.sizes)} files {self.action}, {self.status['error'] + self.status['died']} failed, "
+            f"{self.points/elapsed/1e6 if elapsed else 0:.2f} Mpts/s, "
+            f"ETA {timedelta(seconds=round(eta)) if eta is not None else 'unknown'}"
+        )
+
+    def update(self, final=False) -> None:
+        # Called from the batch loop at least every PROGRESS_INTERVAL seconds
+        now = time.time()
+        if final or now - self.last_summary >= PROGRESS_INTERVAL:
+            print(self.summary())
+            self.last_summary = now
+        self.write_prometheus()
+
+    def write_prometheus(self) -> None:
+        if self.prometheus is None:
+            return
+        now = time.time()
+        label = f'action="{self.action}"'
+        lines = [
+            "# HELP psky_files Files in the batch.",
+            "# TYPE psky_files gauge",
+            f"psky_files{{{label}}} {len(self.sizes)}",
+            "# HELP psky_files_done Files finished in the batch by exit status.",
+            "# TYPE psky_files_done gauge",
+            *(f'psky_files_done{{{label},status="{status}"}} {n}' for status, n in self.status.items()),
+            "# HELP psky_points_done Input points of the files finished.",
+            "# TYPE psky_points_done gauge",
+            f"psky_points_done{{{label}}} {self.points}",
+            "# HELP psky_points_per_second Input points per second since the batch started.",
+            "# TYPE psky_points_per_second gauge",
+            f"psky_points_per_second{{{label}}} {self.points / max(now - self.start, 1e-9):.1f}",
+            "# HELP psky_eta_seconds Estimated seconds until the batch is finished.",
+            "# TYPE psky_eta_seconds gauge",
+            f"psky_eta_seconds{{{label}}} {self.eta() if self.eta() is not None else 'NaN'}",
+            "# HELP psky_worker_file_seconds Seconds the worker has spent on its current file.",
+            "# TYPE psky_worker_file_seconds gauge",
+            *(
+                f'psky_worker_file_seconds{{{label},pid="{pid}",file="{Path(ifile).name}"}} {now - since:.1f}'
+                for ifile, (pid, since) in list(self.running.items())
+            ),
+            "# HELP psky_last_update_timestamp_seconds Time of the last update of this file.",
+            "# TYPE psky_last_update_timestamp_seconds gauge",
+            f"psky_last_update_timestamp_seconds{{{label}}} {now:.0f}",
+        ]
+        # Written under a temporary name and renamed so node_exporter never reads a partial file
+        part = f"{self.prometheus}.part"
+        with open(part, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(part, self.prometheus)
+
+def open_catalog(filename) -> sqlite3.Connection:
+    connection = sqlite3.connect(filename)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            source TEXT,
+            size INTEGER,
+            points INTEGER,
+            version TEXT,
+            point_format INTEGER,
+            compressed INTEGER,
+            srs TEXT,
+            system_id TEXT,
+            minx REAL, miny REAL, minz REAL,
+            maxx REAL, maxy REAL, maxz REAL,
+            gps_time_min REAL,
+            gps_time_max REAL,
+            classes TEXT
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS files_rtree USING rtree(id, minx, maxx, miny, maxy);
+    """)
+    return connection
+
+def catalog_file(connection: sqlite3.Connection, ofile, ifile=None, summary=None) -> None:
+    # Header fields of ofile, bounds/GPS time/classes from the streamed summary when the points were read
+    header = read_las_header(ofile)
+    summary = summary or dict()
+    bounds = summary.get("bounds") or {
+        "minx": header["mins"][0], "miny": header["mins"][1], "minz": header["mins"][2],
+        "maxx": header["maxs"][0], "maxy": header["maxs"][1], "maxz": header["maxs"][2],
+    }
+    gps_time = summary.get("gps_time") or (None, None)
+    classes = summary.get("classes")
+    path = Path(ofile).resolve().as_posix()
+    with connection:
+        connection.execute("""
+            INSERT INTO files (path, source, size, points, version, point_format, compressed, srs, system_id,
+                               minx, miny, minz, maxx, maxy, maxz, gps_time_min, gps_time_max, classes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                source = excluded.source, size = excluded.size, points = excluded.points,
+                version = excluded.version, point_format = excluded.point_format,
+                compressed = excluded.compressed, srs = excluded.srs, system_id = excluded.system_id,
+                minx = excluded.minx, miny = excluded.miny, minz = excluded.minz,
+                maxx = excluded.maxx, maxy = excluded.maxy, maxz = excluded.maxz,
+                gps_time_min = excluded.gps_time_min, gps_time_max = excluded.gps_time_max,
+                classes = excluded.classes
+        """, (
+            path,
+            Path(ifile).resolve().as_posix() if ifile else None,
+            os.path.getsize(ofile),
+            summary.get("points", header["point_count"]),
+            header["version"],
+            header["point_format"],
+            header["compressed"],
+            read_las_wkt(ofile, header),
+            header["system_id"],
+            bounds["minx"], bounds["miny"], bounds["minz"],
+            bounds["maxx"], bounds["maxy"], bounds["maxz"],
+            gps_time[0], gps_time[1],
+            json.dumps(classes) if classes is not None else None,
+        ))
+        (file_id,) = connection.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        connection.execute(
+            "INSERT OR REPLACE INTO files_rtree VALUES (?, ?, ?, ?, ?)",
+            (file_id, bounds["minx"], bounds["maxx"], bounds["miny"], bounds["maxy"]),
+        )
+
+def query_catalog(filename, minx, miny, maxx, maxy) -> list:
+    # Paths of the catalogued files whose XY bounds intersect the box
+    with closing(sqlite3.connect(filename)) as connection:
+        rows = connection.execute("""
+            SELECT files.path FROM files_rtree JOIN files ON files.id = files_rtree.id
+            WHERE files_rtree.maxx >= ? AND files_rtree.minx <= ? AND files_rtree.maxy >= ? AND files_rtree.miny <= ?
+            ORDER BY files.path
+        """, (minx, maxx, miny, maxy)).fetchall()
+    return [path for (path,) in rows]
+
+class Staging:
+    # Copies of the inputs on local scratch disk made ahead of the workers, outputs are written next to them and
+    # moved to their destination in the background
+    # At most max_files inputs are held (copying, waiting or running) and max_bytes reserved, a file larger than
+    # max_bytes is staged alone
+
+    def __init__(self, scratch, max_files, max_bytes=SCRATCH_BYTES, prefetch=PREFETCH_FILES):
+        Path(scratch).mkdir(parents=True, exist_ok=True)
+        self.folder = Path(tempfile.mkdtemp(prefix="psky_", dir=scratch))
+        (self.folder / "in").mkdir()
+        (self.folder / "out").mkdir()
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.held = dict()
+        self.reserved = 0
+        self.closing = False
+        self.budget = threading.Condition()
+        self.names = itertools.count()
+        self.copier = futures.ThreadPoolExecutor(prefetch)
+        self.mover = futures.ThreadPoolExecutor(1)
+
+    def fetch(self, ifile, args: tuple) -> futures.Future:
+        # Future of args with the input and output replaced by their scratch paths
+        return self.copier.submit(self.copy_in, ifile, args)
+
+    def copy_in(self, ifile, args: tuple) -> tuple:
+        reserve = 2 * os.path.getsize(ifile)
+        with self.budget:
+            self.budget.wait_for(lambda: self.closing or not self.held or (
+                len(self.held) < self.max_files and self.reserved + reserve <= self.max_bytes
+            ))
+            if self.closing:
+                raise RuntimeError(f"Staging closed before {ifile!r} was copied")
+            number = next(self.names)
+            local_in = self.folder / "in" / f"{number:06d}_{Path(ifile).name}"
+            local_out = self.folder / "out" / f"{number:06d}_{Path(args[1]).name}"
+            self.held[ifile] = (local_in, local_out, reserve)
+            self.reserved += reserve
+        try:
+            shutil.copyfile(ifile, local_in)
+        except BaseException:
+            self.release(ifile)
+            raise
+        return (local_in.as_posix(), local_out.as_posix(), *args[2:])
+
+    def finish(self, ifile, ofile) -> futures.Future:
+        # Future of moving the output (and its side products) of ifile to ofile
+        return self.mover.submit(self.move_out, ifile, ofile)
+
+    def move_out(self, ifile, ofile) -> None:
+        _, local_out, _ = self.held[ifile]
+        try:
+            # Side products first, the output appears last and complete under its name
+            for side_product in glob.glob(f"{glob.escape(local_out.as_posix())}.*"):
+                move_file(side_product, f"{ofile}{side_product[len(local_out.as_posix()):]}")
+            move_file(local_out, ofile)
+        finally:
+            self.release(ifile)
+
+    def release(self, ifile) -> None:
+        # Remove what is left of ifile on scratch and free its reservation
+        with self.budget:
+            if ifile not in self.held:
+                return
+            local_in, local_out, reserve = self.held.pop(ifile)
+            for leftover in [local_in, *glob.glob(f"{glob.escape(local_out.as_posix())}*")]:
+                Path(leftover).unlink(missing_ok=True)
+            self.reserved -= reserve
+            self.budget.notify_all()
+
+    def close(self) -> None:
+        with self.budget:
+            self.closing = True
+            self.budget.notify_all()
+        self.copier.shutdown(cancel_futures=True)
+        self.mover.shutdown()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+def move_file(src, dst) -> None:
+    # Across file systems under a temporary name, renamed once complete
+    part = f"{dst}.part"
+    shutil.move(src, part)
+    os.replace(part, dst)
+
+def physical_memory():
+    # Bytes of RAM in the machine, None where the platform does not report it
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def available_memory():
+    # Bytes the kernel can hand out without swapping (MemAvailable), None outside Linux
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def task_memory(points: int, record_length=0) -> int:
+    # Estimated peak memory of a task on points points of record_length bytes each
+    # Streamed, the chunks in flight are bounded by stream_chunk_size, only with ALLOW_IN_MEMORY can a pipeline (and
+    # the COPC octree) hold the whole file (the PDAL points and the encoded records)
+    # With SORT_ORDER, a sort run of up to sort_run_points points (and its sorted copy) is held besides the chunks
+    processes, chunks = (3, 3 + RING_SLOTS) if PIPELINED else (1, 3)
+    streamed = points
+    if not (ALLOW_IN_MEMORY or COPC_OUTPUT):
+        chunk_size = stream_chunk_size(
+            memory_limit=MAX_WORKER_MEMORY, pipelined=PIPELINED, sorting=SORT_ORDER is not None,
+        )
+        streamed = min(points, chunks * chunk_size)
+    memory = processes * WORKER_BASE_MEMORY + streamed * (POINT_BYTES + record_length)
+    if SORT_ORDER is not None:
+        run_points = sort_run_points(MAX_WORKER_MEMORY, pipelined=PIPELINED)
+        memory += min(points, points if run_points is None else run_points) * (2 * POINT_BYTES + 16)
+    return memory
+
+class MemoryScheduler:
+    # Admission of tasks by estimated memory, the running estimates together stay within budget (None = no limit)
+    # A task is always admitted when nothing runs, so a file larger than the budget still runs alone
+    # The estimates are scaled by factor, a moving average of the peak RSS of each finished task over its estimate
+    # The peak must be that of the task alone (task_peak_rss), a worker lifetime peak would ratchet factor up after
+    # one large file, tasks without a per-task peak (None) leave factor unchanged
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.admitted = dict()
+        self.factor = 1.0
+
+    def fits(self, estimate: int) -> bool:
+        if not self.admitted:
+            return True
+        if self.budget is not None and self.factor * (sum(self.admitted.values()) + estimate) > self.budget:
+            return False
+        # Memory taken by other programs on the machine counts too
+        available = available_memory()
+        return available is None or self.factor * estimate <= available
+
+    def admit(self, task, estimate: int) -> None:
+        self.admitted[task] = estimate
+
+    def release(self, task, peak=None) -> None:
+        estimate = self.admitted.pop(task)
+        if peak:
+            self.factor = min(max(0.8 * self.factor + 0.2 * peak / estimate, 0.25), 4.0)
+
+def run_batch(func, jobs: dict, action: str, workers=None, manifest=None, params=None, catalog=None,
+              events=None, scratch=None, routes=None) -> dict:
+    # jobs = {input file: (input file, output file, *func arguments)}, returns {input file: func result or exception}
+    # With a manifest, jobs recorded as done with the same input, output and params are skipped
+    # With a catalog, every output is recorded with its header fields and the summary returned by func
+    # With events, start/end of every file is appended as JSON lines (see BatchMetrics)
+    # Inputs larger than SPLIT_SIZE are split into point ranges when func takes parts (see psky_12_to_14)
+    # With scratch (None = SCRATCH_DIR), inputs and outputs are staged on local disk (see Staging)
+    # Tasks are started largest first while their estimated memory fits MEMORY_BUDGET (see MemoryScheduler)
+    # routes = {input file: function run instead of func} (see preflight)
+    outcome = dict()
+    funcs = {ifile: (routes or dict()).get(ifile, func) for ifile in jobs}
+    scratch = SCRATCH_DIR if scratch is None else scratch
+    keys = {ifile: manifest_key(ifile, args[1], params) for ifile, args in jobs.items()}
+    if manifest is not None:
+        Path(manifest).parent.mkdir(parents=True, exist_ok=True)
+        done = read_manifest(manifest)
+        with futures.ThreadPoolExecutor(workers or num_workers) as executor:
+            finished = list(executor.map(lambda key: is_done(done.get(key["input"]), key), keys.values()))
+        jobs = {ifile: args for (ifile, args), skip in zip(jobs.items(), finished) if not skip}
+        if sum(finished):
+            print(f"Skipping {sum(finished)} file(s) already {action} according to {manifest}")
+    splits = dict()
+    if SPLIT_SIZE is not None and lazrs is not None:
+        for ifile in jobs:
+            if keys[ifile]["size"] > SPLIT_SIZE and "parts" in inspect.signature(funcs[ifile]).parameters:
+                try:
+                    ranges = split_points(ifile, -(-keys[ifile]["size"] // SPLIT_SIZE))
+                except (OSError, ValueError):
+                    continue  # Left to the whole-file task to report
+                if len(ranges) > 1:
+                    splits[ifile] = ranges
+    # Largest first, the last files to finish are then small ones
+    jobs = dict(sorted(jobs.items(), key=lambda job: keys[job[0]]["size"], reverse=True))
+    with futures.ThreadPoolExecutor(workers or num_workers) as executor:
+        headers = dict(zip(jobs, executor.map(las_header_or_none, jobs)))
+    budget = MEMORY_BUDGET
+    if budget is None and physical_memory() is not None:
+        budget = int(MEMORY_SHARE * physical_memory())
+    scheduler = MemoryScheduler(budget)
+    if budget is not None:
+        print(f"Memory budget {budget / 1024**3:.1f} GiB for up to {workers or num_workers} worker(s)")
+    connection = open_catalog(catalog) if catalog is not None else None
+    metrics = BatchMetrics(action, {ifile: keys[ifile]["size"] for ifile in jobs}, events)
+    staging = Staging(scratch, (workers or num_workers) + PREFETCH_FILES) if scratch is not None else None
+    # to_do = {future: input file} of whole files and stitches, parts = {future: (input file, part index)}
+    # staged/moved = {future: input file} of copies to and moves from scratch
+    to_do = dict()
+    parts = dict()
+    staged = dict()
+    moved = dict()
+    part_results = {ifile: [None] * len(ranges) for ifile, ranges in splits.items()}
+    # Arguments the tasks run with (the staged copies with scratch), results of outputs still being moved
+    task_args = dict(jobs)
+    finished = dict()
+    # Tasks waiting for memory as a heap of (-input bytes, order, estimate, futures dict, key, call, keywords)
+    ready = []
+    order = itertools.count()
+    # A worker can pick up a task before submit has returned its future
+    submitting = threading.Lock()
+
+    def on_start(future, pid) -> None:
+        with submitting:
+            ifile = to_do[future] if future in to_do else parts[future][0]
+        if ifile not in metrics.running:
+            metrics.started(ifile, pid)
+
+    def part_done(future) -> None:
+        # Queue the stitch once every part of the file is done, unless one failed
+        ifile, index = parts[future]
+        results = part_results[ifile]
+        try:
+            results[index] = future.result()
+        except Exception as exc:
+            results[index] = exc
+        if any(result is None for result in results):
+            return
+        ofile = task_args[ifile][1]
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            for leftover in glob.glob(f"{glob.escape(ofile)}.part*"):
+                os.remove(leftover)
+            failed(ifile, errors[0])
+            return
+        stitched = [(f"{ofile}.part{i:04d}", stats) for i, (stats, _) in enumerate(results)]
+        # Stitching copies the compressed chunks, it holds no points
+        queue_task(keys[ifile]["size"], task_memory(0), to_do, ifile, run_atomic, funcs[ifile], *task_args[ifile],
+                   parts=stitched)
+
+    def estimate(ifile, points=None) -> int:
+        header = headers[ifile]
+        if header is None:
+            return task_memory(0)  # Unreadable, the task fails on opening it
+        return task_memory(header["point_count"] if points is None else points, header["record_length"])
+
+    def queue_task(work, memory, tasks, key, *call, **kwargs) -> None:
+        # work = input bytes the task belongs to, memory = its estimate
+        heapq.heappush(ready, (-work, next(order), memory, tasks, key, call, kwargs))
+
+    def queue(ifile, args) -> None:
+        task_args[ifile] = args
+        size = keys[ifile]["size"]
+        if ifile not in splits:
+            queue_task(size, estimate(ifile), to_do, ifile, run_atomic, funcs[ifile], *args, size=size)
+            return
+        for index, (start, count) in enumerate(splits[ifile]):
+            queue_task(size, estimate(ifile, count), parts, (ifile, index), run_part, funcs[ifile], args[0],
+                       f"{args[1]}.part{index:04d}", *args[2:], start=start, count=count,
+                       size=size // len(splits[ifile]))
+
+    def dispatch() -> list:
+        # Start the largest waiting tasks while they fit, a task that does not fit holds back the smaller ones
+        started = []
+        while ready and len(scheduler.admitted) < pool.num_workers and scheduler.fits(ready[0][2]):
+            _, _, memory, tasks, key, call, kwargs = heapq.heappop(ready)
+            with submitting:
+                future = pool.submit(*call, **kwargs)
+                tasks[future] = key
+            scheduler.admit(future, memory)
+            started.append(future)
+        return started
+
+    def record(ifile, fingerprint, file_metrics) -> None:
+        # Output of ifile complete at its destination
+        if manifest is not None:
+            entry = {
+                **keys[ifile],
+                "fingerprint": fingerprint,
+                "output_size": os.path.getsize(keys[ifile]["output"]),
+            }
+            with open(manifest, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        if connection is not None:
+            summary = outcome[ifile] if isinstance(outcome[ifile], dict) else None
+            catalog_file(connection, keys[ifile]["output"], ifile, summary)
+        metrics.finished(ifile, file_metrics)
+
+    def failed(ifile, exc) -> None:
+        outcome[ifile] = exc
+        metrics.failed(ifile, exc)
+        if staging is not None:
+            staging.release(ifile)
+
+    try:
+        with WorkerPool(workers or num_workers, on_start=on_start) as pool:
+            pending = set()
+            for ifile, args in jobs.items():
+                if staging is None:
+                    queue(ifile, args)
+                else:
+                    future = staging.fetch(ifile, args)
+                    staged[future] = ifile
+                    pending.add(future)
+            pending.update(dispatch())
+            while pending:
+                done, pending = futures.wait(pending, timeout=PROGRESS_INTERVAL, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in staged:
+                        ifile = staged.pop(future)
+                        try:
+                            queue(ifile, future.result())
+                        except Exception as exc:
+                            failed(ifile, exc)
+                        continue
+                    if future in moved:
+                        ifile = moved.pop(future)
+                        try:
+                            future.result()
+                        except Exception as exc:
+                            failed(ifile, exc)
+                            continue
+                        record(ifile, *finished.pop(ifile))
+                        continue
+                    # run_atomic and run_part both return the measurements of the task last, peak_rss is the peak
+                    # of that task alone or None
+                    scheduler.release(future, None if future.exception() else future.result()[-1]["peak_rss"])
+                    if future in parts:
+                        part_done(future)
+                        continue
+                    ifile = to_do[future]
+                    try:
+                        outcome[ifile], fingerprint, file_metrics = future.result()
+                    except Exception as exc:
+                        failed(ifile, exc)
+                        continue
+                    if ifile in part_results:
+                        # Measured from the first part started to the end of the stitch
+                        part_metrics = [metrics for _, metrics in part_results[ifile]]
+                        file_metrics["seconds"] = time.time() - metrics.running.get(ifile, (None, time.time()))[1]
+                        file_metrics["cpu_seconds"] += sum(part["cpu_seconds"] for part in part_metrics)
+                        file_metrics["peak_rss"] = max(part["peak_rss"] or 0 for part in [file_metrics, *part_metrics])
+                        file_metrics["parts"] = len(part_metrics)
+                    if staging is None:
+                        record(ifile, fingerprint, file_metrics)
+                        continue
+                    finished[ifile] = (fingerprint, file_metrics)
+                    future = staging.finish(ifile, jobs[ifile][1])
+                    moved[future] = ifile
+                    pending.add(future)
+                pending.update(dispatch())
+                metrics.update()
+    finally:
+        if staging is not None:
+            staging.close()
+    metrics.update(final=True)
+    if connection is not None:
+        connection.close()
+    return outcome
+
+def read_las_header(filename) -> dict:
+    with open(filename, "rb") as f:
+        raw = f.read(LAS_HEADER.size + LAS_HEADER_14.size)
+    if len(raw) < LAS_HEADER.size or raw[:4] != b"LASF":
+        raise ValueError(f"Not a LAS/LAZ file: {filename!r}")
+    (_, source_id, encoding, guid, major, minor, system_id, software_id, doy, year,
+     header_size, point_offset, vlr_count, point_format, record_length, legacy_count,
+     *rest) = LAS_HEADER.unpack_from(raw)
+    header = {
+        "file_source_id": source_id,
+        "global_encoding": encoding,
+        "project_id": str(uuid.UUID(bytes_le=guid)),
+        "minor_version": minor,
+        "version": f"{major}.{minor}",
+        "system_id": system_id.rstrip(b"\0").decode("ascii", "replace"),
+        "software_id": software_id.rstrip(b"\0").decode("ascii", "replace"),
+        "creation_doy": doy,
+        "creation_year": year,
+        "header_size": header_size,
+        "point_offset": point_offset,
+        "vlr_count": vlr_count,
+        # Bit 7 (and 6 for old LAZ) flags laszip compressed point data
+        "point_format": point_format & 0x3F,
+        "compressed": bool(point_format & 0xC0),
+        "record_length": record_length,
+        "point_count": legacy_count,
+        "points_by_return": rest[:5],
+        "scale": rest[5:8],
+        "offset": rest[8:11],
+        "mins": rest[12:17:2],
+        "maxs": rest[11:17:2],
+        "evlr_offset": 0,
+        "evlr_count": 0,
+    }
+    if minor >= 4 and header_size >= LAS_HEADER.size + LAS_HEADER_14.size:
+        _, evlr_offset, evlr_count, point_count, *by_return = LAS_HEADER_14.unpack_from(raw, LAS_HEADER.size)
+        header["evlr_offset"] = evlr_offset
+        header["evlr_count"] = evlr_count
+        header["point_count"] = point_count or legacy_count
+        header["points_by_return"] = tuple(by_return) if point_count else rest[:5]
+    return header
+
+def pack_las_header(header: dict) -> bytes:
+    # Inverse of read_las_header for LAS 1.2 and 1.4 headers
+    # A larger header_size (user data after the header) is kept, the caller writes those bytes
+    minor = header["minor_version"]
+    header_size = max(LAS_HEADER.size + (LAS_HEADER_14.size if minor >= 4 else 0), header.get("header_size", 0))
+    by_return = list(header.get("points_by_return", ())) + [0] * 15
+    # Legacy counts stay zero for the LAS 1.4 only point formats
+    legacy = header["point_format"] < 6 and header["point_count"] < 2**32
+    raw = LAS_HEADER.pack(
+        b"LASF",
+        header.get("file_source_id", 0),
+        header.get("global_encoding", 0),
+        uuid.UUID(header.get("project_id", str(uuid.UUID(int=0)))).bytes_le,
+        1,
+        minor,
+        header.get("system_id", "").encode("ascii")[:32],
+        header.get("software_id", "").encode("ascii")[:32],
+        header.get("creation_doy", 0),
+        header.get("creation_year", 0),
+        header_size,
+        header.get("point_offset", header_size),
+        header.get("vlr_count", 0),
+        header["point_format"] | (0x80 if header.get("compressed") else 0),
+        header["record_length"],
+        header["point_count"] if legacy else 0,
+        *(by_return[:5] if legacy else [0] * 5),
+        *header["scale"],
+        *header["offset"],
+        header["maxs"][0], header["mins"][0],
+        header["maxs"][1], header["mins"][1],
+        header["maxs"][2], header["mins"][2],
+    )
+    if minor >= 4:
+        raw += LAS_HEADER_14.pack(
+            0,
+            header.get("evlr_offset", 0),
+            header.get("evlr_count", 0),
+            header["point_count"],
+            *by_return[:15],
+        )
+    return raw
+
+def read_las_vlrs(filename, header: dict) -> list:
+    # (user_id, record_id, payload, extended) for every VLR and EVLR in the file
+    vlrs = []
+    with open(filename, "rb") as f:
+        f.seek(header["header_size"])
+        for _ in range(header["vlr_count"]):
+            _, user_id, record_id, length, _ = LAS_VLR_HEADER.unpack(f.read(LAS_VLR_HEADER.size))
+            vlrs.append((user_id.rstrip(b"\0").decode("ascii", "replace"), record_id, f.read(length), False))
+        if header["evlr_count"]:
+            f.seek(header["evlr_offset"])
+            for _ in range(header["evlr_count"]):
+                _, user_id, record_id, length, _ = LAS_EVLR_HEADER.unpack(f.read(LAS_EVLR_HEADER.size))
+                vlrs.append((user_id.rstrip(b"\0").decode("ascii", "replace"), record_id, f.read(length), True))
+    return vlrs
+
+def read_las_wkt(filename, header: dict):
+    for user_id, record_id, payload, _ in read_las_vlrs(filename, header):
+        if user_id == "LASF_Projection" and record_id == 2112:
+            return payload.rstrip(b"\0").decode("utf-8", "replace")
+    return None
+
+def forward_header(header: dict) -> dict:
+    # writers.las options carrying the input header over when points are fed from memory
+    return {
+        "filesource_id": header["file_source_id"],
+        "global_encoding": header["global_encoding"] & 0x1,
+        "project_id": header["project_id"],
+        "system_id": header["system_id"],
+        "software_id": header["software_id"],
+        "creation_doy": header["creation_doy"],
+        "creation_year": header["creation_year"],
+        "scale_x": header["scale"][0],
+        "scale_y": header["scale"][1],
+        "scale_z": header["scale"][2],
+        "offset_x": header["offset"][0],
+        "offset_y": header["offset"][1],
+        "offset_z": header["offset"][2],
+    }
+
+def forward_vlrs(filename, header: dict, evlrs=True) -> list:
+    # writers.las "vlrs" option carrying the VLRs and EVLRs of filename over when points are fed from memory
+    # Left out are the SRS (written from a_srs), the records of LAS_WRITER_RECORDS and the COPC records, which only
+    # describe the layout of the input, without evlrs (LAS 1.2 output) also records too large for a VLR
+    vlrs = []
+    for user_id, record_id, payload, _ in read_las_vlrs(filename, header):
+        if (
+            (user_id == "LASF_Projection" and record_id in LAS_SRS_RECORDS)
+            or (user_id, record_id) in LAS_WRITER_RECORDS
+            or user_id == COPC_USER_ID
+        ):
+            continue
+        if not evlrs and len(payload) > LAS_MAX_VLR_PAYLOAD:
+            print(f"WARNING: EVLR {user_id!r} {record_id} ({len(payload)} bytes) cannot be kept in LAS 1.2: {filename!r}",
+                  file=sys.stderr)
+            continue
+        vlrs.append({"user_id": user_id, "record_id": record_id, "data": base64.b64encode(payload).decode("ascii")})
+    return vlrs
+
+def laszip_vlr(filename, header: dict):
+    # The LASzip VLR of filename as lazrs reads it
+    for user_id, record_id, payload, _ in read_las_vlrs(filename, header):
+        if user_id == LASZIP_USER_ID and record_id == LASZIP_RECORD_ID:
+            try:
+                return lazrs.LazVlr(payload)
+            except lazrs.LazrsError as exc:
+                raise ValueError(f"Unreadable LASzip VLR in {filename!r}: {exc}") from exc
+    raise ValueError(f"No LASzip VLR in {filename!r}")
+
+def read_chunk_table(filename, header: dict) -> dict:
+    # Points and compressed bytes of every chunk of a LAZ file, and where the chunk data ends
+    vlr = laszip_vlr(filename, header)
+    chunk_size = vlr.chunk_size()
+    with open(filename, "rb") as f:
+        f.seek(header["point_offset"])
+        (table_offset,) = struct.unpack("<q", f.read(8))
+        if table_offset == -1:
+            # Writers that cannot seek back store the offset in the last 8 bytes
+            f.seek(-8, os.SEEK_END)
+            (table_offset,) = struct.unpack("<q", f.read(8))
+        f.seek(table_offset)
+        (version,) = struct.unpack("<L", f.read(4))
+        if version != 0:
+            raise ValueError(f"Unknown LAZ chunk table version {version} in {filename!r}")
+        f.seek(table_offset)
+        try:
+            table = lazrs.read_chunk_table_only(f, vlr)
+        except lazrs.LazrsError as exc:
+            raise ValueError(f"Unreadable LAZ chunk table in {filename!r}: {exc}") from exc
+    counts = [count for count, _ in table]
+    sizes = [size for _, size in table]
+    # With a fixed chunk size the table holds no counts, every chunk is full but the last
+    if chunk_size != LASZIP_VARIABLE_CHUNKS and table:
+        counts = [chunk_size] * (len(table) - 1) + [header["point_count"] - chunk_size * (len(table) - 1)]
+    return {"chunk_size": chunk_size, "counts": counts, "sizes": sizes, "table_offset": table_offset}
+
+def pack_chunk_table(counts: list, sizes: list, vlr) -> bytes:
+    # Counts are only written for a LASzip VLR with variable sized chunks
+    table = io.BytesIO()
+    lazrs.write_chunk_table(table, list(zip(counts, sizes)), vlr)
+    return table.getvalue()
+
+def stitch_laz(part_files: list, ofile) -> None:
+    # Concatenate the chunks of LAZ files written with the same header settings into one LAZ file
+    # The chunks are copied byte for byte, only the header and the chunk table are rewritten
+    headers = [read_las_header(part) for part in part_files]
+    tables = [read_chunk_table(part, header) for part, header in zip(part_files, headers)]
+    first = headers[0]
+    for part, header in zip(part_files, headers):
+        if (header["scale"], header["offset"], header["point_format"]) != (first["scale"], first["offset"], first["point_format"]):
+            raise ValueError(f"Scale, offset or point format of {part!r} differs from {part_files[0]!r}")
+    counts = [count for table in tables for count in table["counts"]]
+    sizes = [size for table in tables for size in table["sizes"]]
+    # A fixed chunk size only holds if every chunk but the last is full
+    chunk_size = tables[0]["chunk_size"]
+    variable = chunk_size == LASZIP_VARIABLE_CHUNKS or any(count != chunk_size for count in counts[:-1])
+    merged = {
+        **first,
+        "point_count": sum(header["point_count"] for header in headers),
+        "points_by_return": [sum(by_return) for by_return in zip(*(header["points_by_return"] for header in headers))],
+        "mins": [min(header["mins"][axis] for header in headers) for axis in range(3)],
+        "maxs": [max(header["maxs"][axis] for header in headers) for axis in range(3)],
+    }
+    evlrs = [vlr for vlr in read_las_vlrs(part_files[0], first) if vlr[3]]
+
+    with open(part_files[0], "rb") as f:
+        prefix = bytearray(f.read(first["point_offset"]))
+    at = first["header_size"]
+    for _ in range(first["vlr_count"]):
+        _, user_id, record_id, length, _ = LAS_VLR_HEADER.unpack_from(prefix, at)
+        at += LAS_VLR_HEADER.size
+        if user_id.rstrip(b"\0").decode("ascii", "replace") == LASZIP_USER_ID and record_id == LASZIP_RECORD_ID:
+            if variable:
+                struct.pack_into("<L", prefix, at + LASZIP_CHUNK_SIZE_AT, LASZIP_VARIABLE_CHUNKS)
+            vlr = lazrs.LazVlr(bytes(prefix[at:at + length]))
+        at += length
+    with open(ofile, "wb") as dst:
+        dst.write(prefix)
+        dst.write(struct.pack("<q", -1))
+        for part, header, table in zip(part_files, headers, tables):
+            chunks_start = header["point_offset"] + 8
+            if sum(table["sizes"]) != table["table_offset"] - chunks_start:
+                raise ValueError(f"LAZ chunk table of {part!r} does not match its point data")
+            with open(part, "rb") as src:
+                src.seek(chunks_start)
+                copy_bytes(src, dst, table["table_offset"] - chunks_start)
+        table_offset = dst.tell()
+        dst.write(pack_chunk_table(counts, sizes, vlr))
+        merged["evlr_offset"] = dst.tell() if evlrs else 0
+        for vlr in evlrs:
+            dst.write(pack_vlr(*vlr[:3], extended=True))
+        public = pack_las_header(merged)
+        prefix[:len(public)] = public
+        dst.seek(0)
+        dst.write(prefix)
+        dst.write(struct.pack("<q", table_offset))
+
+def stitch_parts(parts: list, ofile) -> "PointStats":
+    # parts = [(part file, PointStats)] in point order, the part files are removed once ofile is written
+    stitch_laz([part for part, _ in parts], ofile)
+    stats = parts[0][1]
+    for _, part_stats in parts[1:]:
+        stats.merge(part_stats)
+    for part, _ in parts:
+        os.remove(part)
+    return stats
+
+def split_points(ifile, parts: int) -> list:
+    # (start, count) point ranges of about equal size, LAZ files are cut at chunk boundaries and balanced on
+    # compressed bytes so a reader can seek straight to each range
+    header = read_las_header(ifile)
+    if not header["compressed"]:
+        step = max(1, -(-header["point_count"] // parts))
+        return [(start, min(step, header["point_count"] - start)) for start in range(0, header["point_count"], step)]
+    table = read_chunk_table(ifile, header)
+    firsts = np.concatenate([[0], np.cumsum(table["counts"])])
+    ends = np.cumsum(table["sizes"])
+    cuts = np.searchsorted(ends, ends[-1] * np.arange(1, parts) / parts) + 1
+    bounds = np.unique(np.concatenate([[0], cuts, [len(ends)]]))
+    return [(int(firsts[a]), int(firsts[b] - firsts[a])) for a, b in zip(bounds, bounds[1:])]
+
+def remap_classification(points: np.ndarray, lut: np.ndarray) -> None:
+    points["Classification"] = lut[points["Classification"]]
+
+def gps_time_offset(ifile, header: dict, gps_week=None):
+    # Seconds to add to GPS week time for adjusted standard GPS time, None if the point format has no GPS time,
+    # the input has standard time already or no gps_week is given (GPS week time is then kept)
+    # The header creation date is not used, it is usually the processing date and not the acquisition date
+    if header["point_format"] in (0, 2) or header["global_encoding"] & 0x1 or gps_week is None:
+        return None
+    # Times are not unwrapped, a file crossing the week boundary (Sunday 00:00 GPS) needs gps_week per part
+    return gps_week * GPS_WEEK_SECONDS - 1e9
+
+def set_overlap_flag(points: np.ndarray, overlap: np.ndarray) -> None:
+    # Overlap flag on the points where overlap is set, in place on a chunk with ClassFlags
+    # writers.las takes all classification flags from ClassFlags when the chunk has it, so a ClassFlags added by
+    # stream_las is first filled from the per-flag dimensions of the reader (a no-op on a delivered ClassFlags)
+    for bit, dim in enumerate(("Synthetic", "KeyPoint", "Withheld", "Overlap")):
+        if dim in points.dtype.names:
+            points["ClassFlags"] |= (points[dim] != 0).astype(np.uint8) << bit
+    points["ClassFlags"][overlap] |= 0x8
+    if "Overlap" in points.dtype.names:
+        # PDAL versions with one dimension per classification flag
+        points["Overlap"][overlap] = 1
+
+def upgrade_attributes(points: np.ndarray, gps_offset=None, channel_dim=SCAN_CHANNEL_DIM) -> None:
+    # LAS 1.2 attributes as LAS 1.4 expects them, in place on a chunk with the UPGRADE_DIMS
+    # The scan angle needs nothing, PDAL holds ScanAngleRank in degrees and writers.las scales it for format 6
+    if gps_offset is not None:
+        points["GpsTime"] += gps_offset
+    overlap = points["Classification"] == OVERLAP_CLASS
+    set_overlap_flag(points, overlap)
+    if OVERLAP_RECLASS is not None:
+        points["Classification"][overlap] = OVERLAP_RECLASS
+    if channel_dim is not None:
+        points["ScanChannel"] = points[channel_dim] & 0x3
+
+def hex_cells(x: np.ndarray, y: np.ndarray, edge_size: float) -> np.ndarray:
+    # Pointy-top hexagon containing each XY, as axial (q, r) packed into one int64 key
+    q = (np.sqrt(3) / 3 * x - y / 3) / edge_size
+    r = (2 / 3 * y) / edge_size
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    # Cube rounding, the coordinate with the largest rounding error is derived from the other two
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return (rq.astype(np.int64) << 32) | (rr.astype(np.int64) & 0xFFFFFFFF)
+
+def hex_polygons(keys: np.ndarray, edge_size: float) -> np.ndarray:
+    # Closed rings of the hexagons keyed by hex_cells, shape (n, 7, 2)
+    # Vertices are computed on an integer lattice so neighbours share bit-identical corners
+    q = keys >> 32
+    r = ((keys & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000
+    i = (2 * q + r)[:, None] + np.array([1, 0, -1, -1, 0, 1, 1])
+    j = (3 * r)[:, None] + np.array([1, 2, 1, -1, -2, -1, 1])
+    return np.stack([i * (edge_size * np.sqrt(3) / 2), j * (edge_size / 2)], axis=-1)
+
+def grid_cells(x: np.ndarray, y: np.ndarray, cell_size: float) -> np.ndarray:
+    # Square cell containing each XY, as (column, row) packed into one int64 key
+    column = np.floor(x / cell_size).astype(np.int64)
+    row = np.floor(y / cell_size).astype(np.int64)
+    return (column << 32) | (row & 0xFFFFFFFF)
+
+def flag_overlap(points: np.ndarray, cells: np.ndarray, cell_size: float) -> None:
+    # Overlap flag on the points in cells (sorted grid_cells keys), in place on a chunk with ClassFlags
+    # The other classification flags are kept (see set_overlap_flag), also when no cell overlaps
+    if not len(cells):
+        set_overlap_flag(points, np.zeros(len(points), dtype=bool))
+        return
+    keys = grid_cells(points["X"], points["Y"], cell_size)
+    overlap = cells[np.minimum(np.searchsorted(cells, keys), len(cells) - 1)] == keys
+    set_overlap_flag(points, overlap)
+
+def merge_counts(keys: np.ndarray, counts: np.ndarray, new_keys: np.ndarray, new_counts: np.ndarray):
+    keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([counts, new_counts]), minlength=len(keys))
+    return keys, counts.astype(np.int64)
+
+def geojson_crs(epsg):
+    # Named CRS member understood by ogr2ogr, for "EPSG:<code>" only
+    if isinstance(epsg, str) and epsg.upper().startswith("EPSG:"):
+        return {"type": "name", "properties": {"name": f"urn:ogc:def:crs:EPSG::{epsg[5:]}"}}
+    return None
+
+class PointStats:
+    # Chunk transform collecting bounds, class histogram, GPS time range and hexbin counts on the way through
+    # edge_size=None skips the hexbin counts
+
+    def __init__(self, edge_size=HEXBIN_EDGE_SIZE, threshold=HEXBIN_THRESHOLD):
+        self.edge_size = edge_size
+        self.threshold = threshold
+        self.count = 0
+        self.mins = np.full(3, np.inf)
+        self.maxs = np.full(3, -np.inf)
+        self.gps_time = [np.inf, -np.inf]
+        self.classes = np.zeros(256, dtype=np.int64)
+        self.hex_keys = np.empty(0, dtype=np.int64)
+        self.hex_counts = np.empty(0, dtype=np.int64)
+
+    def __call__(self, points: np.ndarray) -> None:
+        if not len(points):
+            return
+        self.count += len(points)
+        for axis, dim in enumerate("XYZ"):
+            self.mins[axis] = min(self.mins[axis], points[dim].min())
+            self.maxs[axis] = max(self.maxs[axis], points[dim].max())
+        if "GpsTime" in points.dtype.names:
+            self.gps_time = [min(self.gps_time[0], points["GpsTime"].min()),
+                             max(self.gps_time[1], points["GpsTime"].max())]
+        self.classes += np.bincount(points["Classification"], minlength=256)
+        if self.edge_size is None:
+            return
+        keys, counts = np.unique(hex_cells(points["X"], points["Y"], self.edge_size), return_counts=True)
+        self.hex_keys, self.hex_counts = merge_counts(self.hex_keys, self.hex_counts, keys, counts)
+
+    def merge(self, other: "PointStats") -> None:
+        # Add the statistics of another part of the same file
+        self.count += other.count
+        self.mins = np.minimum(self.mins, other.mins)
+        self.maxs = np.maximum(self.maxs, other.maxs)
+        self.gps_time = [min(self.gps_time[0], other.gps_time[0]), max(self.gps_time[1], other.gps_time[1])]
+        self.classes += other.classes
+        if self.edge_size is not None:
+            self.hex_keys, self.hex_counts = merge_counts(self.hex_keys, self.hex_counts, other.hex_keys, other.hex_counts)
+
+    def summary(self) -> dict:
+        return {
+            "points": self.count,
+            "bounds": {
+                "minx": self.mins[0], "miny": self.mins[1], "minz": self.mins[2],
+                "maxx": self.maxs[0], "maxy": self.maxs[1], "maxz": self.maxs[2],
+            } if self.count else None,
+            "gps_time": self.gps_time if self.count and np.isfinite(self.gps_time[0]) else None,
+            "classes": {int(code): int(n) for code, n in enumerate(self.classes) if n},
+        }
+
+    def write(self, ofile, epsg=None) -> dict:
+        # <ofile>.stats.json and <ofile>.hex.geojson (hexagons as filters.hexbin "density" writes them)
+        summary = self.summary()
+        covered = self.hex_counts >= self.threshold
+        summary["hexbin"] = {
+            "edge_size": self.edge_size,
+            "threshold": self.threshold,
+            "cells": int(covered.sum()),
+        }
+        with open(f"{ofile}.stats.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        rings = np.round(hex_polygons(self.hex_keys[covered], self.edge_size), 3)
+        coverage = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "properties": {"count": int(count)},
+                    "geometry": {"type": "Polygon", "coordinates": [ring.tolist()]},
+                }
+                for ring, count in zip(rings, self.hex_counts[covered])
+            ],
+        }
+        crs = geojson_crs(epsg)
+        if crs:
+            coverage["crs"] = crs
+        with open(f"{ofile}.hex.geojson", "w", encoding="utf-8") as f:
+            json.dump(coverage, f)
+        return summary
+
+def stream_chunk_size(chunk_size=CHUNK_SIZE, memory_limit=MAX_WORKER_MEMORY, pipelined=False, sorting=False) -> int:
+    # The reader, the NumPy buffer and the writer each hold one chunk at a time
+    # Pipelined, the ring holds RING_SLOTS more chunks and each of the three processes needs its base memory
+    # Sorting, the chunks get at most half of the memory besides the base, the sort run the rest (see sort_run_points)
+    if memory_limit is None:
+        return chunk_size
+    processes, chunks = (3, 3 + RING_SLOTS) if pipelined else (1, 3)
+    fitting = (memory_limit - processes * WORKER_BASE_MEMORY) // ((2 if sorting else 1) * chunks * POINT_BYTES)
+    if fitting < 1:
+        raise ValueError(f"MAX_WORKER_MEMORY={memory_limit} leaves no room for point chunks")
+    return min(chunk_size, fitting)
+
+def non_streamable_stages(stages: list) -> list:
+    return [stage["type"] for stage in stages if stage["type"] not in STREAMABLE_STAGES]
+
+def check_streamable(stages: list, allow_in_memory=ALLOW_IN_MEMORY) -> bool:
+    # True if stages can stream, otherwise report (or refuse) the full in-memory load
+    blocking = non_streamable_stages(stages)
+    if not blocking:
+        return True
+    message = f"Non-streamable stage(s) {', '.join(blocking)} force a full in-memory load"
+    if not allow_in_memory:
+        raise RuntimeError(f"{message}, set ALLOW_IN_MEMORY = True to run anyway")
+    print(f"WARNING: {message}", file=sys.stderr)
+    return False
+
+def task_pids() -> list:
+    # This process and its PIPELINED stage processes
+    return [os.getpid()] + ([stage.pid for stage in RING_STAGES[0]] if RING_STAGES is not None else [])
+
+def reset_peak_rss() -> bool:
+    # Start measuring the peak of one task (see task_peak_rss) by resetting the kernel high-water marks, False where
+    # the platform cannot (only Linux can), ru_maxrss is no use in a reused worker as it never goes down
+    try:
+        for pid in task_pids():
+            with open(f"/proc/{pid}/clear_refs", "w") as f:
+                f.write("5")
+    except OSError:
+        return False
+    return True
+
+def task_peak_rss():
+    # Peak resident set size in bytes since reset_peak_rss, of this process and its PIPELINED stage processes
+    # (summed), None where it cannot be measured
+    peak = 0
+    for pid in task_pids():
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                peak += sum(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:"))
+        except OSError:
+            return None
+    return peak
+
+def limit_worker_memory(memory_limit=MAX_WORKER_MEMORY) -> None:
+    # Enforce the per-worker ceiling on the heap where the platform supports it (not on Windows)
+    # Linux 4.7 and later count private anonymous mmaps in RLIMIT_DATA, not only brk, so the shared libraries PDAL
+    # loads for its plugins (and their data segments) count against the ceiling too, hence WORKER_BASE_MEMORY
+    # Only the soft limit is set, worker_memory_lifted raises it again for the pipelines allowed to run in memory
+    try:
+        import resource
+    except ImportError:
+        return
+    if memory_limit is not None and hasattr(resource, "RLIMIT_DATA"):
+        _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        if hard != resource.RLIM_INFINITY:
+            memory_limit = min(memory_limit, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, hard))
+
+@contextmanager
+def worker_memory_lifted():
+    # Lift the ceiling of limit_worker_memory while a pipeline loads a whole file in memory (ALLOW_IN_MEMORY, COPC),
+    # such tasks are sized by task_memory on all their points and admitted against MEMORY_BUDGET instead
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is None or not hasattr(resource, "RLIMIT_DATA"):
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    resource.setrlimit(resource.RLIMIT_DATA, (hard, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_DATA, (soft, hard))
+
+def stream_las(ifile, writer: dict, transforms=(), chunk_size=CHUNK_SIZE,
+               memory_limit=MAX_WORKER_MEMORY, allow_in_memory=ALLOW_IN_MEMORY, start=0, count=None,
+               pipelined=None, dims=(), sort=None) -> int:
+    # Read ifile in chunks, apply each transform in place on the chunk and stream it into writer
+    # count = read only the points [start, start + count) (one part of a split file)
+    # pipelined = None follows PIPELINED as set when called
+    # dims = [(name, type)] the transforms write, added (zeroed) where the reader does not deliver them
+    # sort = "morton"/"hilbert" writes the points in that order (see sorted_chunks), None follows SORT_ORDER
+    if pipelined is None:
+        pipelined = PIPELINED
+    if sort is None:
+        sort = SORT_ORDER
+    reader = [{"type": "readers.las", "filename": ifile}]
+    if count is not None:
+        reader[0].update(start=start, count=count)
+    chunk_size = stream_chunk_size(chunk_size, memory_limit, pipelined, sorting=bool(sort))
+    streamable = check_streamable(reader + [writer], allow_in_memory)
+    chunks = pdal.Pipeline(json.dumps(reader)).iterator(chunk_size=chunk_size)
+    if sort:
+        header = read_las_header(ifile)
+        bounds = (header["mins"][0], header["mins"][1], header["maxs"][0], header["maxs"][1])
+        keys = partial(spatial_keys, order=sort, bounds=bounds)
+        run_points = sort_run_points(memory_limit, chunk_size, pipelined)
+        chunks = sorted_chunks(chunks, keys, chunk_size, run_points, Path(writer["filename"]).parent)
+    first = next(chunks, None)
+    if first is None:
+        return run_pipeline(json.dumps(reader + [writer]), chunk_size, allow_in_memory=allow_in_memory)
+    dtype = np.dtype(first.dtype.descr + [dim for dim in dims if dim[0] not in first.dtype.names])
+    if not streamable:
+        with worker_memory_lifted():
+            points = np.concatenate([first, *chunks])
+            if dtype != points.dtype:
+                points, loaded = np.empty(len(points), dtype=dtype), points
+                copy_points(points, loaded)
+            for transform in transforms:
+                transform(points)
+            return pdal.Pipeline(json.dumps([writer]), arrays=[points]).execute()
+    if pipelined:
+        return stream_pipelined(itertools.chain([first], chunks), dtype, writer, transforms, chunk_size)
+    buffer = np.empty(chunk_size, dtype=dtype)
+    pending = itertools.chain([first], chunks)
+
+    def load_next_chunk() -> int:
+        points = next(pending, None)
+        if points is None:
+            return 0
+        view = buffer[:len(points)]
+        copy_points(view, points)
+        for transform in transforms:
+            transform(view)
+        return len(view)
+
+    pipeline = pdal.Pipeline(json.dumps([writer]), arrays=[buffer], stream_handlers=[load_next_chunk])
+    return pipeline.execute_streaming(chunk_size=chunk_size)
+
+def copy_points(dst: np.ndarray, src: np.ndarray) -> None:
+    # Structured arrays assign by position, dimensions are matched by name here and those missing in src zeroed
+    if dst.dtype == src.dtype:
+        dst[...] = src
+        return
+    for name in dst.dtype.names:
+        dst[name] = src[name] if name in src.dtype.names else 0
+
+def grid_coordinates(x: np.ndarray, y: np.ndarray, bounds, bits: int) -> tuple:
+    # Integer column and row of each XY on a 2**bits grid over bounds = (minx, miny, maxx, maxy)
+    last = 2**bits - 1
+    coordinates = []
+    for values, low, high in ((x, bounds[0], bounds[2]), (y, bounds[1], bounds[3])):
+        scaled = (values - low) * (last / (high - low)) if high > low else np.zeros(len(values))
+        coordinates.append(np.clip(scaled, 0, last).astype(np.int64))
+    return tuple(coordinates)
+
+def spread_bits(values: np.ndarray) -> np.ndarray:
+    # Bit i of each value moved to bit 2i (values below 2**31)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << shift)) & mask
+    return values
+
+def morton_keys(x: np.ndarray, y: np.ndarray, bounds, bits=SORT_BITS) -> np.ndarray:
+    column, row = grid_coordinates(x, y, bounds, bits)
+    return spread_bits(column) | (spread_bits(row) << 1)
+
+def hilbert_keys(x: np.ndarray, y: np.ndarray, bounds, bits=SORT_BITS) -> np.ndarray:
+    # Distance along the Hilbert curve through the 2**bits grid, one quadrant level per step for all points at once
+    column, row = grid_coordinates(x, y, bounds, bits)
+    keys = np.zeros(len(column), dtype=np.int64)
+    last = 2**bits - 1
+    for level in range(bits - 1, -1, -1):
+        size = 1 << level
+        right = (column & size) > 0
+        top = (row & size) > 0
+        keys += size * size * ((3 * right) ^ top)
+        # Rotate the quadrant so the curve enters and leaves it as at the level above
+        turn = ~top
+        flip = turn & right
+        column = np.where(flip, last - column, column)
+        row = np.where(flip, last - row, row)
+        column, row = np.where(turn, row, column), np.where(turn, column, row)
+    return keys
+
+def spatial_keys(points: np.ndarray, order: str, bounds, bits=SORT_BITS) -> np.ndarray:
+    if order == "morton":
+        return morton_keys(points["X"], points["Y"], bounds, bits)
+    if order == "hilbert":
+        return hilbert_keys(points["X"], points["Y"], bounds, bits)
+    raise ValueError(f"Unknown sort order {order!r}, use 'morton' or 'hilbert'")
+
+def sort_run_points(memory_limit=MAX_WORKER_MEMORY, chunk_size=CHUNK_SIZE, pipelined=False):
+    # Points sorted at once within memory_limit (None = all), the run and its sorted copy with keys and order
+    # The run is held besides the chunks streamed at the same time (see stream_chunk_size)
+    if memory_limit is None:
+        return None
+    processes, chunks = (3, 3 + RING_SLOTS) if pipelined else (1, 3)
+    streamed = chunks * stream_chunk_size(chunk_size, memory_limit, pipelined, sorting=True) * POINT_BYTES
+    fitting = (memory_limit - processes * WORKER_BASE_MEMORY - streamed) // (2 * POINT_BYTES + 16)
+    if fitting < 1:
+        raise ValueError(f"MAX_WORKER_MEMORY={memory_limit} leaves no room for sorting")
+    return fitting
+
+def sorted_chunks(chunks, keys, chunk_size: int, run_points=None, folder=None):
+    # chunks in the order of keys(points), at most chunk_size points each
+    # Runs of about run_points points (None = all) are sorted in memory, several runs are spilled to a temporary
+    # folder in folder and merged (see merge_runs)
+    with tempfile.TemporaryDirectory(prefix="psky_sort_", dir=folder) as spill:
+        runs = []
+        pending = []
+
+        def sort_run() -> tuple:
+            points = np.concatenate(pending)
+            run_keys = keys(points)
+            order = np.argsort(run_keys, kind="stable")
+            return points[order], run_keys[order]
+
+        def spill_run() -> None:
+            points, run_keys = sort_run()
+            path = Path(spill, f"run{len(runs):05d}")
+            points.tofile(f"{path}.points")
+            run_keys.tofile(f"{path}.keys")
+            runs.append((path, points.dtype, len(points)))
+            pending.clear()
+
+        for points in chunks:
+            pending.append(points)
+            if run_points is not None and sum(len(part) for part in pending) >= run_points:
+                spill_run()
+        if not runs:
+            if pending:
+                points, _ = sort_run()
+                for first in range(0, len(points), chunk_size):
+                    yield points[first:first + chunk_size]
+            return
+        if pending:
+            spill_run()
+        yield from merge_runs(runs, chunk_size, max(1, run_points // (2 * len(runs))))
+
+def merge_runs(runs: list, chunk_size: int, block: int):
+    # Merge of sorted runs [(path, dtype, points)] a block of each at a time
+    # Points up to the smallest last key among the blocks cannot be preceded by any point not yet read, so they are
+    # sorted together and handed on, the run owning that key moves on a whole block
+    points = [np.memmap(f"{path}.points", dtype=dtype, mode="r", shape=count) for path, dtype, count in runs]
+    keys = [np.memmap(f"{path}.keys", dtype=np.int64, mode="r", shape=count) for path, _, count in runs]
+    positions = [0] * len(runs)
+    while True:
+        live = [run for run in range(len(runs)) if positions[run] < len(keys[run])]
+        if not live:
+            break
+        cutoff = min(keys[run][min(positions[run] + block, len(keys[run])) - 1] for run in live)
+        ends = {
+            run: positions[run] + int(np.searchsorted(keys[run][positions[run]:positions[run] + block], cutoff, "right"))
+            for run in live
+        }
+        merged = np.concatenate([points[run][positions[run]:ends[run]] for run in live])
+        merged_keys = np.concatenate([keys[run][positions[run]:ends[run]] for run in live])
+        merged = merged[np.argsort(merged_keys, kind="stable")]
+        for run in live:
+            positions[run] = ends[run]
+        for first in range(0, len(merged), chunk_size):
+            yield merged[first:first + chunk_size]
+    del points, keys
+
+def ring_poll(done, stages: list, results: dict, timeout=0) -> None:
+    # Collect the stage results queued on done into results (by kind), failing on a reported error or on a stage
+    # that is no longer alive without having reported its result, whatever its exit code
+    dead = [stage for stage in stages if not stage.is_alive()]
+    try:
+        while True:
+            kind, value = done.get(timeout=timeout) if timeout else done.get_nowait()
+            timeout = 0
+            if kind == "error":
+                raise RuntimeError(value)
+            results[kind] = value
+    except queue.Empty:
+        pass
+    # A stage queues its result before it ends, so the result of a stage seen dead above has been collected
+    for stage in dead:
+        if RING_RESULTS[stage.name] not in results:
+            raise RuntimeError(f"Pipeline stage {stage.name} died with exit code {stage.exitcode}")
+
+def ring_get(messages, stages: list, done, results: dict):
+    # Next message, failing instead of waiting forever if a stage failed (see ring_poll)
+    while True:
+        try:
+            return messages.get(timeout=1)
+        except queue.Empty:
+            ring_poll(done, stages, results)
+
+def ring_transform(jobs, filled, ready, done) -> None:
+    # Stage process applying the transforms in place on the ring slots, one file per job, the transforms (with any
+    # state they collected) are sent back when the input of the file ends
+    while (job := jobs.get()) is not None:
+        name, dtype, chunk_size, transforms = job
+        memory = shared_memory.SharedMemory(name=name)
+        ring = None
+        try:
+            ring = np.ndarray((RING_SLOTS, chunk_size), dtype=dtype, buffer=memory.buf)
+            while (item := filled.get()) is not None:
+                slot, count = item
+                for transform in transforms:
+                    transform(ring[slot, :count])
+                ready.put(item)
+            ready.put(None)
+            done.put(("transforms", transforms))
+        except Exception:
+            done.put(("error", traceback.format_exc()))
+            return
+        finally:
+            del ring
+            memory.close()
+
+def ring_write(jobs, ready, free, done) -> None:
+    # Stage process streaming the ring slots into the writer, one file per job, each slot is freed for the reader
+    # once copied
+    while (job := jobs.get()) is not None:
+        name, dtype, chunk_size, writer = job
+        memory = shared_memory.SharedMemory(name=name)
+        ring = None
+        try:
+            ring = np.ndarray((RING_SLOTS, chunk_size), dtype=dtype, buffer=memory.buf)
+            # Second copy of each chunk: the stream handler can only fill the one array bound to the pipeline
+            buffer = np.empty(chunk_size, dtype=dtype)
+
+            def load_next_chunk() -> int:
+                item = ready.get()
+                if item is None:
+                    return 0
+                slot, count = item
+                buffer[:count] = ring[slot, :count]
+                free.put(slot)
+                return count
+
+            pipeline = pdal.Pipeline(json.dumps([writer]), arrays=[buffer], stream_handlers=[load_next_chunk])
+            done.put(("count", pipeline.execute_streaming(chunk_size=chunk_size)))
+        except Exception:
+            done.put(("error", traceback.format_exc()))
+            return
+        finally:
+            del ring
+            memory.close()
+
+def ring_stages():
+    # The two stage processes of this worker with their queues, started on first use and kept for the next files
+    # All RING_SLOTS slot numbers are on the free queue between files
+    global RING_STAGES
+    if RING_STAGES is None or not all(stage.is_alive() for stage in RING_STAGES[0]):
+        close_ring_stages()
+        transform_jobs, write_jobs, free, filled, ready, done = (multiprocessing.Queue() for _ in range(6))
+        stages = [
+            multiprocessing.Process(
+                target=ring_transform, name="transform", daemon=True, args=(transform_jobs, filled, ready, done),
+            ),
+            multiprocessing.Process(
+                target=ring_write, name="write", daemon=True, args=(write_jobs, ready, free, done),
+            ),
+        ]
+        for stage in stages:
+            stage.start()
+        for slot in range(RING_SLOTS):
+            free.put(slot)
+        RING_STAGES = (stages, transform_jobs, write_jobs, free, filled, ready, done)
+    return RING_STAGES
+
+def close_ring_stages() -> None:
+    # Stop the stage processes, after a failed file their queues may hold chunks of that file
+    global RING_STAGES
+    if RING_STAGES is not None:
+        for stage in RING_STAGES[0]:
+            if stage.is_alive():
+                stage.terminate()
+            stage.join()
+    RING_STAGES = None
+
+def stream_pipelined(chunks, dtype, writer: dict, transforms, chunk_size: int) -> int:
+    # stream_las with the reading here and the transforms and the writer in the two stage processes of the worker
+    # Slots of the shared memory ring go round free -> filled -> ready -> free, only slot numbers are queued
+    # The ring is created first, the stage processes started after it share the resource tracker of this process
+    # (a tracker of their own would unlink the ring when a stage ends)
+    memory = shared_memory.SharedMemory(create=True, size=RING_SLOTS * chunk_size * dtype.itemsize)
+    ring = None
+    results = dict()
+    try:
+        stages, transform_jobs, write_jobs, free, filled, ready, done = ring_stages()
+        transform_jobs.put((memory.name, dtype, chunk_size, list(transforms)))
+        write_jobs.put((memory.name, dtype, chunk_size, writer))
+        ring = np.ndarray((RING_SLOTS, chunk_size), dtype=dtype, buffer=memory.buf)
+        for points in chunks:
+            slot = ring_get(free, stages, done, results)
+            # First copy of each chunk: the PDAL iterator returns arrays of its own, it can't decode into the slot
+            copy_points(ring[slot, :len(points)], points)
+            filled.put((slot, len(points)))
+        filled.put(None)
+        while len(results) < len(stages):
+            ring_poll(done, stages, results, timeout=1)
+    except BaseException:
+        close_ring_stages()
+        raise
+    finally:
+        del ring
+        memory.close()
+        memory.unlink()
+    # The caller's transforms get the state collected in the stage process (e.g. PointStats)
+    for transform, collected in zip(transforms, results["transforms"]):
+        if hasattr(transform, "__dict__"):
+            vars(transform).update(vars(collected))
+    return results["count"]
+
+def srs_wkt(ifile, epsg) -> str:
+    # WKT as PDAL writes it for epsg, reading no points from ifile, cached per epsg in the worker
+    if epsg not in SRS_WKT:
+        reader = [{"type": "readers.las", "filename": ifile, "override_srs": f"{epsg}", "count": 0}]
+        pipeline = pdal.Pipeline(json.dumps(reader))
+        pipeline.execute()
+        metadata = pipeline.metadata
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        SRS_WKT[epsg] = metadata["metadata"]["readers.las"]["srs"]["wkt"]
+    return SRS_WKT[epsg]
+
+def pack_vlr(user_id: str, record_id: int, payload: bytes, extended=False) -> bytes:
+    layout = LAS_EVLR_HEADER if extended else LAS_VLR_HEADER
+    return layout.pack(0, user_id.encode("ascii"), record_id, len(payload), b"") + payload
+
+def copy_bytes(src, dst, length: int, block=16 * 1024**2) -> None:
+    while length > 0:
+        data = src.read(min(block, length))
+        if not data:
+            raise ValueError(f"Unexpected end of file in {src.name!r}")
+        dst.write(data)
+        length -= len(data)
+
+def tag_las_header(ifile, ofile, header: dict, wkt: str, sensorsys) -> bool:
+    # Rewrite the public header and SRS records of a LAS 1.4 file, the point data is copied through byte for byte
+    vlrs = read_las_vlrs(ifile, header)
+    if is_copc(vlrs):
+        return False  # The COPC hierarchy holds absolute offsets, left to PDAL
+    records = [vlr for vlr in vlrs if not (vlr[0] == "LASF_Projection" and vlr[1] in LAS_SRS_RECORDS)]
+    vlrs = b"".join(pack_vlr(*vlr[:3]) for vlr in records if not vlr[3])
+    vlrs += pack_vlr("LASF_Projection", 2112, wkt.encode("utf-8") + b"\0")
+    vlr_count = sum(not vlr[3] for vlr in records) + 1
+    evlrs = b"".join(pack_vlr(*vlr[:3], extended=True) for vlr in records if vlr[3])
+    evlr_count = sum(vlr[3] for vlr in records)
+    points_end = header["evlr_offset"] if header["evlr_count"] else os.path.getsize(ifile)
+    point_offset = header["header_size"] + len(vlrs)
+    shift = point_offset - header["point_offset"]
+
+    with open(ifile, "rb") as src:
+        public = bytearray(src.read(header["header_size"]))
+        src.seek(header["point_offset"])
+        if header["compressed"]:
+            # LAZ point data starts with the absolute file offset of the chunk table, -1 = stored at
+            # the end of the file, which is left to PDAL
+            (chunk_table,) = struct.unpack("<q", src.read(8))
+            if chunk_table == -1:
+                return False
+        struct.pack_into("<H", public, LAS_GLOBAL_ENCODING_AT, header["global_encoding"] | LAS_WKT_BIT)
+        struct.pack_into("32s", public, LAS_SYSTEM_ID_AT, f"{sensorsys}".encode("ascii")[:32])
+        struct.pack_into("<LL", public, LAS_POINT_OFFSET_AT, point_offset, vlr_count)
+        struct.pack_into("<QL", public, LAS_EVLR_OFFSET_AT, points_end + shift if evlr_count else 0, evlr_count)
+        with open(ofile, "wb") as dst:
+            dst.write(public)
+            dst.write(vlrs)
+            if header["compressed"]:
+                dst.write(struct.pack("<q", chunk_table + shift))
+            copy_bytes(src, dst, points_end - src.tell())
+            dst.write(evlrs)
+    return True
+
+def is_copc(vlrs: list) -> bool:
+    return bool(vlrs) and vlrs[0][:2] == (COPC_USER_ID, COPC_INFO_RECORD_ID)
+
+def validate_copc(filename) -> dict:
+    # Check the COPC layout and octree hierarchy of filename, raises ValueError on the first fault
+    # Returns the node count, point count and depth of the octree
+    header = read_las_header(filename)
+    vlrs = read_las_vlrs(filename, header)
+    if header["version"] != "1.4" or header["point_format"] not in (6, 7, 8) or not is_copc(vlrs):
+        raise ValueError(f"Not COPC (LAS 1.4 point format 6-8 with the copc info VLR first): {filename!r}")
+    if header["header_size"] != LAS_HEADER.size + LAS_HEADER_14.size:
+        raise ValueError(f"COPC info VLR not at the fixed offset: {filename!r}")
+    if not any(vlr[:2] == (COPC_USER_ID, COPC_HIERARCHY_RECORD_ID) and vlr[3] for vlr in vlrs):
+        raise ValueError(f"COPC hierarchy EVLR missing: {filename!r}")
+    info = COPC_INFO.unpack(vlrs[0][2][:COPC_INFO.size])
+    root_offset, root_size = info[5], info[6]
+    file_size = os.path.getsize(filename)
+    points_end = header["evlr_offset"] if header["evlr_count"] else file_size
+
+    nodes = dict()
+    pages = [(root_offset, root_size)]
+    with open(filename, "rb") as f:
+        while pages:
+            offset, size = pages.pop()
+            if size % COPC_ENTRY.size or offset + size > file_size:
+                raise ValueError(f"COPC hierarchy page at {offset} ({size} bytes) is malformed: {filename!r}")
+            f.seek(offset)
+            page = f.read(size)
+            for level, x, y, z, data_offset, byte_size, count in COPC_ENTRY.iter_unpack(page):
+                key = (level, x, y, z)
+                if key in nodes or level < 0 or not all(0 <= i < 2**level for i in (x, y, z)):
+                    raise ValueError(f"COPC voxel key {key} is repeated or out of range: {filename!r}")
+                if count == -1:
+                    pages.append((data_offset, byte_size))
+                    continue
+                if count < 0 or (count and (data_offset < header["point_offset"] or data_offset + byte_size > points_end)):
+                    raise ValueError(f"COPC node {key} points outside the point data: {filename!r}")
+                nodes[key] = (data_offset, byte_size, count)
+    if (0, 0, 0, 0) not in nodes and nodes:
+        raise ValueError(f"COPC root node missing: {filename!r}")
+    for level, x, y, z in nodes:
+        if level and (level - 1, x // 2, y // 2, z // 2) not in nodes:
+            raise ValueError(f"COPC node {(level, x, y, z)} has no parent: {filename!r}")
+    chunks = sorted((offset, size) for offset, size, count in nodes.values() if count)
+    for (offset, size), (next_offset, _) in zip(chunks, chunks[1:]):
+        if offset + size > next_offset:
+            raise ValueError(f"COPC point chunks at {offset} and {next_offset} overlap: {filename!r}")
+    points = sum(count for _, _, count in nodes.values())
+    if points != header["point_count"]:
+        raise ValueError(f"COPC nodes hold {points} points, the header {header['point_count']}: {filename!r}")
+    return {"nodes": len(nodes), "points": points, "depth": max((key[0] for key in nodes), default=0)}
+
+def write_copc(ofile, sensorsys) -> dict:
+    # Rebuild the LAS 1.4 file ofile as COPC in place, keeping its SRS and header fields, and validate it
+    # writers.copc has no system_id, it is patched into the fixed size header field (nothing moves)
+    # The octree is built on all points in memory, run_pipeline lifts the worker memory ceiling for it
+    copc = f"{ofile}.copc"
     pipeline = [
         {
             "type": "readers.las",
-            "filename": ifile,
+            "filename": f"{ofile}",
         },
         {
-            "type": "writers.las",
+            "type": "writers.copc",
             "forward": "all",
             "extra_dims": "all",
-            "system_id": f"{sensorsys}",
-            "minor_version": 4,
-            "dataformat_id": 6,
-            "compression": "laszip",
-            "a_srs": f"{epsg}",
-            "filename": f"{ofile}"
+            "filename": copc
         }
     ]
-    pipeline_json = json.dumps(pipeline)
+    try:
+        run_pipeline(json.dumps(pipeline), allow_in_memory=True)
+        with open(copc, "r+b") as f:
+            f.seek(LAS_SYSTEM_ID_AT)
+            f.write(struct.pack("32s", f"{sensorsys}".encode("ascii")[:32]))
+        octree = validate_copc(copc)
+        os.replace(copc, ofile)
+    finally:
+        if os.path.exists(copc):
+            os.remove(copc)
+    return octree
 
-    # Run PDAL Pipeline
-    pipeline = pdal.Pipeline(pipeline_json)
-    count = run_pipeline(pipeline_json)
-    #arrays = pipeline.arrays
-    #metadata = pipeline.metadata
-    #logger = pipeline.log    
+def output_name(name: str) -> str:
+    # File name of a converted file, <stem>.copc.laz with COPC_OUTPUT
+    if not COPC_OUTPUT or name.endswith(".copc.laz"):
+        return name
+    return f"{Path(name).stem}.copc.laz"
 
-def worker_tag14():
-    lasifiles = [Path(f) for f in glob.glob(ifolder)]
-    with futures.ThreadPoolExecutor(num_workers) as executor:
-        to_do = dict()
-        file_count = 0
-        for lasif in lasifiles:
-            lasof = Path(ofolder, lasif.name).as_posix()
-            future = executor.submit(
-                exc_func_in_proc,
-                psky_tag14,
-                lasif.as_posix(),
-                lasof,
-                a_srs,
-                system_id,
-            )
-            to_do[future] = lasif.as_posix()
-            file_count += 1
-        print("Start tagging files")
-        for count, future in enumerate(futures.as_completed(to_do), 1):
-            print(
-                f"File tagged [{count}/{file_count} ({count/file_count*100: >4.1f}%)]: "
-                f"{to_do[future]!r}"
-            )
+def psky_tag14(ifile,ofile,epsg,sensorsys):
+    result = tag14(ifile, ofile, epsg, sensorsys)
+    if COPC_OUTPUT:
+        write_copc(ofile, sensorsys)
+    return result
 
-def psky_12_to_14(ifile,ofile,epsg,sensorsys):
+def tag14(ifile,ofile,epsg,sensorsys):
     
+    # LAZ already in LAS 1.4 point format 6 only needs a new header, no decompress/recompress
+    header = read_las_header(ifile)
+    if header["version"] == "1.4" and header["point_format"] == 6 and header["compressed"]:
+        if tag_las_header(ifile, ofile, header, srs_wkt(ifile, epsg), sensorsys):
+            return
+
     pipeline = [
         {
             "type": "readers.las",
             "filename": ifile,
         },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 21 WHERE Classification == 24"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 40 WHERE Classification == 26"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 41 WHERE Classification == 27"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 42 WHERE Classification == 28"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 43 WHERE Classification == 29"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 44 WHERE Classification == 30"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 45 WHERE Classification == 31"
-        },
         {
             "type": "writers.las",
             "forward": "all",
@@ -159,121 +2098,464 @@ def psky_12_to_14(ifile,ofile,epsg,sensorsys):
     count = run_pipeline(pipeline_json)
     #arrays = pipeline.arrays
     #metadata = pipeline.metadata
-    #logger = pipeline.log        
+    #logger = pipeline.log    
+
+def psky_retag14(ifile,ofile,epsg,sensorsys,side_products=False,gps_week=None):
+    # psky_12_to_14 for inputs already in LAS 1.4 point format 6, only the header is tagged
+    # The points are read once more only for the side products
+    psky_tag14(ifile, ofile, epsg, sensorsys)
+    if not side_products:
+        return None
+    stats = PointStats()
+    reader = [{"type": "readers.las", "filename": ofile}]
+    for points in pdal.Pipeline(json.dumps(reader)).iterator(chunk_size=stream_chunk_size()):
+        stats(points)
+    return stats.write(ofile, epsg)
+
+def link_las(ifile, ofile, *args):
+    # The input is already the output, hard-linked (copied across file systems) without reading it
+    try:
+        os.link(ifile, ofile)
+    except OSError:
+        shutil.copyfile(ifile, ofile)
+
+def preflight_file(filename):
+    # Header and VLR fields routing a file, None if it is not readable LAS/LAZ
+    try:
+        header = read_las_header(filename)
+        wkt = read_las_wkt(filename, header)
+        copc = is_copc(read_las_vlrs(filename, header))
+    except (OSError, ValueError, struct.error):
+        return None
+    return {
+        "version": header["version"],
+        "point_format": header["point_format"],
+        "srs": wkt,
+        "system_id": header["system_id"],
+        "point_count": header["point_count"],
+        "compressed": header["compressed"],
+        "copc": copc,
+        "numpy": numpy_transcodable(header),
+    }
+
+def preflight(jobs: dict, epsg, sensorsys, side_products=False, workers=None) -> dict:
+    # Route of every job to a LAS 1.4 output from the header and VLRs of its input, read in parallel threads
+    ##  skip    = the output is the input
+    ##  link    = LAS 1.4 point format 6 LAZ already tagged with epsg and sensorsys (and COPC as COPC_OUTPUT), linked
+    ##  tag     = LAS 1.4 point format 6, only the header and SRS records are rewritten
+    ##  numpy   = uncompressed LAS 1.2 for psky_12_to_14_numpy (with NUMPY_TRANSCODE, it does not sort)
+    ##  convert = the rest, unreadable files included (the conversion reports them)
+    # With side products nothing is linked, the points are read for the statistics
+    with futures.ThreadPoolExecutor(workers or num_workers) as executor:
+        infos = dict(zip(jobs, executor.map(preflight_file, jobs)))
+    readable = [ifile for ifile, info in infos.items() if info is not None]
+    wkt = srs_wkt(readable[0], epsg) if readable else None
+    routes = dict()
+    for ifile, info in infos.items():
+        ofile = jobs[ifile][1]
+        if os.path.exists(ifile) and os.path.exists(ofile) and os.path.samefile(ifile, ofile):
+            routes[ifile] = "skip"
+        elif info is None:
+            routes[ifile] = "convert"
+        elif info["version"] == "1.4" and info["point_format"] == 6:
+            tagged = info["srs"] == wkt and info["system_id"] == f"{sensorsys}"[:32] and info["copc"] == COPC_OUTPUT
+            routes[ifile] = "link" if tagged and info["compressed"] and not side_products else "tag"
+        elif NUMPY_TRANSCODE and SORT_ORDER is None and info["numpy"]:
+            routes[ifile] = "numpy"
+        else:
+            routes[ifile] = "convert"
+    counts = {route: list(routes.values()).count(route) for route in ("skip", "link", "tag", "numpy", "convert")}
+    print("Pre-flight: " + ", ".join(f"{count} {route}" for route, count in counts.items() if count))
+    return routes
+
+def worker_tag14():
+    lasifiles = [Path(f) for f in glob.glob(ifolder)]
+    jobs = {
+        lasif.as_posix(): (lasif.as_posix(), Path(ofolder, output_name(lasif.name)).as_posix(), a_srs, system_id)
+        for lasif in lasifiles
+    }
+    # psky_tag14 itself only rewrites the header where it can
+    routes = preflight(jobs, a_srs, system_id)
+    engines = {"link": link_las}
+    jobs = {ifile: args for ifile, args in jobs.items() if routes[ifile] != "skip"}
+    print("Start tagging files")
+    params = {"task": "tag14", "a_srs": a_srs, "system_id": system_id, "version": "1.4", "copc": COPC_OUTPUT}
+    run_batch(psky_tag14, jobs, "tagged", manifest=Path(ofolder, MANIFEST_NAME), params=params,
+              catalog=Path(ofolder, CATALOG_NAME), events=Path(ofolder, EVENTS_NAME),
+              routes={ifile: engines[routes[ifile]] for ifile in jobs if routes[ifile] in engines})
+
+def psky_12_to_14(ifile,ofile,epsg,sensorsys,side_products=False,gps_week=None,start=0,count=None,parts=None):
+    # gps_week = GPS week of GPS week time inputs (see gps_time_offset)
+    # count = convert the points [start, start + count) only and return their PointStats (a part of a split file)
+    # parts = [(part file, PointStats)] of a split file, stitched into ofile instead of converting
+    if parts is not None:
+        stats = stitch_parts(parts, ofile)
+        if COPC_OUTPUT:
+            write_copc(ofile, sensorsys)
+        return stats.write(ofile, epsg) if side_products else stats.summary()
+
+    header = read_las_header(ifile)
+    if NUMPY_TRANSCODE and SORT_ORDER is None and count is None and numpy_transcodable(header):
+        return psky_12_to_14_numpy(ifile, ofile, epsg, sensorsys, side_products, gps_week)
+    gps_offset = gps_time_offset(ifile, header, gps_week)
+    writer = {
+        **forward_header(header),
+        "type": "writers.las",
+        "extra_dims": "all",
+        "system_id": f"{sensorsys}",
+        "minor_version": 4,
+        "dataformat_id": 6,
+        "compression": "laszip",
+        "a_srs": f"{epsg}",
+        "vlrs": forward_vlrs(ifile, header),
+        "filename": f"{ofile}"
+    }
+    # Bit 0 = adjusted standard GPS time
+    writer["global_encoding"] |= gps_offset is not None
+
+    # Stream the points through a single classification lookup and the attribute upgrade
+    # Statistics for the catalog (and the side products) are collected in the same pass
+    stats = PointStats() if side_products else PointStats(edge_size=None)
+    transforms = [
+        partial(remap_classification, lut=LUT_12_TO_14),
+        partial(upgrade_attributes, gps_offset=gps_offset),
+        stats,
+    ]
+    stream_las(ifile, writer, transforms, start=start, count=count, dims=UPGRADE_DIMS)
+    if count is not None:
+        return stats
+    if COPC_OUTPUT:
+        write_copc(ofile, sensorsys)
+    if side_products:
+        return stats.write(ofile, epsg)
+    return stats.summary()
+
+def numpy_transcodable(header: dict) -> bool:
+    # Uncompressed point formats 0-3 without extra bytes
+    return (
+        not header["compressed"]
+        and header["point_format"] in (0, 1, 2, 3)
+        and header["record_length"] == LAS_POINT_FORMATS[header["point_format"]].itemsize
+    )
+
+def psky_12_to_14_numpy(ifile,ofile,epsg,sensorsys,side_products=False,gps_week=None,block=CHUNK_SIZE):
+    # psky_12_to_14 for uncompressed LAS as NumPy operations on memory-mapped point records, blocks of block points
+    # The output is uncompressed LAS 1.4 point format 6 (RGB is dropped as by the PDAL path)
+    header = read_las_header(ifile)
+    if not numpy_transcodable(header):
+        raise ValueError(f"Only uncompressed point formats 0-3 without extra bytes are transcoded: {ifile!r}")
+    has_gps_time = header["point_format"] in (1, 3)
+    gps_offset = gps_time_offset(ifile, header, gps_week)
+    # Record fields of the PDAL dimensions SCAN_CHANNEL_DIM can name
+    channel_field = {"UserData": "user_data", "PointSourceId": "point_source_id"}.get(SCAN_CHANNEL_DIM)
+    records = [
+        vlr for vlr in read_las_vlrs(ifile, header)
+        if not vlr[3] and not (vlr[0] == "LASF_Projection" and vlr[1] in LAS_SRS_RECORDS)
+    ]
+    vlrs = b"".join(pack_vlr(*vlr[:3]) for vlr in records)
+    vlrs += pack_vlr("LASF_Projection", 2112, srs_wkt(ifile, epsg).encode("utf-8") + b"\0")
+    out_header = {
+        **header,
+        "minor_version": 4,
+        "global_encoding": (header["global_encoding"] & 0x1) | (gps_offset is not None) | LAS_WKT_BIT,
+        "system_id": f"{sensorsys}",
+        "header_size": LAS_HEADER.size + LAS_HEADER_14.size,
+        "vlr_count": len(records) + 1,
+        "point_format": 6,
+        "record_length": LAS_POINT_FORMATS[6].itemsize,
+        "evlr_offset": 0,
+        "evlr_count": 0,
+    }
+    out_header["point_offset"] = out_header["header_size"] + len(vlrs)
+    point_count = header["point_count"]
+    stats_dtype = [("X", "<f8"), ("Y", "<f8"), ("Z", "<f8"), ("Classification", "u1")]
+    stats_dtype += [("GpsTime", "<f8")] if has_gps_time else []
+    stats = PointStats() if side_products else PointStats(edge_size=None)
+    by_return = np.zeros(15, dtype=np.int64)
+
+    with open(ofile, "wb") as f:
+        f.write(pack_las_header(out_header))
+        f.write(vlrs)
+        f.truncate(out_header["point_offset"] + point_count * out_header["record_length"])
+    if point_count:
+        src = np.memmap(ifile, dtype=LAS_POINT_FORMATS[header["point_format"]], mode="r",
+                        offset=header["point_offset"], shape=point_count)
+        dst = np.memmap(ofile, dtype=LAS_POINT_FORMATS[6], mode="r+",
+                        offset=out_header["point_offset"], shape=point_count)
+        for first in range(0, point_count, block):
+            old, new = src[first:first + block], dst[first:first + block]
+            for dim in ("X", "Y", "Z", "intensity", "user_data", "point_source_id"):
+                new[dim] = old[dim]
+            return_number = old["return_bits"] & 0x07
+            new["return_bits"] = return_number | ((old["return_bits"] & 0x38) << 1)
+            # Synthetic, key-point and withheld move to the classification flags, scan direction and edge of
+            # flight line keep their bits, the overlap class becomes the overlap flag
+            code = old["classification"] & 0x1F
+            overlap = code == OVERLAP_CLASS
+            channel = (old[channel_field] & 0x3) << 4 if channel_field else 0
+            new["flag_bits"] = (old["classification"] >> 5) | (overlap << 3) | channel | (old["return_bits"] & 0xC0)
+            new["classification"] = LUT_12_TO_14[code]
+            if OVERLAP_RECLASS is not None:
+                new["classification"][overlap] = OVERLAP_RECLASS
+            new["scan_angle"] = np.round(old["scan_angle_rank"] / 0.006)
+            new["gps_time"] = old["gps_time"] + (gps_offset or 0) if has_gps_time else 0
+            by_return += np.bincount(return_number, minlength=16)[1:16]
+            scaled = np.empty(len(new), dtype=stats_dtype)
+            for axis, dim in enumerate("XYZ"):
+                scaled[dim] = new[dim] * header["scale"][axis] + header["offset"][axis]
+            scaled["Classification"] = new["classification"]
+            if has_gps_time:
+                scaled["GpsTime"] = new["gps_time"]
+            stats(scaled)
+        dst.flush()
+        del src, dst
+    out_header["points_by_return"] = by_return.tolist()
+    if stats.count:
+        out_header["mins"], out_header["maxs"] = stats.mins.tolist(), stats.maxs.tolist()
+    with open(ofile, "r+b") as f:
+        f.write(pack_las_header(out_header))
+    if COPC_OUTPUT:
+        write_copc(ofile, sensorsys)
+    if side_products:
+        return stats.write(ofile, epsg)
+    return stats.summary()
 
 def worker_12_to_14():
     lasifiles = [Path(f) for f in glob.glob(ifolder)]
-    with futures.ThreadPoolExecutor(num_workers) as executor:
-        to_do = dict()
-        file_count = 0
-        for lasif in lasifiles:
-            lasof = Path(ofolder, lasif.name).as_posix()
-            future = executor.submit(
-                exc_func_in_proc,
-                psky_12_to_14,
-                lasif.as_posix(),
-                lasof,
-                a_srs,
-                system_id,
-            )
-            to_do[future] = lasif.as_posix()
-            file_count += 1
-        print("Start converting files from 1.2 to 1.4")
+    jobs = {
+        lasif.as_posix(): (
+            lasif.as_posix(), Path(ofolder, output_name(lasif.name)).as_posix(), a_srs, system_id, side_products,
+            gps_week
+        )
+        for lasif in lasifiles
+    }
+    routes = preflight(jobs, a_srs, system_id, side_products)
+    engines = {"link": link_las, "tag": psky_retag14, "numpy": psky_12_to_14_numpy}
+    jobs = {ifile: args for ifile, args in jobs.items() if routes[ifile] != "skip"}
+    print("Start converting files from 1.2 to 1.4")
+    params = {"task": "12_to_14", "a_srs": a_srs, "system_id": system_id, "version": "1.4",
+              "side_products": side_products, "gps_week": gps_week, "copc": COPC_OUTPUT}
+    run_batch(psky_12_to_14, jobs, "converted", manifest=Path(ofolder, MANIFEST_NAME), params=params,
+              catalog=Path(ofolder, CATALOG_NAME), events=Path(ofolder, EVENTS_NAME),
+              routes={ifile: engines[routes[ifile]] for ifile in jobs if routes[ifile] in engines})
+
+def psky_14_to_12(ifile,ofile,side_products=False,start=0,count=None,parts=None):
+    # start, count and parts as for psky_12_to_14
+    if parts is not None:
+        stats = stitch_parts(parts, ofile)
+        return stats.write(ofile) if side_products else stats.summary()
+
+    header = read_las_header(ifile)
+    writer = {
+        **forward_header(header),
+        "type": "writers.las",
+        "minor_version":2,
+        "dataformat_id":3,
+        "compression":"laszip",
+        "vlrs": forward_vlrs(ifile, header, evlrs=False),
+        "filename": f"{ofile}"
+    }
+    wkt = read_las_wkt(ifile, header)
+    if wkt:
+        writer["a_srs"] = wkt
+
+    # Stream the points through a single classification lookup
+    # Statistics for the catalog (and the side products) are collected in the same pass
+    stats = PointStats() if side_products else PointStats(edge_size=None)
+    stream_las(ifile, writer, [partial(remap_classification, lut=LUT_14_TO_12), stats], start=start, count=count)
+    if count is not None:
+        return stats
+    if side_products:
+        return stats.write(ofile)
+    return stats.summary()
+
+def worker_14_to_12():
+    lasifiles = [Path(f) for f in glob.glob(ifolder)]
+    jobs = {
+        lasif.as_posix(): (lasif.as_posix(), Path(ofolder, lasif.name).as_posix(), side_products)
+        for lasif in lasifiles
+    }
+    print("Start converting files from 1.4 to 1.2")
+    params = {"task": "14_to_12", "version": "1.2", "side_products": side_products}
+    run_batch(psky_14_to_12, jobs, "converted", manifest=Path(ofolder, MANIFEST_NAME), params=params,
+              catalog=Path(ofolder, CATALOG_NAME), events=Path(ofolder, EVENTS_NAME))
+
+def psky_hexbin(ifile, edge_size):
+    # Hexbin cell keys and point counts of one file, read in chunks
+    reader = [{"type": "readers.las", "filename": ifile}]
+    check_streamable(reader)
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    for points in pdal.Pipeline(json.dumps(reader)).iterator(chunk_size=stream_chunk_size()):
+        new_keys, new_counts = np.unique(hex_cells(points["X"], points["Y"], edge_size), return_counts=True)
+        keys, counts = merge_counts(keys, counts, new_keys, new_counts)
+    return keys, counts
+
+def write_coverage(ofile, keys, counts, edge_size, threshold, epsg) -> None:
+    # Only needed for the coverage command
+    import shapely
+    from osgeo import ogr, osr
+
+    covered = counts >= threshold
+    hexagons = shapely.polygons(hex_polygons(keys[covered], edge_size))
+    # Hexagons share exact corners, so the fast coverage union dissolves them
+    coverage = shapely.multipolygons(shapely.get_parts(shapely.coverage_union_all(hexagons)))
+
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(ofile):
+        driver.DeleteDataSource(ofile)
+    data_source = driver.CreateDataSource(ofile)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(f"{epsg}")
+    layer = data_source.CreateLayer("coverage", srs=srs, geom_type=ogr.wkbMultiPolygon)
+    layer.CreateField(ogr.FieldDefn("points", ogr.OFTInteger64))
+    layer.CreateField(ogr.FieldDefn("cells", ogr.OFTInteger64))
+    layer.CreateField(ogr.FieldDefn("edge_size", ogr.OFTReal))
+    layer.CreateField(ogr.FieldDefn("threshold", ogr.OFTInteger))
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetField("points", int(counts[covered].sum()))
+    feature.SetField("cells", int(covered.sum()))
+    feature.SetField("edge_size", float(edge_size))
+    feature.SetField("threshold", int(threshold))
+    feature.SetGeometry(ogr.CreateGeometryFromWkb(shapely.to_wkb(coverage)))
+    layer.CreateFeature(feature)
+    feature = None
+    data_source = None
+
+def strip_cells(ifile, cell_size):
+    # {PointSourceId: sorted grid_cells keys} of the cells each flight strip in the file has points in, read in chunks
+    reader = [{"type": "readers.las", "filename": ifile}]
+    check_streamable(reader)
+    strips = dict()
+    for points in pdal.Pipeline(json.dumps(reader)).iterator(chunk_size=stream_chunk_size()):
+        keys = grid_cells(points["X"], points["Y"], cell_size)
+        for source in np.unique(points["PointSourceId"]):
+            source_keys = np.unique(keys[points["PointSourceId"] == source])
+            strips[int(source)] = np.union1d(strips.get(int(source), source_keys), source_keys)
+    return strips
+
+def overlap_cells(strips: dict) -> np.ndarray:
+    # Sorted keys of the cells two or more strips have points in, strips = {PointSourceId: sorted cell keys}
+    # One count over all strips, no strip is compared with another
+    if not strips:
+        return np.empty(0, dtype=np.int64)
+    keys, counts = np.unique(np.concatenate(list(strips.values())), return_counts=True)
+    return keys[counts > 1]
+
+def psky_flag_overlap(ifile,ofile,cells_file,cell_size=OVERLAP_CELL_SIZE,start=0,count=None,parts=None):
+    # Overlap flag on the points of a LAS 1.4 file in the cells of cells_file (see worker_overlap)
+    # start, count and parts as for psky_12_to_14
+    if parts is not None:
+        return stitch_parts(parts, ofile).summary()
+
+    header = read_las_header(ifile)
+    if header["point_format"] < 6:
+        raise ValueError(f"Overlap flags need LAS 1.4 point format 6 or higher, convert first: {ifile!r}")
+    writer = {
+        **forward_header(header),
+        "type": "writers.las",
+        "extra_dims": "all",
+        "minor_version": 4,
+        "dataformat_id": header["point_format"],
+        "compression": "laszip",
+        "vlrs": forward_vlrs(ifile, header),
+        "filename": f"{ofile}"
+    }
+    wkt = read_las_wkt(ifile, header)
+    if wkt:
+        writer["a_srs"] = wkt
+
+    # The cells are shared by all workers through the page cache
+    cells = np.load(cells_file, mmap_mode="r")
+    stats = PointStats(edge_size=None)
+    transforms = [partial(flag_overlap, cells=cells, cell_size=cell_size), stats]
+    stream_las(ifile, writer, transforms, start=start, count=count, dims=[("ClassFlags", "u1")])
+    if count is not None:
+        return stats
+    return stats.summary()
+
+def worker_overlap():
+    lasifiles = [Path(f) for f in glob.glob(ifolder)]
+    file_count = len(lasifiles)
+    strips = dict()
+    print("Start gridding flight strips")
+    with WorkerPool(num_workers) as pool:
+        to_do = {
+            pool.submit(strip_cells, lasif.as_posix(), overlap_cell_size, size=lasif.stat().st_size): lasif.as_posix()
+            for lasif in lasifiles
+        }
         for count, future in enumerate(futures.as_completed(to_do), 1):
+            try:
+                for source, keys in future.result().items():
+                    strips[source] = np.union1d(strips.get(source, keys), keys)
+            except Exception as exc:
+                print(f"File failed [{count}/{file_count}]: {to_do[future]!r}\n{exc}", file=sys.stderr)
+                continue
             print(
-                f"File converted [{count}/{file_count} ({count/file_count*100: >4.1f}%)]: "
+                f"File gridded [{count}/{file_count} ({count/file_count*100: >4.1f}%)]: "
                 f"{to_do[future]!r}"
             )
+    cells = overlap_cells(strips)
+    Path(ofolder).mkdir(parents=True, exist_ok=True)
+    cells_file = Path(ofolder, OVERLAP_CELLS_NAME).as_posix()
+    np.save(cells_file, cells)
+    print(f"{len(cells)} cell(s) covered by more than one of {len(strips)} flight strip(s)")
 
-def psky_14_to_12(ifile,ofile):
-    
-    pipeline = [
-        {
-            "type": "readers.las",
-            "filename": ifile,
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 24 WHERE Classification == 21"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 26 WHERE Classification == 40"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 27 WHERE Classification == 41"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 28 WHERE Classification == 42"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 29 WHERE Classification == 43"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 30 WHERE Classification == 44"
-        },
-        {
-            "type":"filters.assign",
-            "value" : "Classification = 31 WHERE Classification == 45"
-        },
-        {
-            "type": "writers.las",
-            "forward": "header",
-            "minor_version":2,
-            "dataformat_id":3,
-            "compression":"laszip",
-            "filename": "{ofile}"
-        }
-    ]
-    pipeline_json = json.dumps(pipeline)
-
-    # Run PDAL Pipeline
-    pipeline = pdal.Pipeline(pipeline_json)
-    count = run_pipeline(pipeline_json)
-    #arrays = pipeline.arrays
-    #metadata = pipeline.metadata
-    #logger = pipeline.log    
+    jobs = {
+        lasif.as_posix(): (lasif.as_posix(), Path(ofolder, lasif.name).as_posix(), cells_file, overlap_cell_size)
+        for lasif in lasifiles
+    }
+    print("Start flagging overlap")
+    # The flags depend on every strip, a changed delivery changes the cells and redoes all files
+    params = {"task": "overlap", "cell_size": overlap_cell_size, "cells": hashlib.sha1(cells.tobytes()).hexdigest()}
+    run_batch(psky_flag_overlap, jobs, "flagged", manifest=Path(ofolder, MANIFEST_NAME), params=params,
+              catalog=Path(ofolder, CATALOG_NAME), events=Path(ofolder, EVENTS_NAME))
 
-def worker_14_to_12():
+def worker_coverage():
     lasifiles = [Path(f) for f in glob.glob(ifolder)]
-    with futures.ThreadPoolExecutor(num_workers) as executor:
-        to_do = dict()
-        file_count = 0
-        for lasif in lasifiles:
-            lasof = Path(ofolder, lasif.name).as_posix()
-            future = executor.submit(
-                exc_func_in_proc,
-                psky_14_to_12,
-                lasif.as_posix(),
-                lasof,
-            )
-            to_do[future] = lasif.as_posix()
-            file_count += 1
-        print("Start converting files from 1.4 to 1.2")
+    file_count = len(lasifiles)
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    print("Start binning files")
+    with WorkerPool(num_workers) as pool:
+        to_do = {
+            pool.submit(psky_hexbin, lasif.as_posix(), hexbin_edge_size, size=lasif.stat().st_size): lasif.as_posix()
+            for lasif in lasifiles
+        }
         for count, future in enumerate(futures.as_completed(to_do), 1):
+            try:
+                keys, counts = merge_counts(keys, counts, *future.result())
+            except Exception as exc:
+                print(f"File failed [{count}/{file_count}]: {to_do[future]!r}\n{exc}", file=sys.stderr)
+                continue
             print(
-                f"File converted [{count}/{file_count} ({count/file_count*100: >4.1f}%)]: "
+                f"File binned [{count}/{file_count} ({count/file_count*100: >4.1f}%)]: "
                 f"{to_do[future]!r}"
             )
+    write_coverage(coverage_file, keys, counts, hexbin_edge_size, hexbin_threshold, a_srs)
+    print(f"Coverage written to {coverage_file!r}")
 
-def run_pipeline(pipeline_json: str) -> int:
+def run_pipeline(pipeline_json: str, chunk_size=CHUNK_SIZE, memory_limit=MAX_WORKER_MEMORY,
+                 allow_in_memory=ALLOW_IN_MEMORY) -> int:
+    chunk_size = stream_chunk_size(chunk_size, memory_limit)
+    streamable = check_streamable(json.loads(pipeline_json), allow_in_memory)
     p = pdal.Pipeline(pipeline_json)
+    if not streamable:
+        with worker_memory_lifted():
+            return p.execute()
 
     # Different python-pdal versions expose different method names.
     if hasattr(p, "execute_streaming"):
-        return p.execute_streaming()      # some builds
-    if hasattr(p, "executeStreaming"):
-        return p.executeStreaming()       # some builds (camelCase)
-    return p.execute()                    # always available
+        return p.execute_streaming(chunk_size=chunk_size)
+    return p.executeStreaming(chunk_size=chunk_size)
 
 
 if __name__ == "__main__":
     #MACHINE VARIABLES
-    num_workers = 8 # Have fun, as many workers as the number of cores you have available :)
+    ## One worker per core, but no more than MAX_WORKER_MEMORY fits MEMORY_BUDGET times (8 where neither is known)
+    ## How many files run at once is then decided by MEMORY_BUDGET, see the scheduling settings at the top
+    budget = MEMORY_BUDGET or (int(MEMORY_SHARE * physical_memory()) if physical_memory() else None)
+    num_workers = max(1, min(os.cpu_count() or 8, budget // MAX_WORKER_MEMORY if budget else 8))
 
     #DO WORK
     ## Sett ønsket arbeidsoppgave til True og juster prosjektparametre
@@ -292,16 +2574,46 @@ if __name__ == "__main__":
     # Konverter LAS 1.4 til LAS 1.2
     ## Filen konverteres ned til 1.2 og klassekoder remappes til FKB-Laser
     ## Merk: konverteringen er destruktiv (scan angle resolution, scanner channel, return numbers, classes over 32, timing)
+    ## "side_products" = skriv hexbin-dekning (.hex.geojson) og statistikk (.stats.json) ved siden av hver fil i samme lesing
     if False:
+        side_products = False
         ifolder = r"C:\projects\pskytools\las14\*.laz" 
         ofolder = r"C:\projects\pskytools\las12_test"
         worker_14_to_12()
     
     # Konverter LAS 1.2 til LAS 1.4
     ## Filen konverteres opp til 1.4 og klassekoder remappes til Produktspesifikasjon Punktsky
+    ## I samme lesing: GPS-ukestid til justert standard GPS-tid (når gps_week er gitt), klasse 12 (overlapp) til overlappflagg, skannerkanal fra SCAN_CHANNEL_DIM
+    ## OVERLAP_RECLASS øverst gir overlappunktene en ny klasse (None = behold klasse 12)
+    ## "side_products" = skriv hexbin-dekning (.hex.geojson) og statistikk (.stats.json) ved siden av hver fil i samme lesing
+    ## "gps_week"      = GPS-uke for filer med GPS-ukestid (None = behold GPS-ukestid, opprettelsesdatoen i headeren er som regel prosesseringsdatoen)
+    ## Filer som allerede er LAS 1.4 punktformat 6 konverteres ikke på nytt, de tagges eller lenkes (se preflight)
+    ## COPC_OUTPUT = True øverst skriver COPC (.copc.laz) med oktre, slik at klipping og visning kan lese bare nodene de trenger
     if True:
         a_srs     = "EPSG:5972"
         system_id = "BMB00"        
+        side_products = False
+        gps_week = None
         ifolder = r"12/*.laz" 
         ofolder = r"14"
-        worker_12_to_14()                         
+        worker_12_to_14()
+
+    # Dekning (hexbin) for et helt prosjekt
+    ## Alle filer bins parallelt og slås sammen til ett dekningslag i en GeoPackage (krever shapely 2 og GDAL)
+    ## "hexbin_edge_size" = kantlengde på heksagon i meter, "hexbin_threshold" = minste antall punkt i et dekket heksagon
+    if False:
+        a_srs            = "EPSG:5972"
+        hexbin_edge_size = HEXBIN_EDGE_SIZE
+        hexbin_threshold = HEXBIN_THRESHOLD
+        ifolder = r"14/*.laz"
+        coverage_file = r"14_dekning.gpkg"
+        worker_coverage()
+
+    # Overlappflagg på tvers av flystriper
+    ## Første lesing: hvilke ruter (overlap_cell_size meter) hver flystripe (PointSourceId) har punkt i, filene parallelt
+    ## Andre lesing: punkt i ruter med punkt fra flere flystriper får overlappflagget (krever LAS 1.4 punktformat 6)
+    if False:
+        overlap_cell_size = OVERLAP_CELL_SIZE
+        ifolder = r"14/*.laz"
+        ofolder = r"14_overlapp"
+        worker_overlap()                         
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+"""
+Benchmark of the psky_asprs_las_tools conversion workers on synthetic LiDAR files.
+
+Deterministic LAS 1.2 (point format 3) and LAS 1.4 (point format 6) files of configurable
+size and class mix are generated, optionally compressed to LAZ with PDAL, and every task is
+run over them once per worker count. One JSON line per file and one per run is appended to
+the results file, so runs can be compared over time and num_workers chosen from data.
+
+Spatial locality of each LAZ output is measured as the share of its LAZ chunks a small query
+window touches (the chunks a spatial read has to decompress), which together with the output
+size shows the effect of the sorted tasks (SORT_ORDER).
+
+The *_pipelined tasks run the same conversion with PIPELINED, their run line also records
+pipelined_gain, the throughput over that of the unpipelined task with the same workers.
+
+Usage:
+    python psky_benchmark.py --files 8 --points 2000000 --workers 1 2 4 8 --compressed
+    python psky_benchmark.py --tasks 12_to_14 --classes 2:0.6,5:0.3,24:0.1 -o bench.jsonl
+
+Peak RSS is measured per file (worker and PIPELINED stage processes together) from the Linux
+high-water marks and left empty elsewhere. CPU time is read with the resource module and is
+left empty on Windows.
+"""
+
+import argparse
+from datetime import datetime, timezone
+from functools import partial
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import sys
+import tempfile
+import textwrap
+import time
+
+import numpy as np
+import pdal
+
+import psky_asprs_las_tools as psky
+
+# Share of each class code in the synthetic files, FKB-Laser codes (24, 26-31) are remapped by the conversions
+CLASS_MIX = {1: 0.05, 2: 0.45, 3: 0.05, 4: 0.05, 5: 0.2, 6: 0.1, 9: 0.04, 24: 0.03, 26: 0.01, 30: 0.02}
+# Tile of the synthetic files, 1 km x 1 km in UTM 32, scanned in 10 flight lines
+TILE_ORIGIN = (500000.0, 6600000.0)
+TILE_SIZE = 1000.0
+FLIGHT_LINES = 10
+EPSG = "EPSG:25832"
+SYSTEM_ID = "BENCH"
+# Query windows of the spatial read measurement, QUERY_SIZE metres square at QUERIES random places in the tile
+QUERIES = 100
+QUERY_SIZE = 50.0
+
+
+def with_settings(settings: dict, func, *args):
+    # func with module settings of psky_asprs_las_tools changed in the worker process running it
+    saved = {name: getattr(psky, name) for name in settings}
+    vars(psky).update(settings)
+    try:
+        return func(*args)
+    finally:
+        vars(psky).update(saved)
+
+
+# Name: (input LAS version, task function, arguments after ifile and ofile)
+## 12_to_14_numpy only differs from 12_to_14 for uncompressed inputs (without --compressed)
+TASKS = {
+    "12_to_14": ("1.2", psky.psky_12_to_14, (EPSG, SYSTEM_ID)),
+    "12_to_14_pipelined": ("1.2", partial(with_settings, {"PIPELINED": True}, psky.psky_12_to_14), (EPSG, SYSTEM_ID)),
+    "12_to_14_numpy": ("1.2", partial(with_settings, {"NUMPY_TRANSCODE": True}, psky.psky_12_to_14), (EPSG, SYSTEM_ID)),
+    "12_to_14_morton": ("1.2", partial(with_settings, {"SORT_ORDER": "morton"}, psky.psky_12_to_14), (EPSG, SYSTEM_ID)),
+    "12_to_14_hilbert": ("1.2", partial(with_settings, {"SORT_ORDER": "hilbert"}, psky.psky_12_to_14), (EPSG, SYSTEM_ID)),
+    "14_to_12": ("1.4", psky.psky_14_to_12, ()),
+    "14_to_12_pipelined": ("1.4", partial(with_settings, {"PIPELINED": True}, psky.psky_14_to_12), ()),
+    "tag14": ("1.4", psky.psky_tag14, (EPSG, SYSTEM_ID)),
+}
+
+
+def parse_class_mix(text) -> dict:
+    # "2:0.6,5:0.3,24:0.1" -> {2: 0.6, 5: 0.3, 24: 0.1}
+    return {int(code): float(share) for code, share in (item.split(":") for item in text.split(","))}
+
+
+def synthetic_points(point_count, point_format, class_mix, seed) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    points = np.zeros(point_count, dtype=psky.LAS_POINT_FORMATS[point_format])
+    # Acquisition order: flight lines one after another, points along each line in time order
+    gps_time = np.sort(rng.uniform(0, 60 * FLIGHT_LINES, point_count))
+    line = np.minimum((gps_time // 60).astype(np.int64), FLIGHT_LINES - 1)
+    along = (gps_time % 60) / 60 * TILE_SIZE
+    across = (line + rng.uniform(0, 1, point_count)) * TILE_SIZE / FLIGHT_LINES
+    x = np.where(line % 2, TILE_SIZE - along, along)
+    z = 100 + 20 * np.sin(x / 150) * np.cos(across / 200) + rng.normal(0, 0.5, point_count)
+    # Coordinates are stored with scale 0.01 and offset at the tile origin
+    points["X"] = np.round(x * 100)
+    points["Y"] = np.round(across * 100)
+    points["Z"] = np.round(z * 100)
+    points["intensity"] = rng.integers(0, 4096, point_count)
+    number_of_returns = rng.integers(1, 4, point_count)
+    return_number = rng.integers(1, 4, point_count) % number_of_returns + 1
+    scan_direction = line % 2
+    edge = (along < 1) | (along > TILE_SIZE - 1)
+    scan_angle = (across % (TILE_SIZE / FLIGHT_LINES)) / (TILE_SIZE / FLIGHT_LINES) * 40 - 20
+    codes = np.array(list(class_mix.keys()), dtype=np.uint8)
+    shares = np.array(list(class_mix.values()), dtype=float)
+    points["classification"] = rng.choice(codes, point_count, p=shares / shares.sum())
+    points["point_source_id"] = line + 1
+    points["user_data"] = 0
+    if point_format == 6:
+        points["return_bits"] = return_number | (number_of_returns << 4)
+        points["flag_bits"] = (scan_direction << 6) | (edge << 7)
+        points["scan_angle"] = np.round(scan_angle / 0.006)
+        # Adjusted standard GPS time
+        points["gps_time"] = 4.0e8 + gps_time
+    else:
+        points["return_bits"] = return_number | (number_of_returns << 3) | (scan_direction << 6) | (edge << 7)
+        points["scan_angle_rank"] = np.round(scan_angle)
+        # GPS week time
+        points["gps_time"] = 86400.0 + gps_time
+    if "red" in points.dtype.names:
+        for band in ("red", "green", "blue"):
+            points[band] = rng.integers(0, 65536, point_count)
+    return points
+
+
+def write_synthetic_las(filename, version, point_count, class_mix, seed) -> None:
+    point_format = 6 if version == "1.4" else 3
+    points = synthetic_points(point_count, point_format, class_mix, seed)
+    if point_format == 6:
+        return_number = points["return_bits"] & 0x0F
+    else:
+        return_number = points["return_bits"] & 0x07
+    xyz = [points[dim] * 0.01 + offset for dim, offset in zip("XYZ", (*TILE_ORIGIN, 0.0))]
+    today = datetime.now(timezone.utc).timetuple()
+    header = {
+        "minor_version": int(version[-1]),
+        "global_encoding": 1 if point_format == 6 else 0,
+        "system_id": SYSTEM_ID,
+        "software_id": "psky_benchmark",
+        "creation_doy": today.tm_yday,
+        "creation_year": today.tm_year,
+        "point_format": point_format,
+        "record_length": points.dtype.itemsize,
+        "point_count": point_count,
+        "points_by_return": np.bincount(return_number, minlength=16)[1:].tolist(),
+        "scale": (0.01, 0.01, 0.01),
+        "offset": (*TILE_ORIGIN, 0.0),
+        "mins": [float(axis.min()) for axis in xyz],
+        "maxs": [float(axis.max()) for axis in xyz],
+    }
+    with open(filename, "wb") as f:
+        f.write(psky.pack_las_header(header))
+        f.write(points.tobytes())
+
+
+def compress(ifile, ofile) -> None:
+    pipeline = [
+        {"type": "readers.las", "filename": ifile},
+        {
+            "type": "writers.las",
+            "forward": "all",
+            "extra_dims": "all",
+            "a_srs": EPSG,
+            "compression": "laszip",
+            "filename": ofile,
+        },
+    ]
+    pdal.Pipeline(json.dumps(pipeline)).execute()
+
+
+def generate_inputs(folder, files, point_count, class_mix, compressed, seed) -> dict:
+    # {"1.2": [files], "1.4": [files]}, identical for identical arguments
+    inputs = dict()
+    for version in ("1.2", "1.4"):
+        vfolder = Path(folder, f"las{version.replace('.', '')}")
+        vfolder.mkdir(parents=True, exist_ok=True)
+        inputs[version] = list()
+        for number in range(files):
+            las = vfolder / f"synthetic_{number:04d}.las"
+            write_synthetic_las(las, version, point_count, class_mix, seed + number)
+            if compressed:
+                laz = las.with_suffix(".laz")
+                compress(las.as_posix(), laz.as_posix())
+                las.unlink()
+                las = laz
+            inputs[version].append(las.as_posix())
+    return inputs
+
+
+def chunks_per_query(filename, seed=0):
+    # Mean share of the LAZ chunks of filename whose XY bounds intersect a query window, None for uncompressed files
+    header = psky.read_las_header(filename)
+    if not header["compressed"] or not header["point_count"]:
+        return None
+    counts = psky.read_chunk_table(filename, header)["counts"]
+    reader = [{"type": "readers.las", "filename": filename}]
+    xy = np.concatenate([
+        np.stack([points["X"], points["Y"]], axis=1)
+        for points in pdal.Pipeline(json.dumps(reader)).iterator(chunk_size=psky.stream_chunk_size())
+    ])
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    mins = np.minimum.reduceat(xy, starts)
+    maxs = np.maximum.reduceat(xy, starts)
+    rng = np.random.default_rng(seed)
+    low = rng.uniform(header["mins"][:2], np.maximum(header["mins"][:2], np.subtract(header["maxs"][:2], QUERY_SIZE)),
+                      size=(QUERIES, 2))
+    high = low + QUERY_SIZE
+    touched = (mins[None] <= high[:, None]) & (maxs[None] >= low[:, None])
+    return float(touched.all(axis=2).mean())
+
+
+def measured(func, ifile, ofile, *args) -> dict:
+    # Runs func in the worker process and returns its per-file measurements
+    # The spatial read measurement is made after the timing
+    header = psky.read_las_header(ifile)
+    measuring = psky.reset_peak_rss()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    func(ifile, ofile, *args)
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    peak_rss = psky.task_peak_rss() if measuring else None
+    return {
+        "points": header["point_count"],
+        "bytes_in": os.path.getsize(ifile),
+        "bytes_out": os.path.getsize(ofile),
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "points_per_second": header["point_count"] / seconds if seconds else None,
+        "peak_rss": peak_rss,
+        "chunks_per_query": chunks_per_query(ofile),
+    }
+
+
+def children_cpu_seconds():
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def benchmark(task, ifiles, workers, workdir, run_id) -> list:
+    version, func, args = TASKS[task]
+    ofolder = Path(workdir, f"out_{task}_{workers}")
+    ofolder.mkdir(parents=True, exist_ok=True)
+    jobs = {ifile: (ifile, Path(ofolder, Path(ifile).name).as_posix(), *args) for ifile in ifiles}
+    cpu_start = children_cpu_seconds()
+    start = time.perf_counter()
+    outcome = psky.run_batch(partial(measured, func), jobs, "benchmarked", workers=workers)
+    seconds = time.perf_counter() - start
+    cpu_end = children_cpu_seconds()
+    common = {"run": run_id, "task": task, "workers": workers}
+    records = [
+        {**common, "type": "file", "file": ifile, **metrics}
+        for ifile, metrics in outcome.items() if isinstance(metrics, dict)
+    ]
+    points = sum(record["points"] for record in records)
+    shares = [record["chunks_per_query"] for record in records if record["chunks_per_query"] is not None]
+    records.append({
+        **common,
+        "type": "run",
+        "files": len(records),
+        "failed": len(outcome) - len(records),
+        "points": points,
+        "bytes_in": sum(record["bytes_in"] for record in records),
+        "bytes_out": sum(record["bytes_out"] for record in records),
+        "seconds": seconds,
+        "cpu_seconds": cpu_end - cpu_start if cpu_start is not None else None,
+        "points_per_second": points / seconds if seconds else None,
+        "peak_rss": max((record["peak_rss"] or 0 for record in records), default=None),
+        "chunks_per_query": float(np.mean(shares)) if shares else None,
+    })
+    shutil.rmtree(ofolder)
+    return records
+
+
+def main(**kwargs):
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    host = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "pdal": getattr(pdal, "__version__", None),
+    }
+    workdir = Path(kwargs["workdir"] or tempfile.mkdtemp(prefix="psky_benchmark_"))
+    try:
+        print(f"Generating {kwargs['files']} x {kwargs['points']} points per LAS version in {workdir}")
+        inputs = generate_inputs(workdir, kwargs["files"], kwargs["points"], kwargs["classes"],
+                                 kwargs["compressed"], kwargs["seed"])
+        settings = {key: kwargs[key] for key in ("files", "points", "compressed", "seed")}
+        settings["classes"] = kwargs["classes"]
+        runs = dict()
+        with open(kwargs["output"], "a", encoding="utf-8") as results:
+            for task in kwargs["tasks"]:
+                for workers in kwargs["workers"]:
+                    records = benchmark(task, inputs[TASKS[task][0]], workers, workdir, run_id)
+                    run = runs[task, workers] = records[-1]
+                    # Throughput of a *_pipelined task over the same task unpipelined, when that ran before
+                    plain = runs.get((task.removesuffix("_pipelined"), workers))
+                    if task.endswith("_pipelined") and plain and plain["points_per_second"] and run["points_per_second"]:
+                        run["pipelined_gain"] = run["points_per_second"] / plain["points_per_second"]
+                    for record in records:
+                        results.write(json.dumps({**record, "host": host, "settings": settings}) + "\n")
+                    print(
+                        f"{task:>18} workers={workers:<3} {run['seconds']:8.2f} s "
+                        f"{(run['points_per_second'] or 0) / 1e6:8.2f} Mpts/s "
+                        f"{run['bytes_out'] / 1024**2:9.1f} MiB out"
+                        + (f"  {run['chunks_per_query']:6.1%} chunks/query" if run["chunks_per_query"] is not None else "")
+                        + (f"  x{run['pipelined_gain']:.2f} pipelined" if "pipelined_gain" in run else "")
+                        + (f"  failed={run['failed']}" if run["failed"] else "")
+                    )
+    finally:
+        if not kwargs["keep"]:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(f"Results appended to {kwargs['output']!r}")
+
+
+parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,
+                                 description=textwrap.dedent("""\
+                                 Benchmark of the psky_asprs_las_tools workers on synthetic
+                                 LAS 1.2 (format 3) and LAS 1.4 (format 6) files."""))
+parser.add_argument("-o", "--output", default="psky_benchmark.jsonl",
+                    help="JSON lines results file, appended to. Default is psky_benchmark.jsonl.")
+parser.add_argument("--files", type=int, default=4,
+                    help="Number of synthetic files per LAS version. Default is 4.")
+parser.add_argument("--points", type=int, default=1_000_000,
+                    help="Points per synthetic file. Default is 1000000.")
+parser.add_argument("--classes", type=parse_class_mix, default=CLASS_MIX,
+                    help="Class mix as code:share pairs, e.g. 2:0.6,5:0.3,24:0.1.")
+parser.add_argument("--compressed", action="store_true",
+                    help="Compress the synthetic files to LAZ.")
+parser.add_argument("--seed", type=int, default=0,
+                    help="Random seed, the same seed gives the same files. Default is 0.")
+parser.add_argument("--tasks", nargs="+", choices=list(TASKS), default=list(TASKS),
+                    help="Tasks to run. Default is all.")
+parser.add_argument("--workers", nargs="+", type=int, default=[1, os.cpu_count()],
+                    help="Worker counts to run every task with. Default is 1 and the number of cores.")
+parser.add_argument("--workdir",
+                    help="Folder for the synthetic files and outputs. Default is a temporary folder.")
+parser.add_argument("--keep", action="store_true",
+                    help="Keep the synthetic files and the working folder.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(**vars(args))
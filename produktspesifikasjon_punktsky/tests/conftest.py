@@ -0,0 +1,5 @@
+# The tools are scripts, not a package, the tests import them from the folder above
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
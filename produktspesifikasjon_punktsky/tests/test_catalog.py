@@ -0,0 +1,96 @@
+import json
+import shutil
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pdal")
+laspy = pytest.importorskip("laspy")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+def write_las(filename, minx, miny, size=100.0, system_id="psky test"):
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.system_identifier = system_id
+    header.offsets = [minx, miny, 0]
+    header.scales = [0.01, 0.01, 0.01]
+    las = laspy.LasData(header)
+    las.x = np.array([minx, minx + size])
+    las.y = np.array([miny, miny + size])
+    las.z = np.array([1.0, 2.0])
+    las.write(filename)
+    return filename.as_posix()
+
+def rows(catalog):
+    with closing(sqlite3.connect(catalog)) as connection:
+        connection.row_factory = sqlite3.Row
+        return {row["path"]: dict(row) for row in connection.execute("SELECT * FROM files")}
+
+@pytest.fixture
+def tiles(tmp_path):
+    # 2 x 2 tiles of 100 m
+    return {(i, j): write_las(tmp_path / f"{i}_{j}.las", 1000 + i * 100, 2000 + j * 100)
+            for i in range(2) for j in range(2)}
+
+def test_catalog_rows(tmp_path, tiles):
+    catalog = tmp_path / psky.CATALOG_NAME
+    with closing(psky.open_catalog(catalog)) as connection:
+        psky.catalog_file(connection, tiles[0, 0], "in/0_0.las")
+        psky.catalog_file(connection, tiles[1, 0], summary={
+            "points": 2,
+            "bounds": {"minx": 1100, "miny": 2000, "minz": 1, "maxx": 1150, "maxy": 2050, "maxz": 2},
+            "gps_time": (10.0, 20.0),
+            "classes": {"2": 2},
+        })
+    catalogued = rows(catalog)
+    assert len(catalogued) == 2
+    row = catalogued[Path(tiles[0, 0]).resolve().as_posix()]
+    assert row["source"].endswith("in/0_0.las")
+    assert (row["version"], row["point_format"], row["compressed"], row["points"]) == ("1.4", 6, 0, 2)
+    assert row["system_id"] == "psky test"
+    assert (row["minx"], row["miny"], row["maxx"], row["maxy"]) == (1000, 2000, 1100, 2100)
+    assert row["classes"] is None
+    row = catalogued[Path(tiles[1, 0]).resolve().as_posix()]
+    assert (row["maxx"], row["maxy"], row["gps_time_min"], row["gps_time_max"]) == (1150, 2050, 10.0, 20.0)
+    assert json.loads(row["classes"]) == {"2": 2}
+
+def test_catalog_file_again_replaces(tmp_path, tiles):
+    catalog = tmp_path / psky.CATALOG_NAME
+    with closing(psky.open_catalog(catalog)) as connection:
+        psky.catalog_file(connection, tiles[0, 0])
+        write_las(Path(tiles[0, 0]), 5000, 5000)
+        psky.catalog_file(connection, tiles[0, 0])
+        assert connection.execute("SELECT COUNT(*) FROM files_rtree").fetchone() == (1,)
+    assert psky.query_catalog(catalog, 5000, 5000, 5001, 5001) == [Path(tiles[0, 0]).resolve().as_posix()]
+    assert psky.query_catalog(catalog, 1000, 2000, 1001, 2001) == []
+
+@pytest.mark.parametrize("box, expected", [
+    ((1010, 2010, 1020, 2020), [(0, 0)]),
+    ((1050, 2050, 1150, 2060), [(0, 0), (1, 0)]),
+    ((1100, 2100, 1100, 2100), [(0, 0), (0, 1), (1, 0), (1, 1)]),  # Corner shared by all four
+    ((900, 1900, 2000, 3000), [(0, 0), (0, 1), (1, 0), (1, 1)]),
+    ((1201, 2000, 1300, 2100), []),
+])
+def test_query_catalog(tmp_path, tiles, box, expected):
+    catalog = tmp_path / psky.CATALOG_NAME
+    with closing(psky.open_catalog(catalog)) as connection:
+        for filename in tiles.values():
+            psky.catalog_file(connection, filename)
+    assert psky.query_catalog(catalog, *box) == sorted(Path(tiles[tile]).resolve().as_posix() for tile in expected)
+
+def copy(ifile, ofile):
+    shutil.copyfile(ifile, ofile)
+    return {"points": 2, "classes": {"1": 2}}
+
+def test_run_batch_catalog(tmp_path, tiles):
+    outputs = tmp_path / "out"
+    outputs.mkdir()
+    jobs = {ifile: (ifile, (outputs / Path(ifile).name).as_posix()) for ifile in tiles.values()}
+    catalog = outputs / psky.CATALOG_NAME
+    psky.run_batch(copy, jobs, "copied", workers=2, catalog=catalog)
+    catalogued = rows(catalog)
+    assert sorted(catalogued) == sorted(Path(ofile).resolve().as_posix() for _, ofile in jobs.values())
+    assert all(json.loads(row["classes"]) == {"1": 2} for row in catalogued.values())
+    assert psky.query_catalog(catalog, 1150, 2150, 1160, 2160) == [(outputs / "1_1.las").resolve().as_posix()]
@@ -0,0 +1,82 @@
+import struct
+
+import pytest
+
+pytest.importorskip("pdal")
+laspy = pytest.importorskip("laspy")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+POINTS = 5000
+
+@pytest.fixture
+def copc_file(tmp_path):
+    # Smallest valid COPC: all points in the root node, the hierarchy in one page of an EVLR
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.vlrs.append(laspy.VLR(psky.COPC_USER_ID, psky.COPC_INFO_RECORD_ID, record_data=bytes(psky.COPC_INFO.size)))
+    las = laspy.LasData(header)
+    rng = np.random.default_rng(19)
+    las.x = rng.random(POINTS) * 100
+    las.y = rng.random(POINTS) * 100
+    las.z = np.zeros(POINTS)
+    las.evlrs = laspy.vlrs.vlrlist.VLRList(
+        [laspy.VLR(psky.COPC_USER_ID, psky.COPC_HIERARCHY_RECORD_ID, record_data=bytes(psky.COPC_ENTRY.size))]
+    )
+    filename = tmp_path / "points.copc.laz"
+    with open(filename, "wb") as f:
+        las.write(f, do_compress=True)
+
+    info = psky.read_las_header(filename)
+    data = bytearray(filename.read_bytes())
+    (chunk_table,) = struct.unpack_from("<q", data, info["point_offset"])
+    first_chunk = info["point_offset"] + 8
+    page = info["evlr_offset"] + psky.LAS_EVLR_HEADER.size
+    struct.pack_into(psky.COPC_ENTRY.format, data, page, 0, 0, 0, 0, first_chunk, chunk_table - first_chunk, POINTS)
+    info_at = info["header_size"] + psky.LAS_VLR_HEADER.size
+    struct.pack_into(psky.COPC_INFO.format, data, info_at, 50, 50, 0, 50, 1, page, psky.COPC_ENTRY.size, 0, 0,
+                     *[0] * 11)
+    filename.write_bytes(data)
+    return filename, page, info_at
+
+def test_validate_copc(copc_file):
+    filename, _, _ = copc_file
+    assert psky.validate_copc(filename) == {"nodes": 1, "points": POINTS, "depth": 0}
+
+@pytest.mark.parametrize("fault, message", [
+    (lambda data, page, info: struct.pack_into("<i", data, page + 28, POINTS - 1), "header"),
+    (lambda data, page, info: struct.pack_into("<4i", data, page, 1, 0, 0, 0), "root node missing"),
+    (lambda data, page, info: struct.pack_into("<Q", data, page + 16, len(data)), "outside the point data"),
+    (lambda data, page, info: struct.pack_into("<Q", data, info + 48, psky.COPC_ENTRY.size - 1), "malformed"),
+    (lambda data, page, info: struct.pack_into("<4i", data, page, -1, 0, 0, 0), "out of range"),
+])
+def test_validate_copc_faults(copc_file, fault, message):
+    filename, page, info_at = copc_file
+    data = bytearray(filename.read_bytes())
+    fault(data, page, info_at)
+    filename.write_bytes(data)
+    with pytest.raises(ValueError, match=message):
+        psky.validate_copc(filename)
+
+def test_validate_copc_plain_laz(tmp_path):
+    las = laspy.LasData(laspy.LasHeader(point_format=6, version="1.4"))
+    las.x = las.y = las.z = np.zeros(10)
+    filename = tmp_path / "plain.laz"
+    las.write(filename)
+    with pytest.raises(ValueError, match="Not COPC"):
+        psky.validate_copc(filename)
+
+def test_write_copc_in_capped_worker(tmp_path, monkeypatch):
+    # The octree is built on all points in memory, more than the worker ceiling (scaled down with the file)
+    points = 3_000_000
+    monkeypatch.setattr(psky, "MAX_WORKER_MEMORY", psky.WORKER_BASE_MEMORY + points * psky.POINT_BYTES // 4)
+    las = laspy.LasData(laspy.LasHeader(point_format=6, version="1.4"))
+    rng = np.random.default_rng(19)
+    las.x = rng.random(points) * 1000
+    las.y = rng.random(points) * 1000
+    las.z = rng.random(points) * 100
+    filename = tmp_path / "points.laz"
+    las.write(filename)
+    with psky.WorkerPool(1) as pool:
+        octree = pool.submit(psky.write_copc, str(filename), "0000").result()
+    assert octree["points"] == points
+    assert psky.read_las_header(filename)["system_id"] == "0000"
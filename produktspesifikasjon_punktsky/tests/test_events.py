@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import shutil
+import signal
+
+import pytest
+
+pytest.importorskip("pdal")
+import psky_asprs_las_tools as psky
+
+# One sample of the text exposition format: name{label="value",...} value
+SAMPLE = re.compile(r'^([a-z_]+)\{([a-z_]+="[^"\\\n]*"(?:,[a-z_]+="[^"\\\n]*")*)\} (NaN|-?[0-9.]+(?:e[+-]?[0-9]+)?)$')
+
+def file_metrics(points=1000, seconds=2.0):
+    return {"seconds": seconds, "cpu_seconds": seconds, "peak_rss": 123, "points_in": points,
+            "points_out": points, "bytes_in": 100, "bytes_out": 80}
+
+def read_events(events):
+    return [json.loads(line) for line in events.read_text().splitlines()]
+
+def parse_prometheus(filename):
+    # {metric: [(labels, value)]}, checking every metric has HELP and TYPE gauge before its samples
+    metrics = dict()
+    described = set()
+    for line in filename.read_text().splitlines():
+        if line.startswith("# HELP "):
+            described.add(line.split()[2])
+            continue
+        if line.startswith("# TYPE "):
+            assert line.split()[2] in described and line.split()[3] == "gauge"
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        assert name in described
+        metrics.setdefault(name, []).append((dict(re.findall(r'([a-z_]+)="([^"]*)"', labels)), float(value)))
+    return metrics
+
+def test_events(tmp_path):
+    events = tmp_path / psky.EVENTS_NAME
+    metrics = psky.BatchMetrics("converted", {"a.las": 100, "b.las": 100, "c.las": 100}, events)
+    metrics.started("a.las", 11)
+    metrics.started("b.las", 12)
+    metrics.started("c.las", 13)
+    metrics.finished("a.las", file_metrics())
+    metrics.failed("b.las", RuntimeError("bad header"))
+    metrics.failed("c.las", psky.WorkerDied(13, -9))
+    records = read_events(events)
+    assert [(record["event"], record["file"]) for record in records] == [
+        ("start", "a.las"), ("start", "b.las"), ("start", "c.las"), ("end", "a.las"), ("end", "b.las"), ("end", "c.las"),
+    ]
+    assert all(record["action"] == "converted" and isinstance(record["time"], float) for record in records)
+    assert records[0]["pid"] == 11 and records[0]["bytes_in"] == 100
+    assert {key: records[3][key] for key in file_metrics()} == file_metrics()
+    assert records[3]["status"] == "ok"
+    assert (records[4]["status"], records[4]["exitcode"], records[4]["error"]) == ("error", None, "bad header")
+    assert (records[5]["status"], records[5]["exitcode"]) == ("died", -9)
+    assert metrics.status == {"ok": 1, "error": 1, "died": 1}
+    assert metrics.points == 1000 and not metrics.running
+
+def test_no_events_file(tmp_path):
+    metrics = psky.BatchMetrics("converted", {"a.las": 100})
+    metrics.started("a.las", 11)
+    metrics.finished("a.las", file_metrics())
+    assert list(tmp_path.iterdir()) == []
+
+def test_prometheus(tmp_path):
+    prometheus = tmp_path / "psky.prom"
+    metrics = psky.BatchMetrics("converted", {"a.las": 100, "dir/b.las": 300}, prometheus=prometheus)
+    metrics.update()
+    before = parse_prometheus(prometheus)
+    assert before["psky_files"] == [({"action": "converted"}, 2)]
+    assert before["psky_eta_seconds"] == [({"action": "converted"}, pytest.approx(float("nan"), nan_ok=True))]
+    assert "psky_worker_file_seconds" not in before
+
+    metrics.started("a.las", 11)
+    metrics.started("dir/b.las", 12)
+    metrics.finished("a.las", file_metrics(points=5000))
+    metrics.update(final=True)
+    after = parse_prometheus(prometheus)
+    assert sorted((labels["status"], value) for labels, value in after["psky_files_done"]) == [
+        ("died", 0), ("error", 0), ("ok", 1),
+    ]
+    assert after["psky_points_done"] == [({"action": "converted"}, 5000)]
+    assert after["psky_points_per_second"][0][1] > 0
+    assert after["psky_eta_seconds"][0][1] >= 0
+    assert [labels for labels, _ in after["psky_worker_file_seconds"]] == [
+        {"action": "converted", "pid": "12", "file": "b.las"},
+    ]
+    assert not os.path.exists(f"{prometheus}.part")
+
+def copy(ifile, ofile):
+    shutil.copyfile(ifile, ofile)
+
+def die(ifile, ofile):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def test_run_batch_events(tmp_path):
+    jobs = dict()
+    for n in range(3):
+        ifile = tmp_path / f"{n}.las"
+        ifile.write_bytes(bytes(100 + n))
+        jobs[ifile.as_posix()] = (ifile.as_posix(), (tmp_path / f"{n}.out").as_posix())
+    killed = next(iter(jobs))
+    events = tmp_path / psky.EVENTS_NAME
+    outcome = psky.run_batch(copy, jobs, "copied", workers=2, events=events, routes={killed: die})
+    assert isinstance(outcome[killed], psky.WorkerDied)
+    records = read_events(events)
+    ends = {record["file"]: record for record in records if record["event"] == "end"}
+    assert sorted(ends) == sorted(jobs)
+    assert ends[killed]["status"] == "died" and ends[killed]["exitcode"] == -signal.SIGKILL
+    assert all(ends[ifile]["status"] == "ok" and ends[ifile]["bytes_out"] == os.path.getsize(ifile)
+               for ifile in jobs if ifile != killed)
+    # A worker killed right away can die before its start message is flushed from its queue
+    for ifile in jobs:
+        events_of = [record["event"] for record in records if record["file"] == ifile]
+        if ifile == killed:
+            assert events_of in (["start", "end"], ["end"])
+        else:
+            assert events_of == ["start", "end"]
@@ -0,0 +1,81 @@
+import struct
+
+import pytest
+
+pytest.importorskip("pdal")
+pytest.importorskip("lazrs")
+laspy = pytest.importorskip("laspy")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+LASZIP_CHUNK = 50_000
+
+def write_laz(filename, count, seed=0):
+    las = laspy.LasData(laspy.LasHeader(point_format=6, version="1.4"))
+    rng = np.random.default_rng(seed)
+    las.x = rng.random(count) * 1000
+    las.y = rng.random(count) * 1000
+    las.z = rng.random(count) * 100
+    las.intensity = np.arange(count) % 65536
+    las.write(filename)
+    return filename
+
+def table(filename):
+    return psky.read_chunk_table(filename, psky.read_las_header(filename))
+
+def test_fixed_chunk_size(tmp_path):
+    filename = write_laz(tmp_path / "fixed.laz", 120_000)
+    header = psky.read_las_header(filename)
+    chunks = table(filename)
+    assert chunks["chunk_size"] == LASZIP_CHUNK
+    assert chunks["counts"] == [50_000, 50_000, 20_000]
+    assert sum(chunks["sizes"]) == chunks["table_offset"] - header["point_offset"] - 8
+
+def test_deferred_table_offset(tmp_path):
+    # Writers that cannot seek back write -1 and the offset in the last 8 bytes
+    filename = write_laz(tmp_path / "fixed.laz", 120_000)
+    expected = table(filename)
+    data = bytearray(filename.read_bytes())
+    at = psky.read_las_header(filename)["point_offset"]
+    offset = struct.unpack_from("<q", data, at)[0]
+    struct.pack_into("<q", data, at, -1)
+    deferred = tmp_path / "deferred.laz"
+    deferred.write_bytes(bytes(data) + struct.pack("<q", offset))
+    assert table(deferred) == expected
+
+def test_stitch_round_trip_variable_chunks(tmp_path):
+    # Parts whose last chunk is not full give variable sized chunks once stitched
+    parts = [write_laz(tmp_path / f"part{i}.laz", count, seed=i) for i, count in enumerate((70_000, 30_000, 55_000))]
+    stitched = tmp_path / "stitched.laz"
+    psky.stitch_laz(parts, stitched)
+
+    chunks = table(stitched)
+    assert chunks["chunk_size"] == psky.LASZIP_VARIABLE_CHUNKS
+    assert chunks["counts"] == [50_000, 20_000, 30_000, 50_000, 5_000]
+    expected = np.concatenate([laspy.read(part).points.array for part in parts])
+    assert np.array_equal(laspy.read(stitched).points.array, expected)
+
+    # A variable sized table stitched again, and split at chunk boundaries
+    again = tmp_path / "again.laz"
+    psky.stitch_laz([stitched, parts[0]], again)
+    assert table(again)["counts"] == chunks["counts"] + [50_000, 20_000]
+    ranges = psky.split_points(str(again), 3)
+    assert sum(count for _, count in ranges) == len(expected) + 70_000
+    assert all(start in np.cumsum([0] + table(again)["counts"]) for start, _ in ranges)
+
+def test_stitch_keeps_fixed_chunks_when_full(tmp_path):
+    parts = [write_laz(tmp_path / f"part{i}.laz", count, seed=i) for i, count in enumerate((100_000, 20_000))]
+    stitched = tmp_path / "stitched.laz"
+    psky.stitch_laz(parts, stitched)
+    assert table(stitched)["chunk_size"] == LASZIP_CHUNK
+    assert table(stitched)["counts"] == [50_000, 50_000, 20_000]
+    assert laspy.read(stitched).header.point_count == 120_000
+
+def test_corrupt_chunk_table(tmp_path):
+    filename = write_laz(tmp_path / "fixed.laz", 1000)
+    header = psky.read_las_header(filename)
+    data = bytearray(filename.read_bytes())
+    struct.pack_into("<L", data, table(filename)["table_offset"], 7)  # Unknown table version
+    filename.write_bytes(data)
+    with pytest.raises(ValueError):
+        psky.read_chunk_table(filename, header)
@@ -0,0 +1,82 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("pdal")
+import psky_asprs_las_tools as psky
+
+PARAMS = {"task": "copy", "version": "1.4"}
+
+def copy(ifile, ofile):
+    shutil.copyfile(ifile, ofile)
+    return os.path.getsize(ifile)
+
+@pytest.fixture
+def batch(tmp_path):
+    inputs = tmp_path / "in"
+    outputs = tmp_path / "out"
+    inputs.mkdir()
+    jobs = dict()
+    for n in range(3):
+        ifile = inputs / f"{n}.las"
+        ifile.write_bytes(bytes([n]) * (1000 + n))
+        jobs[ifile.as_posix()] = (ifile.as_posix(), (outputs / f"{n}.las").as_posix())
+    outputs.mkdir()
+    return jobs, outputs / psky.MANIFEST_NAME
+
+def run(jobs, manifest, params=PARAMS):
+    return psky.run_batch(copy, jobs, "copied", workers=1, manifest=manifest, params=params)
+
+def test_finished_files_skipped(batch):
+    jobs, manifest = batch
+    assert run(jobs, manifest) == {ifile: 1000 + n for n, ifile in enumerate(jobs)}
+    assert len(manifest.read_text().splitlines()) == 3
+    assert run(jobs, manifest) == {}
+
+def test_changed_params_redo(batch):
+    jobs, manifest = batch
+    run(jobs, manifest)
+    assert set(run(jobs, manifest, {**PARAMS, "version": "1.2"})) == set(jobs)
+
+def test_changed_input_redone(batch):
+    jobs, manifest = batch
+    run(jobs, manifest)
+    # Same size and modification time, only the fingerprint tells the content changed
+    changed, grown, _ = jobs
+    stat = os.stat(changed)
+    with open(changed, "r+b") as f:
+        f.write(b"\xff")
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    with open(grown, "ab") as f:
+        f.write(b"\0")
+    assert set(run(jobs, manifest)) == {changed, grown}
+
+def test_missing_or_changed_output_redone(batch):
+    jobs, manifest = batch
+    run(jobs, manifest)
+    first, second, _ = jobs
+    os.remove(jobs[first][1])
+    with open(jobs[second][1], "ab") as f:
+        f.write(b"\0")
+    assert set(run(jobs, manifest)) == {first, second}
+
+def test_manifest_line_cut_short(batch):
+    jobs, manifest = batch
+    run(jobs, manifest)
+    lines = manifest.read_text().splitlines()
+    manifest.write_text("\n".join(lines[:-1]) + "\n" + lines[-1][:20])
+    done = psky.read_manifest(manifest)
+    assert len(done) == 2
+    assert len(run(jobs, manifest)) == 1
+
+def test_is_done(batch):
+    jobs, manifest = batch
+    run(jobs, manifest)
+    ifile, ofile = next(iter(jobs.values()))
+    key = psky.manifest_key(ifile, ofile, PARAMS)
+    entry = psky.read_manifest(manifest)[key["input"]]
+    assert entry["fingerprint"] == psky.file_fingerprint(ifile)
+    assert psky.is_done(entry, key)
+    assert not psky.is_done(None, key)
+    assert not psky.is_done(entry, {**key, "params": {**PARAMS, "task": "other"}})
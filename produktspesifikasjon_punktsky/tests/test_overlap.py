@@ -0,0 +1,108 @@
+import pytest
+
+pytest.importorskip("pdal")
+laspy = pytest.importorskip("laspy")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+CELL = 2.0
+
+def chunk(xy, flags=None, dims=("Synthetic", "KeyPoint", "Withheld")):
+    # Points as streamed by PDAL with the per-flag dimensions of the reader and the ClassFlags stream_las adds
+    xy = np.asarray(xy, dtype=float)
+    dtype = [("X", "f8"), ("Y", "f8"), *((dim, "u1") for dim in dims), ("ClassFlags", "u1")]
+    points = np.zeros(len(xy), dtype=dtype)
+    points["X"], points["Y"] = xy.T
+    for dim, values in (flags or dict()).items():
+        points[dim] = values
+    return points
+
+def cells(*xy):
+    xy = np.asarray(xy, dtype=float)
+    return np.unique(psky.grid_cells(xy[:, 0], xy[:, 1], CELL))
+
+def test_grid_cells():
+    x = np.array([0.0, 1.99, 2.0, -0.01, -2.0, -2.01, 1e6])
+    y = np.array([0.0, 0.0, 0.0, 0.0, 1.99, 3.0, -1e6])
+    keys = psky.grid_cells(x, y, CELL)
+    assert keys[0] == keys[1] != keys[2]
+    assert keys[3] == keys[4] != keys[0]
+    assert len(set(keys.tolist())) == 5
+    # Column in the high 32 bits, row in the low 32 bits
+    assert keys[5] >> 32 == -2 and keys[5] & 0xFFFFFFFF == 1
+    assert keys[6] >> 32 == 500000 and ((keys[6] & 0xFFFFFFFF) ^ 0x80000000) - 0x80000000 == -500000
+
+def test_overlap_cells():
+    a, b, c, d = cells((0, 0)), cells((10, 0)), cells((20, 0)), cells((-30, -30))
+    strips = {1: np.union1d(a, b), 2: np.union1d(b, c), 3: np.union1d(c, d), 4: a}
+    assert psky.overlap_cells(strips).tolist() == sorted(np.concatenate([a, b, c]).tolist())
+    assert psky.overlap_cells({1: np.union1d(a, b)}).tolist() == []
+    empty = psky.overlap_cells(dict())
+    assert empty.dtype == np.int64 and not len(empty)
+
+def test_flag_overlap_keeps_flags():
+    points = chunk(
+        [(0.5, 0.5), (1.5, 1.0), (3.0, 0.5), (100.0, 100.0), (-0.5, 0.5)],
+        {"Synthetic": [1, 0, 1, 0, 0], "KeyPoint": [0, 1, 0, 0, 1], "Withheld": [1, 0, 0, 1, 0]},
+    )
+    psky.flag_overlap(points, cells((0, 0), (100, 100)), CELL)
+    assert points["ClassFlags"].tolist() == [0x1 | 0x4 | 0x8, 0x2 | 0x8, 0x1, 0x4 | 0x8, 0x2]
+
+def test_flag_overlap_without_cells_keeps_flags():
+    points = chunk([(0, 0), (5, 5)], {"Synthetic": [1, 0], "Withheld": [0, 1]})
+    psky.flag_overlap(points, np.empty(0, dtype=np.int64), CELL)
+    assert points["ClassFlags"].tolist() == [0x1, 0x4]
+
+def test_flag_overlap_last_cell():
+    # Keys past the last overlap cell are looked up at the end of the array
+    points = chunk([(10, 10), (11, 11), (50, 50)])
+    psky.flag_overlap(points, cells((-10, -10), (10, 10)), CELL)
+    assert points["ClassFlags"].tolist() == [0x8, 0x8, 0]
+
+def test_flag_overlap_overlap_dimension():
+    # PDAL versions with an Overlap dimension of their own, a delivered overlap flag is kept
+    points = chunk([(0, 0), (5, 5), (9, 9)], {"Overlap": [0, 1, 0]},
+                   dims=("Synthetic", "KeyPoint", "Withheld", "Overlap"))
+    psky.flag_overlap(points, cells((0, 0)), CELL)
+    assert points["Overlap"].tolist() == [1, 1, 0]
+    assert points["ClassFlags"].tolist() == [0x8, 0x8, 0]
+
+def test_flag_overlap_delivered_class_flags():
+    # A ClassFlags dimension read from the file is kept as it is
+    points = chunk([(0, 0), (5, 5)], {"ClassFlags": [0x1, 0x6]}, dims=())
+    psky.flag_overlap(points, cells((5, 5)), CELL)
+    assert points["ClassFlags"].tolist() == [0x1, 0x6 | 0x8]
+
+def write_strips(filename, strips):
+    # strips = {PointSourceId: [(x, y)]}, with Synthetic and Withheld set on every other point
+    xy = np.concatenate([np.asarray(points, dtype=float) for points in strips.values()])
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.scales = [0.01, 0.01, 0.01]
+    las = laspy.LasData(header)
+    las.x, las.y = xy.T
+    las.z = np.zeros(len(xy))
+    las.point_source_id = np.repeat(list(strips), [len(points) for points in strips.values()])
+    las.synthetic = np.arange(len(xy)) % 2
+    las.withheld = np.arange(len(xy)) % 2
+    las.write(filename)
+    return filename.as_posix()
+
+def test_strip_cells_and_flag_overlap(tmp_path):
+    ifile = write_strips(tmp_path / "in.las", {
+        1: [(0.5, 0.5), (10.5, 0.5), (30.5, 0.5)],
+        2: [(1.5, 1.5), (20.5, 0.5)],
+        3: [(20.5, 1.5), (40.5, 0.5)],
+    })
+    strips = psky.strip_cells(ifile, CELL)
+    assert {source: keys.tolist() for source, keys in strips.items()} == {
+        1: cells((0, 0), (10, 0), (30, 0)).tolist(),
+        2: cells((0, 0), (20, 0)).tolist(),
+        3: cells((20, 0), (40, 0)).tolist(),
+    }
+    overlap = tmp_path / psky.OVERLAP_CELLS_NAME
+    np.save(overlap, psky.overlap_cells(strips))
+    psky.psky_flag_overlap(ifile, (tmp_path / "out.laz").as_posix(), overlap.as_posix(), CELL)
+    out = laspy.read(tmp_path / "out.laz")
+    assert out.overlap.astype(int).tolist() == [1, 0, 0, 1, 1, 1, 0]
+    assert out.synthetic.astype(int).tolist() == [0, 1, 0, 1, 0, 1, 0]
+    assert out.withheld.astype(int).tolist() == [0, 1, 0, 1, 0, 1, 0]
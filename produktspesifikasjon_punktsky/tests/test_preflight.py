@@ -0,0 +1,99 @@
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pdal")
+laspy = pytest.importorskip("laspy")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+EPSG = "EPSG:25832"
+WKT = 'PROJCS["ETRS89 / UTM zone 32N",AUTHORITY["EPSG","25832"]]'
+SENSOR = "psky sensor"
+
+def write_las(filename, version="1.4", point_format=6, wkt=WKT, system_id=SENSOR):
+    header = laspy.LasHeader(point_format=point_format, version=version)
+    header.system_identifier = system_id
+    if wkt is not None:
+        header.vlrs.append(laspy.vlrs.known.WktCoordinateSystemVlr(wkt))
+    las = laspy.LasData(header)
+    las.x = np.arange(10.0)
+    las.y = np.arange(10.0)
+    las.z = np.zeros(10)
+    las.write(filename)
+    return filename.as_posix()
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    # The WKT PDAL writes for EPSG, cached as srs_wkt caches it in the worker
+    monkeypatch.setitem(psky.SRS_WKT, EPSG, WKT)
+    (tmp_path / "out").mkdir()
+    garbage = tmp_path / "garbage.las"
+    garbage.write_bytes(b"LASF" + bytes(50))
+    inputs = {
+        "tagged": write_las(tmp_path / "tagged.laz"),
+        "uncompressed": write_las(tmp_path / "uncompressed.las"),
+        "other_srs": write_las(tmp_path / "other_srs.laz", wkt='PROJCS["ETRS89 / UTM zone 33N"]'),
+        "no_srs": write_las(tmp_path / "no_srs.laz", wkt=None),
+        "other_system": write_las(tmp_path / "other_system.laz", system_id="other"),
+        "las12": write_las(tmp_path / "las12.las", version="1.2", point_format=1),
+        "laz12": write_las(tmp_path / "laz12.laz", version="1.2", point_format=1),
+        "garbage": garbage.as_posix(),
+        "missing": (tmp_path / "missing.las").as_posix(),
+    }
+    jobs = {
+        ifile: (ifile, (tmp_path / "out" / name).as_posix(), EPSG, SENSOR) for name, ifile in inputs.items()
+    }
+    # Converted in place
+    same = write_las(tmp_path / "out" / "same.laz")
+    jobs[same] = (same, same, EPSG, SENSOR)
+    return jobs
+
+def routes(jobs, side_products=False):
+    found = psky.preflight(jobs, EPSG, SENSOR, side_products, workers=2)
+    return {Path(ifile).stem: route for ifile, route in found.items()}
+
+def test_routes(jobs):
+    assert routes(jobs) == {
+        "tagged": "link",
+        "uncompressed": "tag",
+        "other_srs": "tag",
+        "no_srs": "tag",
+        "other_system": "tag",
+        "las12": "convert",
+        "laz12": "convert",
+        "garbage": "convert",
+        "missing": "convert",
+        "same": "skip",
+    }
+
+def test_side_products_not_linked(jobs):
+    assert routes(jobs, True)["tagged"] == "tag"
+
+def test_copc_output_not_linked_from_laz(jobs, monkeypatch):
+    monkeypatch.setattr(psky, "COPC_OUTPUT", True)
+    assert routes(jobs)["tagged"] == "tag"
+
+def test_numpy_transcode(jobs, monkeypatch):
+    monkeypatch.setattr(psky, "NUMPY_TRANSCODE", True)
+    found = routes(jobs)
+    assert (found["las12"], found["laz12"]) == ("numpy", "convert")
+    # psky_12_to_14_numpy does not sort
+    monkeypatch.setattr(psky, "SORT_ORDER", "morton")
+    assert routes(jobs)["las12"] == "convert"
+
+def test_preflight_file(jobs):
+    tagged = next(ifile for ifile in jobs if ifile.endswith("tagged.laz"))
+    assert psky.preflight_file(tagged) == {
+        "version": "1.4",
+        "point_format": 6,
+        "srs": WKT,
+        "system_id": SENSOR,
+        "point_count": 10,
+        "compressed": True,
+        "copc": False,
+        "numpy": False,
+    }
+    las12 = next(ifile for ifile in jobs if ifile.endswith("las12.las"))
+    assert psky.preflight_file(las12)["numpy"]
+    assert psky.preflight_file(las12.replace("las12.las", "garbage.las")) is None
@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("pdal")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+CHUNK = 1000
+# Room for the streamed chunks and a sort run of a few thousand points besides the base
+SMALL_MEMORY = psky.WORKER_BASE_MEMORY + 2 * 3 * CHUNK * psky.POINT_BYTES + 4000 * (2 * psky.POINT_BYTES + 16)
+
+def random_points(count, seed=20):
+    rng = np.random.default_rng(seed)
+    points = np.zeros(count, dtype=[("X", "f8"), ("Y", "f8"), ("Z", "f8"), ("GpsTime", "f8")])
+    points["X"] = rng.random(count) * 1000
+    points["Y"] = rng.random(count) * 1000
+    points["GpsTime"] = np.arange(count)
+    return points
+
+def test_sort_run_leaves_room_for_streamed_chunks():
+    run_points = psky.sort_run_points(SMALL_MEMORY, CHUNK)
+    chunk_size = psky.stream_chunk_size(CHUNK, SMALL_MEMORY, sorting=True)
+    used = psky.WORKER_BASE_MEMORY + 3 * chunk_size * psky.POINT_BYTES + run_points * (2 * psky.POINT_BYTES + 16)
+    assert chunk_size == CHUNK
+    assert 0 < run_points and used <= SMALL_MEMORY
+    assert psky.sort_run_points(SMALL_MEMORY, CHUNK, pipelined=False) < psky.sort_run_points(2 * SMALL_MEMORY, CHUNK)
+
+def test_sort_run_needs_memory():
+    with pytest.raises(ValueError):
+        psky.sort_run_points(psky.WORKER_BASE_MEMORY, CHUNK)
+
+@pytest.mark.parametrize("order", ["morton", "hilbert"])
+def test_sorted_chunks_in_several_runs(tmp_path, monkeypatch, order):
+    points = random_points(20_000)
+    bounds = (0, 0, 1000, 1000)
+    keys = lambda chunk: psky.spatial_keys(chunk, order, bounds)
+    merged = []
+    merge_runs = psky.merge_runs
+    monkeypatch.setattr(psky, "merge_runs", lambda runs, *args: merged.append(len(runs)) or merge_runs(runs, *args))
+
+    run_points = psky.sort_run_points(SMALL_MEMORY, CHUNK)
+    chunks = (points[first:first + CHUNK] for first in range(0, len(points), CHUNK))
+    out = list(psky.sorted_chunks(chunks, keys, CHUNK, run_points, tmp_path))
+
+    assert merged and merged[0] > 1
+    assert all(len(chunk) <= CHUNK for chunk in out)
+    result = np.concatenate(out)
+    # The same points, in key order and stable (acquisition order among equal keys)
+    expected = points[np.argsort(keys(points), kind="stable")]
+    assert np.array_equal(result, expected)
+    assert list(tmp_path.iterdir()) == []
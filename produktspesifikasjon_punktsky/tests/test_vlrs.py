@@ -0,0 +1,64 @@
+import base64
+
+import pytest
+
+pytest.importorskip("pdal")
+laspy = pytest.importorskip("laspy")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+CUSTOM = ("psky_test", 4711, b"kept across conversions")
+LARGE = ("psky_test", 4712, bytes(range(256)) * 300)
+
+def write_las(filename, version, point_format, vlrs=(), evlrs=()):
+    header = laspy.LasHeader(point_format=point_format, version=version)
+    header.vlrs.extend(laspy.VLR(user_id, record_id, record_data=data) for user_id, record_id, data in vlrs)
+    las = laspy.LasData(header)
+    rng = np.random.default_rng(1)
+    las.x = rng.random(1000) * 100
+    las.y = rng.random(1000) * 100
+    las.z = rng.random(1000) * 10
+    las.classification = np.full(1000, 2)
+    if evlrs:
+        las.evlrs = laspy.vlrs.vlrlist.VLRList(
+            [laspy.VLR(user_id, record_id, record_data=data) for user_id, record_id, data in evlrs]
+        )
+    las.write(filename)
+    return filename
+
+def records(filename):
+    return {(user_id, record_id): payload for user_id, record_id, payload, _ in
+            psky.read_las_vlrs(filename, psky.read_las_header(filename))}
+
+def test_forward_vlrs_keeps_custom_records(tmp_path):
+    filename = write_las(tmp_path / "in.las", "1.4", 6, vlrs=[CUSTOM, ("LASF_Projection", 2112, b"WKT\0")],
+                         evlrs=[LARGE, (psky.COPC_USER_ID, psky.COPC_HIERARCHY_RECORD_ID, bytes(32))])
+    header = psky.read_las_header(filename)
+    forwarded = {(vlr["user_id"], vlr["record_id"]): base64.b64decode(vlr["data"])
+                 for vlr in psky.forward_vlrs(filename, header)}
+    assert forwarded == {CUSTOM[:2]: CUSTOM[2], LARGE[:2]: LARGE[2]}
+    # LAS 1.2 has no EVLRs, a record larger than a VLR can hold is left out
+    assert [(vlr["user_id"], vlr["record_id"]) for vlr in psky.forward_vlrs(filename, header, evlrs=False)] == [
+        CUSTOM[:2]
+    ]
+
+def test_12_to_14_keeps_custom_vlr(tmp_path):
+    ifile = write_las(tmp_path / "in.las", "1.2", 3, vlrs=[CUSTOM])
+    psky.psky_12_to_14(str(ifile), str(tmp_path / "out.laz"), "EPSG:5972", "0000")
+    assert records(tmp_path / "out.laz")[CUSTOM[:2]] == CUSTOM[2]
+
+def test_14_to_12_keeps_custom_vlr(tmp_path):
+    ifile = write_las(tmp_path / "in.las", "1.4", 6, vlrs=[CUSTOM], evlrs=[CUSTOM[:1] + (4713, b"small EVLR")])
+    psky.psky_14_to_12(str(ifile), str(tmp_path / "out.laz"))
+    kept = records(tmp_path / "out.laz")
+    assert kept[CUSTOM[:2]] == CUSTOM[2]
+    assert kept[("psky_test", 4713)] == b"small EVLR"
+
+def test_flag_overlap_keeps_custom_vlr_and_evlr(tmp_path):
+    ifile = write_las(tmp_path / "in.las", "1.4", 6, vlrs=[CUSTOM], evlrs=[LARGE])
+    cells = tmp_path / "cells.npy"
+    np.save(cells, np.empty(0, dtype=np.int64))
+    psky.psky_flag_overlap(str(ifile), str(tmp_path / "out.laz"), str(cells))
+    kept = records(tmp_path / "out.laz")
+    assert kept[CUSTOM[:2]] == CUSTOM[2]
+    assert kept[LARGE[:2]] == LARGE[2]
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("pdal")
+resource = pytest.importorskip("resource")
+np = pytest.importorskip("numpy")
+import psky_asprs_las_tools as psky
+
+if not hasattr(resource, "RLIMIT_DATA"):
+    pytest.skip("RLIMIT_DATA not supported", allow_module_level=True)
+
+GIB = 1024**3
+
+def allocate(nbytes, lifted):
+    # Address space only, the pages are never touched
+    if lifted:
+        with psky.worker_memory_lifted():
+            return len(np.empty(nbytes, dtype=np.uint8))
+    return len(np.empty(nbytes, dtype=np.uint8))
+
+def limits():
+    return resource.getrlimit(resource.RLIMIT_DATA)
+
+def test_worker_memory_is_capped_outside_in_memory_execution():
+    with psky.WorkerPool(1) as pool:
+        capped = pool.submit(allocate, 2 * psky.MAX_WORKER_MEMORY, False)
+        lifted = pool.submit(allocate, 2 * psky.MAX_WORKER_MEMORY, True)
+        after = pool.submit(limits)
+        with pytest.raises(RuntimeError, match="MemoryError"):
+            capped.result()
+        assert lifted.result() == 2 * psky.MAX_WORKER_MEMORY
+        assert after.result()[0] == psky.MAX_WORKER_MEMORY
+
+def test_soft_limit_only(monkeypatch):
+    # The hard limit stays so the ceiling can be lifted again in the same process
+    monkeypatch.setattr(resource, "setrlimit", lambda kind, limit: calls.append(limit))
+    calls = []
+    psky.limit_worker_memory(GIB)
+    assert calls == [(GIB, limits()[1])]
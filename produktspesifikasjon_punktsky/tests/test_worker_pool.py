@@ -0,0 +1,68 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("pdal")
+import psky_asprs_las_tools as psky
+
+def pid(delay=0):
+    time.sleep(delay)
+    return os.getpid()
+
+def fail():
+    raise ValueError("task failed")
+
+def die():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+def shutdown_within(pool, seconds=30):
+    closer = threading.Thread(target=pool.shutdown, daemon=True)
+    closer.start()
+    closer.join(seconds)
+    return not closer.is_alive()
+
+def test_results_and_errors():
+    with psky.WorkerPool(2) as pool:
+        results = [pool.submit(pow, 2, n) for n in range(10)]
+        failed = pool.submit(fail)
+        assert [future.result(timeout=30) for future in results] == [2**n for n in range(10)]
+        with pytest.raises(RuntimeError, match="task failed"):
+            failed.result(timeout=30)
+
+def test_worker_killed_mid_task():
+    pool = psky.WorkerPool(2)
+    killed = pool.submit(die)
+    others = [pool.submit(pid, 0.05) for _ in range(6)]
+    with pytest.raises(psky.WorkerDied) as died:
+        killed.result(timeout=30)
+    assert died.value.exitcode == -signal.SIGKILL
+    assert all(future.result(timeout=30) for future in others)
+    assert shutdown_within(pool)
+
+def test_worker_killed_before_starting_its_task():
+    # Killed right after the task is handed over, before the worker reports it started
+    started = []
+    pool = psky.WorkerPool(1, on_start=lambda future, pid: started.append(pid))
+    worker = next(iter(pool.workers.values()))
+    os.kill(worker.process.pid, signal.SIGSTOP)
+    held = pool.submit(pid)
+    os.kill(worker.process.pid, signal.SIGKILL)
+    with pytest.raises(psky.WorkerDied):
+        held.result(timeout=30)
+    assert not started
+    # The replacement worker takes the next task
+    assert pool.submit(pid).result(timeout=30) != worker.process.pid
+    assert shutdown_within(pool)
+
+def test_workers_replaced_after_max_files():
+    with psky.WorkerPool(1, max_files=2) as pool:
+        pids = [pool.submit(pid).result(timeout=30) for _ in range(6)]
+    assert len(set(pids)) == 3
+
+def test_workers_replaced_after_max_bytes():
+    with psky.WorkerPool(1, max_bytes=100) as pool:
+        pids = [pool.submit(pid, size=60).result(timeout=30) for _ in range(4)]
+    assert len(set(pids)) == 2